@@ -1,11 +1,15 @@
 import streamlit as st
 import pandas as pd
-import networkx as nx
-import matplotlib.pyplot as plt
 import numpy as np
-from PIL import Image
 import io
 import base64
+import os
+import sys
+
+# Streamlit re-executes this script on every interaction, so networkx, PIL and matplotlib are imported where
+# they are used instead of here (modules are cached after the first import, but only if something imports them)
+# graph/ holds the shared pipeline modules
+sys.path.append(os.path.join(os.path.dirname(__file__), "graph"))
 
 # Set page config
 st.set_page_config(layout="wide", page_title="Social Media Analysis Dashboard")
@@ -147,6 +151,7 @@ def load_sample_data():
     entity_df = pd.DataFrame(entity_data)
     
     # Create graph data
+    import networkx as nx
     G = nx.barabasi_albert_graph(20, 3)  # Generate a random graph
     
     return people, content_df, entity_df, G
@@ -160,40 +165,55 @@ col1, col2 = st.columns([2, 1])
 with col1:
     st.markdown("<div class='sub-header'>Network Graph</div>", unsafe_allow_html=True)
     
-    # Create a placeholder for the graph
-    graph_placeholder = st.empty()
-    
-    # Function to plot the graph
-    def plot_graph():
-        fig, ax = plt.subplots(figsize=(10, 8))
-        pos = nx.spring_layout(graph, seed=42)
-        
-        # Color nodes by suspicion score
-        node_colors = []
-        for i in range(1, 21):
-            score = people_df[people_df['person_id'] == i]['suspicion_score'].values[0]
-            if score > 0.7:
-                node_colors.append('red')
-            elif score > 0.4:
-                node_colors.append('orange')
-            else:
-                node_colors.append('green')
-        
-        nx.draw_networkx(graph, pos, with_labels=True, 
-                         node_color=node_colors, 
-                         node_size=500, 
-                         font_size=10, 
-                         font_weight='bold',
-                         edge_color='gray', 
-                         width=1.0,
-                         alpha=0.8)
-        
-        plt.axis('off')
-        return fig
-    
-    # Display the graph
-    graph_fig = plot_graph()
-    graph_placeholder.pyplot(graph_fig)
+    # Layout and drawing run in a worker pool; the page shows the last finished render meanwhile
+    from rendering import RenderCache, render_key, render_network_png, score_colours
+
+    @st.cache_resource
+    def get_render_cache():
+        return RenderCache()
+
+    @st.cache_data
+    def graph_version(edges):
+        return render_key("sample", np.asarray(edges))
+
+    graph_nodes = list(graph.nodes())
+    graph_edges = list(graph.edges())
+    # node i is person i + 1, colours straight from the score array
+    node_scores = people_df.set_index('person_id')['suspicion_score'].reindex(np.asarray(graph_nodes) + 1).to_numpy()
+    node_colours = score_colours(node_scores)
+    render_cache = get_render_cache()
+    current_render = render_key(graph_version(graph_edges), node_colours)
+    render_cache.submit(current_render, render_network_png, graph_nodes, graph_edges, node_colours.tolist())
+
+    # Poll only while this render is running; once it finishes, one full rerun redefines the fragment without run_every
+    rendering = render_cache.result(current_render) is None and render_cache.error(current_render) is None
+
+    @st.fragment(run_every=0.5 if rendering else None)
+    def graph_panel():
+        png = render_cache.result(current_render)
+        if png is not None:
+            st.session_state["last_graph_render"] = png
+        elif render_cache.error(current_render) is not None:
+            st.error(f"Graph rendering failed: {render_cache.error(current_render)}")
+        last = st.session_state.get("last_graph_render")
+        if last is not None:
+            st.image(last, use_container_width=True)
+        if png is None and render_cache.error(current_render) is None:
+            st.caption("Rendering graph...")
+        elif rendering:
+            st.rerun()
+
+    graph_panel()
+
+# Per-profile entity summaries (built with graph/entity_summaries.py), loaded once per server process
+ENTITY_SUMMARIES_DIR = "data/entity_summaries"
+
+@st.cache_resource
+def load_entity_summaries(summaries_dir):
+    from entity_summaries import EntitySummaries
+    return EntitySummaries.load(summaries_dir)
+
+entity_summaries = load_entity_summaries(ENTITY_SUMMARIES_DIR) if os.path.isdir(ENTITY_SUMMARIES_DIR) else None
 
 # Entity extraction panel (right panel)
 with col2:
@@ -204,20 +224,25 @@ with col2:
     species_placeholder = st.empty()
     mentioned_placeholder = st.empty()
     
-    # Initially show aggregated data
-    all_locations = []
-    all_species = []
-    for _, row in entity_df.iterrows():
-        all_locations.extend(row['locations'])
-        all_species.extend(row['species'])
-    
-    # Get top locations and species
-    location_counts = pd.Series(all_locations).value_counts()
-    species_counts = pd.Series(all_species).value_counts()
-    
-    # Use head() to get top 5 items, then format for display
-    top_locations = location_counts.head(5)
-    top_species = species_counts.head(5)
+    if entity_summaries is not None:
+        # Totals over every post, precomputed instead of exploding the entity lists on each rerun
+        top_locations = entity_summaries.top("location", 5)
+        top_species = entity_summaries.top("species", 5)
+    else:
+        # Initially show aggregated data
+        all_locations = []
+        all_species = []
+        for _, row in entity_df.iterrows():
+            all_locations.extend(row['locations'])
+            all_species.extend(row['species'])
+        
+        # Get top locations and species
+        location_counts = pd.Series(all_locations).value_counts()
+        species_counts = pd.Series(all_species).value_counts()
+        
+        # Use head() to get top 5 items, then format for display
+        top_locations = location_counts.head(5)
+        top_species = species_counts.head(5)
     
     location_placeholder.markdown("<div class='card'><b>Top Locations:</b><br>" + 
                                  "<br>".join([f"{loc} ({count})" for loc, count in zip(top_locations.index, top_locations.values)]) +
@@ -331,6 +356,7 @@ with person_col2:
                     (content['content_id'] * 47) % 255
                 )
                 # Create a colored rectangle as a placeholder image
+                from PIL import Image
                 img = Image.new('RGB', (300, 200), color=color)
                 
                 # Add a watermark with content ID for better visual identification
@@ -371,6 +397,63 @@ with person_col2:
             </div>
             """, unsafe_allow_html=True)
 
+# Investigation view over the shared graph server (graph/graph_server.py), every session queries the same process
+if os.environ.get("ETHACK_GRAPH_SERVER"):
+    from graph_server import GraphClient
+    from plotly_functions import plot_profile_traffic, plot_subgraph_in_plotly, select_subgraph_with_single_node
+
+    graph_client = GraphClient(os.environ["ETHACK_GRAPH_SERVER"])
+    st.markdown("<div class='sub-header'>Profiles by Risk</div>", unsafe_allow_html=True)
+    # Only the columns this snapshot has (traffic_likelihood always): risk_score and suspicious_probability need
+    # suspicious seeds, hybrid_score (graph/hybrid_model.py) and the structural features a snapshot built after they were added
+    node_columns = graph_client.info().get("node_columns", [])
+    rank_columns = [column for column in ["risk_score", "suspicious_probability", "traffic_likelihood", "hybrid_score",
+                                          "triangles", "clustering", "core_number", "ego_density"] if column in node_columns]
+    risk_column = st.selectbox("Rank by:", rank_columns)
+    top_profiles = graph_client.top_k(risk_column, k=50)
+    st.dataframe(top_profiles, height=250, use_container_width=True, hide_index=True)
+    if len(top_profiles):
+        profile_id = st.selectbox("Explore profile:", top_profiles["id"].tolist())
+        ego_col, timeline_col = st.columns([2, 1])
+        with ego_col:
+            st.plotly_chart(plot_subgraph_in_plotly(select_subgraph_with_single_node(graph_client, profile_id)), use_container_width=True)
+        with timeline_col:
+            st.plotly_chart(plot_profile_traffic(profile_id, client=graph_client), use_container_width=True)
+        if entity_summaries is not None:
+            # distinct is a HyperLogLog estimate and top_counts Count-Min estimates where approximate is set
+            st.dataframe(entity_summaries.profile(profile_id), use_container_width=True, hide_index=True)
+
+    # Whole-network view: the server returns at most max_nodes nodes for the viewport, dense areas as tiles
+    if graph_client.info().get("lod"):
+        from plotly_functions import plot_viewport_in_plotly
+
+        st.markdown("<div class='sub-header'>Network Explorer</div>", unsafe_allow_html=True)
+        x_col, y_col = st.columns(2)
+        with x_col:
+            x0, x1 = st.slider("Horizontal range", 0.0, 1.0, (0.0, 1.0), step=0.01)
+        with y_col:
+            y0, y1 = st.slider("Vertical range", 0.0, 1.0, (0.0, 1.0), step=0.01)
+        view = graph_client.viewport(x0, y0, x1, y1, max_nodes=2000)
+        st.caption(f"Zoom level {view['zoom']}: {len(view['nodes'])} profiles, {len(view['tiles'])} density tiles")
+        st.plotly_chart(plot_viewport_in_plotly(view), use_container_width=True)
+
+# Similar posts search (index built with graph/similarity_search.py)
+POST_INDEX_DIR = "data/post_index"
+
+@st.cache_resource
+def load_post_index(index_dir):
+    from similarity_search import IVFIndex
+    return IVFIndex.load(index_dir)
+
+if os.path.isdir(POST_INDEX_DIR):
+    from similarity_search import similar_posts
+
+    st.markdown("<div class='sub-header'>Similar Posts</div>", unsafe_allow_html=True)
+    similar_query = st.text_input("Find posts similar to:")
+    if similar_query:
+        st.dataframe(similar_posts(load_post_index(POST_INDEX_DIR), similar_query, k=20),
+                     use_container_width=True, hide_index=True)
+
 # Add a footer with information
 st.markdown("---")
 st.markdown("""
@@ -13,23 +13,39 @@ def _():
 
 @app.cell
 def _():
+    import sys
+    # graph/ holds the shared pipeline modules
+    sys.path.append("graph")
+    return (sys,)
+
+
+@app.cell
+def _(sys):
     from sqlalchemy import create_engine
     import os
-    DATABASE_URL = "sqlite:///data/social_network_anonymized.db"
-    engine = create_engine(DATABASE_URL)
-    return DATABASE_URL, create_engine, engine, os
+    from db_access import connect
+    DB_FILE = "data/social_network_anonymized.db"
+    DATABASE_URL = f"sqlite:///{DB_FILE}"
+    # Connections carry the read pragmas (mmap, cache); `python graph/db_access.py prepare --db data/social_network_anonymized.db` adds the indexes
+    engine = create_engine(DATABASE_URL, creator=lambda: connect(DB_FILE))
+    return DATABASE_URL, DB_FILE, connect, create_engine, engine, os
 
 
 @app.cell
-def _(engine, mo):
-    df = mo.sql(
+def _(DB_FILE, engine, entries, mo, sys):
+    from notebook_cache import cached_query
+    # Only posts of the translated types with content, filtered in SQLite (idx_activity_type) rather than polars.
+    # Cached on disk by SQL text + DB fingerprint, so upstream re-runs read parquet instead of re-querying
+    _types = ", ".join(f"'{entry}'" for entry in entries)
+    df = cached_query(
+        "activity",
         f"""
-        select * from `Activity`
+        select * from `Activity` where type in ({_types}) and content != ''
         """,
-        output=False,
-        engine=engine
+        DB_FILE,
+        run=lambda sql: mo.sql(sql, output=False, engine=engine)
     )
-    return (df,)
+    return cached_query, df
 
 
 @app.cell
@@ -47,7 +63,16 @@ def _():
 
 
 @app.cell
-def _(df, entries, pl, translate_with_gemini):
+def _(mo):
+    # Every Gemini call sits behind this button; cached translations are shown without pressing it
+    run_llm = mo.ui.run_button(label="Call Gemini for posts without a cached translation")
+    run_llm
+    return (run_llm,)
+
+
+@app.cell
+def _(df, entries, mo, pl, run_llm, translate_with_gemini):
+    mo.stop(not run_llm.value, mo.md("Sample translation: press the button above to call Gemini"))
     df.filter(
         # filter entries with content
         (pl.col("type").is_in(entries)) & (pl.col("content") != "")
@@ -56,33 +81,8 @@ def _(df, entries, pl, translate_with_gemini):
 
 
 @app.cell
-def _(genai):
-    import enum
-    from pydantic import BaseModel
-
-    class TrafficLikelihood(enum.Enum):
-        ONE = 1
-        TWO = 2
-        THREE = 3
-        FOUR = 4
-        FIVE = 5
-
-    class SuspiciousActions(enum.Enum):
-        S = "selling"
-        B = "buying"
-        AD = "advertising"
-        HU = "hunting"
-        O = "Other suspicious action"
-
-    class Response(BaseModel):
-        translated_content: str
-        language: str
-        traffic_likelihood: int
-        species_being_mentioned: list[str]
-        location: list[str]
-        pii: list[str]
-        actions: list[SuspiciousActions]
-
+def _(genai, sys):
+    from llm_schema import TRANSLATION_MODEL, TRANSLATION_PROMPT, Response, SuspiciousActions, TrafficLikelihood, prompt_version
 
     client = genai.Client(
         vertexai=True,
@@ -90,50 +90,107 @@ def _(genai):
         location="europe-west1",
     )
 
+    # Prompt, model and schema live in llm_schema.py; prompt_version() is part of every cache key for LLM output
     def translate_with_gemini(text):
         return client.models.generate_content(
-            model='gemini-2.0-flash',
-            contents= f"""
-            Provide all the answers in as much detail as is available
-            Translate this text into English: {text}, 
-            return the language being used
-            then give it a likelihood rating of mentioning illegal animal trafficking,
-            list out any animal species in being mentioned, 
-            list out any location being mentioned,
-            list out any personal identifiable information (pii) as: `typeofPII_PII` e.g name_Jack
-            list out any suspicious actions
-            """,
+            model=TRANSLATION_MODEL,
+            contents=TRANSLATION_PROMPT.format(text=text),
             config={
                 'response_mime_type': 'application/json',
                 'response_schema': Response,
             },
         ).text
-
-    translate_with_gemini("hola, hablo español")
     return (
-        BaseModel,
         Response,
         SuspiciousActions,
+        TRANSLATION_MODEL,
+        TRANSLATION_PROMPT,
         TrafficLikelihood,
         client,
-        enum,
+        prompt_version,
         translate_with_gemini,
     )
 
 
 @app.cell
-def _(df, entries, os, pl, translate_with_gemini):
+def _(DB_FILE, df, entries, mo, os, pl, prompt_version, run_llm, sys, translate_with_gemini):
+    from notebook_cache import cached_frame, file_fingerprint
+    from post_dedup import ClusterMap, ResponseStore, translate_deduplicated
+    from structured_output import translate_rows, write_responses
+    from triage import load_triage_model, score_posts, select_for_llm
+
+    def _translate():
+        # Only runs on a cache miss, and only calls Gemini once the button has been pressed
+        mo.stop(not run_llm.value, mo.md("No cached translations for this prompt version and database: press the button to call Gemini"))
+        candidates = df.filter(
+            (pl.col("type").is_in(entries)) & (pl.col("content") != "")
+        )
+        # Local triage first: only likely-relevant posts (plus a calibration sample) go to Gemini
+        if os.path.isfile("data/triage_model.npz"):
+            _model = load_triage_model("data/triage_model.npz")
+            _forward, _ = select_for_llm(score_posts(_model, candidates["content"].to_list()), _model["threshold"])
+            candidates = candidates.filter(pl.Series(_forward))
+        translated = candidates[:500]
+        # One Gemini call per cluster of (near-)duplicate posts, fanned out to every member; the cluster map and
+        # the responses (one file per prompt version) persist in data/, so a rerun only calls for clusters it has not seen
+        _cluster_map = ClusterMap.load("data/post_clusters")
+        _clusters = _cluster_map.assign(translated["id"].to_numpy(), translated["content"].to_list())
+        _cluster_map.save("data/post_clusters")
+        # Responses are validated as they arrive; malformed ones go to the dead-letter file
+        _store = ResponseStore(f"data/llm_responses.{prompt_version()}.jsonl")
+        _rows = translate_deduplicated(translated.iter_rows(named=True), translate_with_gemini, _clusters, _store)
+        write_responses(_rows, translated.drop("content").to_arrow().schema, "translated_posts.parquet", "translated_posts_dead_letters.jsonl")
+        return pl.read_parquet("translated_posts.parquet")
+
     if os.path.isfile("data/translated_posts.parquet"):
         unnested = pl.read_parquet("data/translated_posts.parquet")
     else:
-        translated = df.filter(
-            (pl.col("type").is_in(entries)) & (pl.col("content") != "")
-        )[:500].with_columns(
-            pl.col("content").map_elements(translate_with_gemini)
+        # Keyed on the prompt/schema version and on what decides which posts are sent
+        unnested = cached_frame(
+            "translated_posts",
+            [prompt_version(), file_fingerprint(DB_FILE), file_fingerprint("data/triage_model.npz")],
+            _translate
+        )
+    return (
+        ClusterMap,
+        ResponseStore,
+        cached_frame,
+        file_fingerprint,
+        load_triage_model,
+        score_posts,
+        select_for_llm,
+        translate_deduplicated,
+        translate_rows,
+        unnested,
+        write_responses,
+    )
+
+
+@app.cell
+def _(mo):
+    mo.md(r"""## Similar posts""")
+    return
+
+
+@app.cell
+def _(mo):
+    similar_query = mo.ui.text(label="Find posts similar to:", full_width=True)
+    similar_query
+    return (similar_query,)
+
+
+@app.cell
+def _(os, pl, similar_query, sys, unnested):
+    from similarity_search import IVFIndex, similar_posts
+    similar = None
+    # index built with `python graph/similarity_search.py` and moved to data/post_index
+    if similar_query.value and os.path.isdir("data/post_index"):
+        _post_index = IVFIndex.load("data/post_index")
+        similar = pl.from_pandas(similar_posts(_post_index, similar_query.value, k=20)).join(
+            unnested.select("id", "translated_content"), on="id", how="left"
         )
-        unnested = translated.select(pl.all().exclude("content"),  pl.col("content").str.json_decode()).unnest("content")
-        unnested.write_parquet("translated_posts.parquet")
-    return translated, unnested
+    similar
+    return IVFIndex, similar, similar_posts
 
 
 @app.cell
@@ -143,25 +200,27 @@ def _(mo):
 
 
 @app.cell
-def _(engine, mo):
-    pa = mo.sql(
+def _(DB_FILE, cached_query, engine, mo):
+    pa = cached_query(
+        "profile_activity",
         f"""
-        SELECT * from `ProfileActivity`
+        SELECT profile_id, activity_id from `ProfileActivity`
         """,
-        output=False,
-        engine=engine
+        DB_FILE,
+        run=lambda sql: mo.sql(sql, output=False, engine=engine)
     )
     return (pa,)
 
 
 @app.cell
-def _(engine, mo):
-    p = mo.sql(
+def _(DB_FILE, cached_query, engine, mo):
+    p = cached_query(
+        "profiles",
         f"""
         select * from `Profiles`
         """,
-        output=False,
-        engine=engine
+        DB_FILE,
+        run=lambda sql: mo.sql(sql, output=False, engine=engine)
     )
     return (p,)
 
@@ -214,28 +273,46 @@ def _(selected):
 
 
 @app.cell
-def _(pl, result, row):
-    selected = result.filter(
-            pl.col("id") == row.value["id"]
-        ).with_columns(
-            pl.from_epoch(pl.col("timestamp"), time_unit="ms").alias("datetime")
-        )
+def _(pl, result, sys):
+    from notebook_cache import ProfileIndex
+    # result sorted by profile once per upstream change; a new table selection only slices it
+    posts_by_profile = ProfileIndex(
+        result.with_columns(pl.from_epoch(pl.col("timestamp"), time_unit="ms").alias("datetime")),
+        key="id",
+        order=["timestamp"]
+    )
+    return ProfileIndex, posts_by_profile
+
+
+@app.cell
+def _(posts_by_profile, row):
+    selected = posts_by_profile.rows(row.value["id"])
     return (selected,)
 
 
 @app.cell
-def _(pl, selected):
+def _(result, sys):
+    from entity_summaries import summarise_table
+    # Distinct counts and top entities for every profile in one bounded-memory pass over result (sketches only
+    # for profiles with very many distinct entities); the person cell below is then a lookup
+    entity_summaries = summarise_table(
+        result.select("id", "pii", "species_being_mentioned", "location").to_arrow(),
+        profile_column="id"
+    )
+    return entity_summaries, summarise_table
+
+
+@app.cell
+def _(entity_summaries, mo, pl, row, selected):
     person_info = selected.group_by(
         "name", "profile_url", "region",  
     ).agg(
-        pl.col("traffic_likelihood").sum(),
-        pl.col("pii").explode(),
-        pl.col("species_being_mentioned").explode(),
-        pl.col("location").explode()
+        pl.col("traffic_likelihood").sum()
     )
+    person_entities = pl.from_pandas(entity_summaries.profile(row.value["id"]))
 
-    person_info
-    return (person_info,)
+    mo.vstack([person_info, person_entities])
+    return person_entities, person_info
 
 
 @app.cell
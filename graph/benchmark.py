@@ -0,0 +1,152 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import networkx as nx
+import pandas as pd
+
+from create_graph import (
+    create_person_graph_with_relationship,
+    extract_data_with_query,
+    predict_with_harmonic_function,
+    seed_labels_from_traffic_likelihood,
+    select_neighbourhood_subgraph,
+)
+from enrichment_store import load_posts
+from plotly_functions import plot_subgraph_in_plotly, select_subgraph_with_single_node
+from synthetic_network import generate_social_network
+
+# End-to-end timings and peak memory for each pipeline stage on synthetic networks of increasing size.
+# Results go to JSON; pass --baseline with an earlier results file to flag regressions.
+
+DEFAULT_SCALES = [10_000, 100_000, 1_000_000]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(results, name, fn, *args, trace_memory=True, **kwargs):
+    # Runs one stage, silencing its prints, and records wall time and memory
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            output = fn(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        # ru_maxrss is in KiB on Linux, in bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == "darwin" else 1024)
+        result = {"seconds": round(seconds, 4), "max_rss_mb": round(max_rss, 1)}
+        if trace_memory:
+            result["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    results[name] = result
+    print(f"  {name:<24} {seconds:8.3f}s")
+    return output
+
+
+def _ego_node(graph, max_ego_nodes=500):
+    # Busiest node whose ego network is still small enough to lay out and plot
+    degrees = pd.Series(dict(graph.degree()))
+    degrees = degrees[degrees < max_ego_nodes]
+    return degrees.idxmax()
+
+
+def run_pipeline_benchmark(db_path, posts_path, trace_memory=True, max_ego_nodes=500):
+    stages = {}
+    people_profiles = measure(stages, "extract_profiles", extract_data_with_query, "SELECT * FROM Profiles", db_path, trace_memory=trace_memory)
+    people_connections = measure(stages, "extract_connections", extract_data_with_query, "SELECT * FROM ProfileConnection", db_path, trace_memory=trace_memory)
+    combined_data = measure(stages, "load_posts", load_posts, ["id", "profile_id", "traffic_likelihood"], store_dir=None, legacy_path=posts_path, db_path=db_path, trace_memory=trace_memory)
+    combined_data = combined_data.dropna(subset=["profile_id"]).astype({"profile_id": int})
+    graph = measure(stages, "build_graph", create_person_graph_with_relationship, people_profiles, people_connections,
+                    friends_conn=True, group_conn=True, follow_conn=True, comment_conn=True, tagged_conn=True, trace_memory=trace_memory)
+    target_nodes = set(combined_data["profile_id"]) & set(graph.nodes())
+    subgraph = measure(stages, "neighbourhood_subgraph", select_neighbourhood_subgraph, graph, target_nodes, trace_memory=trace_memory)
+    traffic_likelihood = measure(stages, "aggregate_traffic", lambda: combined_data.groupby("profile_id")[["traffic_likelihood"]].sum(), trace_memory=trace_memory)
+    # Synthetic sums are smaller than the real ones, seed on the top / bottom of the distribution instead of >= 100
+    suspicious_threshold = traffic_likelihood["traffic_likelihood"].quantile(0.99)
+    traffic_likelihood = traffic_likelihood[traffic_likelihood.index.isin(target_nodes)]
+    subgraph = measure(stages, "seed_labels", seed_labels_from_traffic_likelihood, subgraph, traffic_likelihood, suspicious_threshold, trace_memory=trace_memory)
+    subgraph = measure(stages, "harmonic_function", predict_with_harmonic_function, subgraph, traffic_likelihood, trace_memory=trace_memory)
+    ego = measure(stages, "ego_subgraph", select_subgraph_with_single_node, graph, _ego_node(graph, max_ego_nodes), trace_memory=trace_memory)
+    ego = nx.Graph(ego)
+    measure(stages, "spring_layout", nx.spring_layout, ego, trace_memory=trace_memory)
+    measure(stages, "plotly_figure", plot_subgraph_in_plotly, ego, trace_memory=trace_memory)
+    counts = {
+        "nodes": graph.number_of_nodes(),
+        "edges": graph.number_of_edges(),
+        "subgraph_nodes": subgraph.number_of_nodes(),
+        "subgraph_edges": subgraph.number_of_edges(),
+        "ego_nodes": ego.number_of_nodes(),
+    }
+    return stages, counts
+
+
+def compare_with_baseline(results, baseline, tolerance=0.2):
+    # Stages that got slower than baseline by more than `tolerance`, matched on edge count
+    baseline_runs = {run["edges"]: run for run in baseline["runs"]}
+    regressions = []
+    for run in results["runs"]:
+        previous = baseline_runs.get(run["edges"])
+        if previous is None:
+            continue
+        for stage, timing in run["stages"].items():
+            before = previous["stages"].get(stage, {}).get("seconds")
+            if before and timing["seconds"] > before * (1 + tolerance) and timing["seconds"] - before > 0.05:
+                regressions.append({"edges": run["edges"], "stage": stage, "before": before, "after": timing["seconds"]})
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the graph pipeline on synthetic social networks")
+    parser.add_argument("--edges", type=int, nargs="+", default=DEFAULT_SCALES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default="benchmark_data")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--no-trace-memory", action="store_true", help="skip tracemalloc, which slows allocation-heavy stages")
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    results = {
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "runs": [],
+    }
+    for n_edges in args.edges:
+        db_path = os.path.join(args.workdir, f"social_network_{n_edges}.db")
+        posts_path = os.path.join(args.workdir, f"translated_posts_{n_edges}.parquet")
+        print(f"{n_edges} edges")
+        generate_start = time.perf_counter()
+        if not (os.path.isfile(db_path) and os.path.isfile(posts_path)):
+            generate_social_network(db_path, posts_path, n_edges, seed=args.seed)
+        generate_seconds = time.perf_counter() - generate_start
+        stages, counts = run_pipeline_benchmark(db_path, posts_path, trace_memory=not args.no_trace_memory)
+        results["runs"].append({"edges": n_edges, "generate_seconds": round(generate_seconds, 3), "counts": counts, "stages": stages})
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_with_baseline(results, json.load(f))
+        for regression in regressions:
+            print(f"REGRESSION {regression['edges']} edges {regression['stage']}: {regression['before']}s -> {regression['after']}s")
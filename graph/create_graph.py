@@ -1,29 +1,37 @@
-import sqlite3
+import numpy as np
 import pandas as pd
-from itertools import combinations
-import matplotlib.pyplot as plt
-import networkx as nx
-from networkx.algorithms import node_classification
-import pickle
 
+from db_access import connections, profiles, read_query
+from graph_arrays import GraphArrays, NodeTable
+from instrumentation import count, span, traced
 
-def extract_data_with_query(query):
-    # Connect to SQLite database
-    conn = sqlite3.connect("../social_network_anonymized.db")
+DB_PATH = "../social_network_anonymized.db"
 
-    # Execute the query
-    data = pd.read_sql_query(query, conn)
+# networkx is imported inside the graph-building functions, so extraction-only callers skip it
 
-    # Close the connection
-    conn.close()
+# ProfileConnection.connection_type -> edge label used in the graph
+CONNECTION_EDGE_TYPES = {
+    "updated-friends-list-on-facebook": "friend_with",
+    "ADDED_THEM_AS_A_FRIEND_ON_FACEBOOK": "friend_with",
+    "BECAME_MEMBER_OF_GROUP_ON_FACEBOOK": "in_same_group",
+    "FOLLOWED_THEM_ON_FACEBOOK": "follower",
+    "COMMENTED_ON_THEIR_POST_ON_FACEBOOK": "commented_on",
+    "MENTIONED_THEM_ON_FACEBOOK": "tagged",
+}
 
-    return data
 
+def extract_data_with_query(query, db_path=DB_PATH):
+    # Connection with the read pragmas from db_access.py (run `python db_access.py prepare` once for the indexes)
+    return read_query(query, db_path=db_path)
+
+@traced("build_graph")
 def create_person_graph_with_relationship(people_profiles, people_connections, only_connected_nodes=False,friends_conn=False, group_conn=False, follow_conn=False, comment_conn=False,tagged_conn=False):
     # From the same region
     # Follow them on FB
     # Friends with each other
     # In the same group
+    import networkx as nx
+
     # Create an empty undirected graph
     G = nx.Graph()
     # Add nodes (persons)
@@ -76,6 +84,8 @@ def create_person_graph_with_relationship(people_profiles, people_connections, o
         connected_nodes = {node for edge in relationships for node in edge}  # Get unique nodes with at least one edge
         print(f"Number of connected nodes: {len(connected_nodes)}")
         G = G.subgraph(connected_nodes)  # Create subgraph with only connected nodes
+    count("graph_nodes", G.number_of_nodes())
+    count("graph_edges", G.number_of_edges())
     return G
 
 
@@ -85,50 +95,92 @@ def label_nodes_in_a_graph(graph_object, node_list, label):
     return graph_object
 
 
+def select_neighbourhood_subgraph(graph, target_nodes):
+    with span("neighbourhood_subgraph", target_nodes=len(target_nodes)) as counters:
+        neighbors = set()
+        for node in target_nodes:
+            neighbors.update(graph.neighbors(node))
+        # Combine target nodes with their neighbors
+        nodes_to_include = set(target_nodes).union(neighbors)
+        # Create subgraph with the selected nodes
+        subgraph = graph.subgraph(nodes_to_include)
+        counters["nodes"] = subgraph.number_of_nodes()
+        counters["edges"] = subgraph.number_of_edges()
+    print(f"Number of nodes in subgraph: {counters['nodes']}")
+    print(f"Number of edges in subgraph: {counters['edges']}")
+    return subgraph
+
+
+def seed_label_table(subgraph, suspicious_nodes, not_suspicious_nodes):
+    table = NodeTable.from_graph(subgraph)
+    # not_suspicious is applied second so it wins where the two sets overlap, as before
+    table.set_by_id("label", np.asarray(suspicious_nodes, dtype=int), np.full(len(suspicious_nodes), "suspicious", dtype=object))
+    table.set_by_id("label", np.asarray(not_suspicious_nodes, dtype=int), np.full(len(not_suspicious_nodes), "not_suspicious", dtype=object))
+    return table
+
+
+@traced("seed_labels")
+def seed_labels_from_traffic_likelihood(subgraph, traffic_likelihood, suspicious_threshold=100, not_suspicious_threshold=1):
+    scores = traffic_likelihood['traffic_likelihood'].to_numpy()
+    nodes = traffic_likelihood.index.to_numpy()
+    table = seed_label_table(subgraph, nodes[scores >= suspicious_threshold], nodes[scores <= not_suspicious_threshold])
+    return table.write_to_graph(subgraph)
+
+
+@traced("seed_labels")
+def seed_labels_from_seed_sets(subgraph, suspicious_nodes, not_suspicious_nodes):
+    # Seed sets from seed_selection.select_seeds / cached_seeds
+    return seed_label_table(subgraph, suspicious_nodes, not_suspicious_nodes).write_to_graph(subgraph)
+
+
+def prediction_table(subgraph, predictions, traffic_likelihood):
+    # graph_based_prediction for every node; llm_based_prediction only where the profile has posts (null otherwise)
+    table = NodeTable.from_graph(subgraph)
+    table.set("graph_based_prediction", np.arange(len(table)), np.array(predictions, dtype=object))
+    table.set_by_id("llm_based_prediction", traffic_likelihood.index.to_numpy(), traffic_likelihood['traffic_likelihood'].to_numpy())
+    return table
+
+
+@traced("propagation")
+def predict_with_harmonic_function(subgraph, traffic_likelihood):
+    from networkx.algorithms import node_classification
+
+    with span("harmonic_function", nodes=subgraph.number_of_nodes(), edges=subgraph.number_of_edges()):
+        predictions = node_classification.harmonic_function(subgraph)
+    # predictions are in subgraph.nodes() order, which is the table's position order
+    with span("write_predictions"):
+        prediction_table(subgraph, predictions, traffic_likelihood).write_to_graph(subgraph)
+    return subgraph
+
+
 if __name__ == "__main__":
-    # People list
-    people_profiles = extract_data_with_query("SELECT * FROM Profiles")
-    # People network
-    people_connections = extract_data_with_query("SELECT * FROM ProfileConnection")
+    # People list, only person profiles become nodes
+    people_profiles = profiles(DB_PATH, profile_type="person")
+    # People network, only the connection types that become edges
+    people_connections = connections(DB_PATH, connection_types=list(CONNECTION_EDGE_TYPES))
     graph = create_person_graph_with_relationship(people_profiles, people_connections, only_connected_nodes=False, friends_conn=True, group_conn=True, follow_conn=True, comment_conn=True,tagged_conn=True)
-    nx.write_graphml(graph, "overall_graph.graphml")
-    extra_data = pd.read_parquet("translated_posts.parquet")
-    profile_actvitity_link = extract_data_with_query("SELECT * FROM ProfileActivity")
-    combined_data = pd.merge(extra_data, profile_actvitity_link[["profile_id", "activity_id"]], left_on='id', right_on='activity_id', how='left')
-    combined_data = combined_data.dropna(subset=['profile_id'])
-    combined_data['profile_id'] = combined_data['profile_id'].astype(int)
+    from enrichment_store import load_posts
+    from graph_io import write_graph
+    write_graph(GraphArrays.from_connections(people_profiles, people_connections), "overall_graph.graphml")
+    # Only the columns the propagation needs, profile_id already attached in the enrichment store
+    combined_data = load_posts(["id", "profile_id", "traffic_likelihood"])
+    with span("merge_posts") as counters:
+        combined_data = combined_data.dropna(subset=['profile_id'])
+        combined_data['profile_id'] = combined_data['profile_id'].astype(int)
+        counters["rows"] = len(combined_data)
     target_nodes = set(combined_data['profile_id'])
-    neighbors = set()
-    for node in target_nodes:
-        neighbors.update(graph.neighbors(node))
-    # Combine target nodes with their neighbors
-    nodes_to_include = target_nodes.union(neighbors)
-    # Create subgraph with the selected nodes
-    subgraph = graph.subgraph(nodes_to_include)
-    print(f"Number of nodes in subgraph: {subgraph.number_of_nodes()}")
-    print(f"Number of edges in subgraph: {subgraph.number_of_edges()}")
-    nx.write_graphml(subgraph, "subgraph.graphml")
+    subgraph = select_neighbourhood_subgraph(graph, target_nodes)
+    write_graph(GraphArrays.from_networkx(subgraph), "subgraph.graphml")
     # node classification
-    traffic_likelihood = combined_data.groupby("profile_id").sum()[["traffic_likelihood"]]
-    example_nodes_suspicious = traffic_likelihood[traffic_likelihood['traffic_likelihood'] >= 100].index.tolist()
-    example_nodes_not_suspicious = traffic_likelihood[traffic_likelihood['traffic_likelihood'] <= 1].index.tolist()
-    # change them all into int
-    example_nodes_suspicious = [int(node) for node in example_nodes_suspicious]
-    example_nodes_not_suspicious = [int(node) for node in example_nodes_not_suspicious]
-    subgraph = label_nodes_in_a_graph(subgraph, example_nodes_suspicious, "suspicious")
-    subgraph = label_nodes_in_a_graph(subgraph, example_nodes_not_suspicious, "not_suspicious")
-    predictions = node_classification.harmonic_function(subgraph)
-    # now loop through the predictions and nodes to assign labels to node attribute
-    for prediction, node in zip(predictions, subgraph.nodes()):
-        subgraph.nodes[node]["graph_based_prediction"] = prediction
-        if node in traffic_likelihood.index:
-            subgraph.nodes[node]["llm_based_prediction"] = traffic_likelihood.loc[node]["traffic_likelihood"]
-        else:
-            subgraph.nodes[node]["llm_based_prediction"] = "no post data"
-    nx.write_graphml(subgraph, "subgraph_with_predictions.graphml")
-    with open("subgraph_with_predictions.pickle", "wb") as f:
-        pickle.dump(subgraph, f)
-    # pickle this graph
+    with span("aggregate_traffic_likelihood"):
+        traffic_likelihood = combined_data.groupby("profile_id")[["traffic_likelihood"]].sum()
+    subgraph = seed_labels_from_traffic_likelihood(subgraph, traffic_likelihood)
+    subgraph = predict_with_harmonic_function(subgraph, traffic_likelihood)
+    predictions = GraphArrays.from_networkx(subgraph)
+    write_graph(predictions, "subgraph_with_predictions.graphml")
+    # Node table + edge list, what load_networkx_graph("subgraph_with_predictions") reads back quickest
+    write_graph(predictions, "subgraph_with_predictions")
+    # import matplotlib.pyplot as plt
     # plt.figure(figsize=(12, 12))
     # pos = nx.spring_layout(subgraph, k=0.1)  # Adjust k for better spacing
     # nx.draw(graph, pos, node_size=0.5, width=0.1, edge_color="gray", with_labels=False)
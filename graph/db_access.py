@@ -0,0 +1,207 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import span
+
+# Read path for social_network_anonymized.db. prepare_database() is a one-off step that adds covering indexes
+# for the filters the pipeline uses (ProfileConnection.connection_type, ProfileActivity.profile_id,
+# Activity.type, Profiles.profile_type), switches the DB to WAL so the notebook, the dashboard and scripts
+# can read while one process writes, and runs ANALYZE so the planner picks the indexes.
+# connect() sets the per-connection read pragmas; the query functions push filters and column lists into SQL
+# instead of reading whole tables and filtering in pandas/polars.
+#   python db_access.py prepare --db ../social_network_anonymized.db
+#   python db_access.py benchmark --db ../social_network_anonymized.db     (before/after timings on a copy)
+
+DB_PATH = "../social_network_anonymized.db"
+
+# name -> (table, columns). Leading column is the filter, the rest are what the queries read, so the
+# index alone answers them (INTEGER PRIMARY KEY ids come with every index entry).
+INDEXES = {
+    "idx_connection_type": ("ProfileConnection", ["connection_type", "source_id", "target_id", "timestamp"]),
+    "idx_profile_activity_profile": ("ProfileActivity", ["profile_id", "activity_id"]),
+    "idx_profile_activity_activity": ("ProfileActivity", ["activity_id", "profile_id"]),
+    "idx_activity_type": ("Activity", ["type", "timestamp"]),
+    "idx_profile_type": ("Profiles", ["profile_type", "region"]),
+}
+
+READ_PRAGMAS = {
+    "mmap_size": 1 << 30,  # map up to 1 GiB of the file instead of copying pages through read()
+    "cache_size": -262_144,  # 256 MiB page cache (negative values are KiB)
+    "temp_store": "MEMORY",
+}
+
+
+def _tables(conn):
+    return {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def prepare_database(db_path=DB_PATH):
+    # Idempotent: indexes are created if missing, WAL is persistent once set
+    with span("prepare_database", db=db_path) as counters:
+        conn = sqlite3.connect(db_path)
+        try:
+            tables = _tables(conn)
+            created = 0
+            for name, (table, columns) in INDEXES.items():
+                if table in tables:
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+                    created += 1
+            conn.commit()
+            counters["journal_mode"] = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+            conn.execute("ANALYZE")
+            conn.commit()
+            counters["indexes"] = created
+        finally:
+            conn.close()
+    return counters
+
+
+def connect(db_path=DB_PATH, read_only=True):
+    # sqlite3 connection with the read pragmas applied; also usable as a SQLAlchemy creator
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    for pragma, value in READ_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    if read_only:
+        conn.execute("PRAGMA query_only = 1")
+    return conn
+
+
+def read_query(query, params=(), db_path=DB_PATH):
+    with span("sql_extraction", query=query) as counters:
+        conn = connect(db_path)
+        try:
+            data = pd.read_sql_query(query, conn, params=params)
+        finally:
+            conn.close()
+        counters["rows"] = len(data)
+    return data
+
+
+# Longer value lists are bound as one JSON array and read back with json_each, since SQLite caps the number of
+# bound parameters per statement (999 in older builds) and the read-only connections cannot fill a temp table
+MAX_INLINE_VALUES = 256
+
+
+def _where(filters):
+    # filters: (column, values) pairs; values is a scalar or any list-like (list, set, numpy array, Series),
+    # None means no filter. Returns the WHERE clause and its parameters.
+    clauses, params = [], []
+    for column, values in filters:
+        if values is None:
+            continue
+        if isinstance(values, (set, frozenset)):
+            values = list(values)
+        # plain Python values: sqlite binds numpy integers as blobs, which match nothing
+        values = np.atleast_1d(np.asarray(values)).tolist()
+        if len(values) > MAX_INLINE_VALUES:
+            clauses.append(f"{column} IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps(values))
+        else:
+            clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+def _select(table, columns, filters, db_path, extra=""):
+    where, params = _where(filters)
+    if extra:
+        where = f"{where} AND {extra}" if where else f" WHERE {extra}"
+    return read_query(f"SELECT {', '.join(columns) if columns else '*'} FROM {table}{where}", params, db_path)
+
+
+def profiles(db_path=DB_PATH, profile_type=None, columns=None):
+    return _select("Profiles", columns, [("profile_type", profile_type)], db_path)
+
+
+def connections(db_path=DB_PATH, connection_types=None, columns=None):
+    return _select("ProfileConnection", columns, [("connection_type", connection_types)], db_path)
+
+
+def activities(db_path=DB_PATH, types=None, with_content=False, columns=None):
+    # with_content: skip posts with empty content, as the translation step does
+    return _select("Activity", columns, [("type", types)], db_path, "content != ''" if with_content else "")
+
+
+def profile_activity(db_path=DB_PATH, profile_ids=None, activity_ids=None, columns=("profile_id", "activity_id")):
+    return _select("ProfileActivity", columns, [("profile_id", profile_ids), ("activity_id", activity_ids)], db_path)
+
+
+def _benchmark_queries(db_path, connection_types, activity_types, profile_id):
+    # (name, full scan + pandas filter, pushed-down query) for the filters the pipeline and the notebook use
+    def scan(table):
+        conn = sqlite3.connect(db_path)
+        try:
+            return pd.read_sql_query(f"SELECT * FROM {table}", conn)
+        finally:
+            conn.close()
+    return [
+        ("person_profiles",
+         lambda: scan("Profiles").query("profile_type == 'person'"),
+         lambda: profiles(db_path, "person", ["id", "region", "profile_type"])),
+        ("connections_by_type",
+         lambda: scan("ProfileConnection").pipe(lambda frame: frame[frame["connection_type"].isin(connection_types)]),
+         lambda: connections(db_path, connection_types, ["id", "source_id", "target_id", "connection_type"])),
+        ("connections_one_type",
+         lambda: scan("ProfileConnection").pipe(lambda frame: frame[frame["connection_type"] == connection_types[-1]]),
+         lambda: connections(db_path, connection_types[-1:], ["id", "source_id", "target_id", "connection_type"])),
+        ("posts_by_type",
+         lambda: scan("Activity").pipe(lambda frame: frame[frame["type"].isin(activity_types) & (frame["content"] != "")]),
+         lambda: activities(db_path, activity_types, with_content=True)),
+        ("one_profile_activity",
+         lambda: scan("ProfileActivity").pipe(lambda frame: frame[frame["profile_id"] == profile_id]),
+         lambda: profile_activity(db_path, profile_ids=[profile_id])),
+    ]
+
+
+def benchmark(db_path=DB_PATH, repeat=3, connection_types=None, activity_types=None):
+    # Times each query on an unprepared copy of the DB (full scan, filter in pandas), then on the same copy
+    # after prepare_database() with the filter pushed into SQL. Returns one row per query.
+    from create_graph import CONNECTION_EDGE_TYPES
+    connection_types = connection_types or list(CONNECTION_EDGE_TYPES)
+    activity_types = activity_types or ["commented-on-facebook", "shared-a-post-on-facebook", "posted-to-story-on-facebook"]
+    with tempfile.TemporaryDirectory() as directory:
+        copy = os.path.join(directory, os.path.basename(db_path))
+        shutil.copyfile(db_path, copy)
+        conn = sqlite3.connect(copy)
+        for name in INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+        profile_id = conn.execute("SELECT profile_id FROM ProfileActivity LIMIT 1").fetchone()[0]
+        conn.close()
+        queries = _benchmark_queries(copy, connection_types, activity_types, profile_id)
+
+        def best(fn):
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                rows = len(fn())
+                timings.append(time.perf_counter() - start)
+            return min(timings), rows
+        before = {name: best(scan) for name, scan, _ in queries}
+        prepare_database(copy)
+        after = {name: best(pushed) for name, _, pushed in queries}
+    return pd.DataFrame([
+        {"query": name, "rows": after[name][1], "before_s": before[name][0], "after_s": after[name][0],
+         "speedup": before[name][0] / after[name][0]}
+        for name, _, _ in queries
+    ]).set_index("query")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prepare social_network_anonymized.db for reads and time it")
+    parser.add_argument("command", choices=["prepare", "benchmark"])
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == "prepare":
+        print(prepare_database(args.db))
+    else:
+        print(benchmark(args.db, args.repeat).to_string(float_format="{:.4f}".format))
@@ -0,0 +1,156 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from create_graph import DB_PATH, extract_data_with_query
+from db_access import profile_activity
+from instrumentation import span
+
+# Normalised, dictionary-encoded layout for the LLM enrichment output:
+#   <store>/entities.parquet  shared (entity_id, kind, value) dictionary for species / locations / PII
+#   <store>/posts/month=YYYY-MM/region=.../*.parquet  one row per (post, linked profile), entity lists stored as int32 ids
+# Rows are sorted by (profile_id, timestamp) inside each file so parquet min/max statistics prune row groups.
+
+ENTITY_COLUMNS = {
+    "species_being_mentioned": "species",
+    "location": "location",
+    "pii": "pii",
+}
+PARTITIONING = ds.partitioning(pa.schema([("month", pa.string()), ("region", pa.string())]), flavor="hive")
+
+
+def _flat_values(table, column):
+    # cast, an all-empty column comes back from parquet as list<null>
+    return pc.list_flatten(table.column(column).combine_chunks()).cast(pa.string())
+
+
+def build_entity_dictionary(table, entities=None):
+    # Extend an existing dictionary (or start a new one) with unseen values, ids stay stable across runs
+    if entities is None:
+        entities = pd.DataFrame({"entity_id": pd.Series(dtype="int32"), "kind": pd.Series(dtype="object"), "value": pd.Series(dtype="object")})
+    new_rows = []
+    next_id = int(entities["entity_id"].max()) + 1 if len(entities) else 0
+    for column, kind in ENTITY_COLUMNS.items():
+        known = set(entities.loc[entities["kind"] == kind, "value"])
+        values = [value for value in pc.unique(_flat_values(table, column)).to_pylist() if value is not None and value not in known]
+        new_rows.append(pd.DataFrame({"entity_id": np.arange(next_id, next_id + len(values), dtype="int32"), "kind": kind, "value": values}))
+        next_id += len(values)
+    return pd.concat([entities] + new_rows, ignore_index=True)
+
+
+def _encode_list_column(table, column, value_set, ids):
+    # list<string> -> list<int32> through the dictionary, keeping the list offsets as they are
+    lists = table.column(column).combine_chunks()
+    positions = pc.index_in(pc.list_flatten(lists).cast(pa.string()), value_set=value_set)
+    encoded = pc.take(ids, positions)
+    return pa.ListArray.from_arrays(lists.offsets, encoded, mask=lists.is_null())
+
+
+def _encode_actions(table):
+    actions = table.column("actions").combine_chunks()
+    if pa.types.is_integer(actions.type.value_type):
+        return actions.cast(pa.list_(pa.int8()))
+    # Older parquet files keep the SuspiciousActions values as strings (structured_output pulls in pydantic)
+    from structured_output import ACTIONS
+
+    codes = pc.index_in(pc.list_flatten(actions), value_set=pa.array(ACTIONS)).cast(pa.int8())
+    return pa.ListArray.from_arrays(actions.offsets, codes, mask=actions.is_null())
+
+
+def encode_posts(posts, profile_activity, people_profiles, entities):
+    # posts: arrow table as written by the enrichment (translated_posts.parquet)
+    # one row per (post, linked profile), like the left join in the legacy load_posts path: a post shared by several
+    # profiles counts for each of them, a post without a link keeps a null profile_id
+    links = pd.merge(profile_activity[["profile_id", "activity_id"]], people_profiles[["id", "region"]], left_on="profile_id", right_on="id", how="left")
+    rows = pd.merge(pd.DataFrame({"activity_id": posts.column("id").to_numpy(), "row": np.arange(posts.num_rows)}),
+                    links[["activity_id", "profile_id", "region"]], on="activity_id", how="left")
+    posts = posts.take(pa.array(rows["row"].to_numpy()))
+    post_ids = posts.column("id").to_numpy()
+    profile_id = rows["profile_id"].astype("Int64")
+    region = rows["region"].fillna("unknown").astype(str).to_numpy()
+    timestamp = posts.column("timestamp").to_numpy()
+    columns = {
+        "id": pa.array(post_ids, pa.int64()),
+        "profile_id": pa.array(profile_id, pa.int64()),
+        "timestamp": pa.array(timestamp, pa.int64()),
+        "month": pa.array(pd.to_datetime(timestamp, unit="ms").strftime("%Y-%m").to_numpy(), pa.string()),
+        "region": pa.array(region, pa.string()),
+        "type": posts.column("type").combine_chunks().dictionary_encode(),
+        "translated_content": posts.column("translated_content").combine_chunks(),
+        "language": pc.utf8_lower(posts.column("language").combine_chunks()).dictionary_encode(),
+        "traffic_likelihood": posts.column("traffic_likelihood").combine_chunks().cast(pa.int8()),
+        "actions": _encode_actions(posts),
+    }
+    for column, kind in ENTITY_COLUMNS.items():
+        kind_entities = entities[entities["kind"] == kind]
+        columns[f"{kind}_ids"] = _encode_list_column(posts, column, pa.array(kind_entities["value"], pa.string()), pa.array(kind_entities["entity_id"], pa.int32()))
+    table = pa.table(columns)
+    return table.sort_by([("profile_id", "ascending"), ("timestamp", "ascending")])
+
+
+def write_enrichment_store(posts_path, store_dir, profile_activity, people_profiles):
+    posts = pq.read_table(posts_path)
+    entities_path = os.path.join(store_dir, "entities.parquet")
+    entities = pd.read_parquet(entities_path) if os.path.isfile(entities_path) else None
+    entities = build_entity_dictionary(posts, entities)
+    os.makedirs(store_dir, exist_ok=True)
+    entities.to_parquet(entities_path, index=False)
+    table = encode_posts(posts, profile_activity, people_profiles, entities)
+    ds.write_dataset(
+        table,
+        os.path.join(store_dir, "posts"),
+        format="parquet",
+        partitioning=PARTITIONING,
+        existing_data_behavior="delete_matching",
+        max_rows_per_group=64 * 1024,
+        file_options=ds.ParquetFileFormat().make_write_options(compression="zstd", write_statistics=True),
+    )
+    return table.num_rows
+
+
+def posts_dataset(store_dir):
+    return ds.dataset(os.path.join(store_dir, "posts"), format="parquet", partitioning=PARTITIONING)
+
+
+def read_enrichment(store_dir, columns=None, filter=None):
+    # Column projection and predicate pushdown happen in pyarrow (partitions + row group statistics)
+    with span("read_enrichment", filtered=filter is not None) as counters:
+        posts = posts_dataset(store_dir).to_table(columns=columns, filter=filter).to_pandas()
+        counters["rows"] = len(posts)
+    return posts
+
+
+def read_entities(store_dir):
+    return pd.read_parquet(os.path.join(store_dir, "entities.parquet"))
+
+
+def decode_entity_ids(id_lists, entities):
+    # list of entity ids per row -> list of values per row
+    values = entities.set_index("entity_id")["value"]
+    return [list(values.reindex(ids)) if ids is not None else [] for ids in id_lists]
+
+
+def load_posts(columns, store_dir="enrichment_store", legacy_path="translated_posts.parquet", filter=None, db_path=DB_PATH):
+    # Posts with profile_id attached; reads the store when it exists, otherwise the old parquet + ProfileActivity merge
+    if store_dir and os.path.isdir(os.path.join(store_dir, "posts")):
+        return read_enrichment(store_dir, columns=columns, filter=filter)
+    extra_data = pd.read_parquet(legacy_path, columns=["id"] + [column for column in columns if column not in ("id", "profile_id")])
+    profile_actvitity_link = profile_activity(db_path)
+    with span("merge_posts_profile_activity", rows=len(extra_data)):
+        combined_data = pd.merge(extra_data, profile_actvitity_link[["profile_id", "activity_id"]], left_on='id', right_on='activity_id', how='left')
+    combined_data = combined_data[columns]
+    if filter is not None:
+        combined_data = pa.Table.from_pandas(combined_data, preserve_index=False).filter(filter).to_pandas()
+    return combined_data
+
+
+if __name__ == "__main__":
+    people_profiles = extract_data_with_query("SELECT id, region FROM Profiles")
+    profile_actvitity_link = extract_data_with_query("SELECT profile_id, activity_id FROM ProfileActivity")
+    n_rows = write_enrichment_store("translated_posts.parquet", "enrichment_store", profile_actvitity_link, people_profiles)
+    print(f"Wrote {n_rows} posts to enrichment_store")
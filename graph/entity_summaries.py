@@ -0,0 +1,310 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from enrichment_store import ENTITY_COLUMNS, posts_dataset, read_entities
+from instrumentation import span
+
+# Per-profile entity summaries (species / location / PII) in one streaming pass over the posts, instead of
+# exploding and collecting every mention per profile:
+#   mentions      total entity mentions (exact)
+#   distinct      distinct entities, exact or a HyperLogLog estimate
+#   top_entities  the top_k entities with their counts (exact, or Count-Min estimates)
+# Every profile starts exact: (profile, entity) -> count pairs, merged every compact_rows mentions. A profile
+# that passes exact_limit distinct entities is promoted: its pairs go into a HyperLogLog of its own (distinct
+# count) and into one Count-Min sketch per kind shared by all promoted profiles (frequencies), and it keeps only
+# a bounded list of candidate heavy hitters re-ranked by their sketch estimates. Memory is then bounded by the
+# light profiles' pairs plus fixed-size sketches, however prolific the heavy profiles are.
+#   python entity_summaries.py --store enrichment_store --out ../data/entity_summaries
+# EntitySummaries.load(...).profile(id) / .top(kind) serve the explore.py person cell and the app.py entity panel.
+
+KINDS = list(ENTITY_COLUMNS.values())
+
+DEFAULT_PARAMS = {
+    "top_k": 10,
+    "exact_limit": 256,  # distinct entities before a profile switches to sketches
+    "candidates": 64,  # heavy-hitter candidates kept per promoted profile
+    "precision": 10,  # HyperLogLog registers = 2 ** precision (about 3% error)
+    "cms_width": 1 << 18,
+    "cms_depth": 4,
+    "compact_rows": 1 << 20,
+}
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _pair_keys(profiles, hashes):
+    # One 64-bit key per (profile code, entity hash), for the shared Count-Min sketch
+    return hashes ^ (profiles.astype(np.uint64) * _GOLDEN)
+
+
+def _count_pairs(profiles, hashes, counts=None):
+    # Distinct (profile, entity) pairs sorted by profile, with summed counts
+    if not len(profiles):
+        return profiles, hashes, np.zeros(0, dtype=np.int64)
+    order = np.lexsort((hashes, profiles))
+    profiles, hashes = profiles[order], hashes[order]
+    counts = np.ones(len(order), dtype=np.int64) if counts is None else counts[order]
+    starts = np.flatnonzero(np.r_[True, (profiles[1:] != profiles[:-1]) | (hashes[1:] != hashes[:-1])])
+    return profiles[starts], hashes[starts], np.add.reduceat(counts, starts)
+
+
+def _top_per_profile(profiles, scores, k):
+    # Positions of the k highest scores of each profile, ordered by (profile, -score)
+    order = np.lexsort((-scores, profiles))
+    sorted_profiles = profiles[order]
+    starts = np.flatnonzero(np.r_[True, sorted_profiles[1:] != sorted_profiles[:-1]])
+    rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    return order[rank < k]
+
+
+class CountMinSketch:
+    # depth x width counters with multiply-shift hashing; estimates never undercount
+    def __init__(self, width=1 << 18, depth=4, seed=0):
+        self.bits = int(np.log2(width))
+        self.table = np.zeros((depth, 1 << self.bits), dtype=np.int64)
+        self.multipliers = np.random.default_rng(seed).integers(1, 1 << 62, size=depth, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+
+    def _buckets(self, keys):
+        return ((keys[None, :] * self.multipliers[:, None]) >> np.uint64(64 - self.bits)).astype(np.intp)
+
+    def add(self, keys, counts):
+        for row, buckets in enumerate(self._buckets(keys)):
+            self.table[row] += np.bincount(buckets, weights=counts, minlength=self.table.shape[1]).astype(np.int64)
+
+    def query(self, keys):
+        buckets = self._buckets(keys)
+        return self.table[np.arange(len(self.table))[:, None], buckets].min(axis=0)
+
+
+class HyperLogLogs:
+    # One HyperLogLog of 2 ** precision registers per row; rows are added as profiles get promoted
+    def __init__(self, precision=10):
+        self.precision = precision
+        self.registers = np.zeros((0, 1 << precision), dtype=np.uint8)
+
+    def add_rows(self, n):
+        start = len(self.registers)
+        self.registers = np.vstack([self.registers, np.zeros((n, self.registers.shape[1]), dtype=np.uint8)])
+        return np.arange(start, start + n)
+
+    def add(self, rows, hashes):
+        bucket = (hashes >> np.uint64(64 - self.precision)).astype(np.intp)
+        rest = hashes << np.uint64(self.precision)
+        # bit length of rest from its two 32-bit halves (exact in float64), rank = leading zeros + 1
+        high, low = (rest >> np.uint64(32)).astype(np.float64), (rest & np.uint64(0xFFFFFFFF)).astype(np.float64)
+        bit_length = np.where(high > 0, np.frexp(high)[1] + 32, np.frexp(low)[1])
+        rank = np.minimum(65 - bit_length, 64 - self.precision + 1).astype(np.uint8)
+        np.maximum.at(self.registers, (rows, bucket), rank)
+
+    def estimate(self):
+        m = self.registers.shape[1]
+        raw = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.exp2(-self.registers.astype(np.float64)), axis=1)
+        zeros = (self.registers == 0).sum(axis=1)
+        # linear counting while most registers are still empty
+        return np.where((raw <= 2.5 * m) & (zeros > 0), m * np.log(m / np.maximum(zeros, 1)), raw)
+
+
+class EntitySummaryBuilder:
+    def __init__(self, kinds=KINDS, params=None):
+        self.params = {**DEFAULT_PARAMS, **(params or {})}
+        self.kinds = list(kinds)
+        self.profile_index = pd.Index([], dtype=np.int64)
+        self.values = {}
+        self.mentions = {kind: np.zeros(0, dtype=np.int64) for kind in self.kinds}
+        self.promoted = {kind: np.zeros(0, dtype=np.int64) for kind in self.kinds}
+        self.exact = {kind: (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)) for kind in self.kinds}
+        self.pending = {kind: [] for kind in self.kinds}
+        self.pending_rows = {kind: 0 for kind in self.kinds}
+        self.hll = {kind: HyperLogLogs(self.params["precision"]) for kind in self.kinds}
+        self.cms = {kind: CountMinSketch(self.params["cms_width"], self.params["cms_depth"], seed) for seed, kind in enumerate(self.kinds)}
+        self.candidates = {kind: (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64)) for kind in self.kinds}
+        self.totals = {kind: pd.Series(dtype=np.int64) for kind in self.kinds}
+
+    def _codes(self, profile_ids):
+        codes = self.profile_index.get_indexer(profile_ids)
+        if (codes < 0).any():
+            self.profile_index = self.profile_index.append(pd.Index(pd.unique(profile_ids[codes < 0])))
+            n = len(self.profile_index)
+            for kind in self.kinds:
+                self.mentions[kind] = np.r_[self.mentions[kind], np.zeros(n - len(self.mentions[kind]), dtype=np.int64)]
+                self.promoted[kind] = np.r_[self.promoted[kind], np.full(n - len(self.promoted[kind]), -1, dtype=np.int64)]
+            codes = self.profile_index.get_indexer(profile_ids)
+        return codes
+
+    def update(self, profile_ids, entity_lists):
+        # profile_ids: one per post; entity_lists: kind -> arrow list array (entity values or store ids) per post
+        profile_ids = np.asarray(profile_ids)
+        known = ~pd.isna(profile_ids)
+        codes = np.full(len(profile_ids), -1, dtype=np.int64)
+        codes[known] = self._codes(profile_ids[known].astype(np.int64))
+        for kind, lists in entity_lists.items():
+            lists = lists.combine_chunks() if isinstance(lists, pa.ChunkedArray) else lists
+            flat = pc.list_flatten(lists)
+            profiles = codes[pc.list_parent_indices(lists).to_numpy()]
+            keep = (profiles >= 0) & flat.is_valid().to_numpy(zero_copy_only=False)
+            values = flat.filter(pa.array(keep)).to_numpy(zero_copy_only=False)
+            profiles = profiles[keep]
+            if not len(values):
+                continue
+            hashes = pd.util.hash_array(values)
+            unique, first, counts = np.unique(hashes, return_index=True, return_counts=True)
+            self.values.update((key, values[position]) for key, position in zip(unique.tolist(), first.tolist()) if key not in self.values)
+            self.totals[kind] = self.totals[kind].add(pd.Series(counts, index=unique), fill_value=0).astype(np.int64)
+            self.mentions[kind] += np.bincount(profiles, minlength=len(self.profile_index))
+            rows = self.promoted[kind][profiles]
+            heavy = rows >= 0
+            if heavy.any():
+                self._update_sketches(kind, profiles[heavy], hashes[heavy], np.ones(heavy.sum(), dtype=np.int64))
+            self.pending[kind].append(_count_pairs(profiles[~heavy], hashes[~heavy]))
+            self.pending_rows[kind] += int((~heavy).sum())
+            if self.pending_rows[kind] >= self.params["compact_rows"]:
+                self._compact(kind)
+        return self
+
+    def _update_sketches(self, kind, profiles, hashes, counts):
+        profiles, hashes, counts = _count_pairs(profiles, hashes, counts)
+        self.hll[kind].add(self.promoted[kind][profiles], hashes)
+        self.cms[kind].add(_pair_keys(profiles, hashes), counts)
+        # re-rank this profile's candidates together with what it just mentioned, keep the best few
+        old_profiles, old_hashes = self.candidates[kind]
+        profiles, hashes, _ = _count_pairs(np.r_[old_profiles, profiles], np.r_[old_hashes, hashes])
+        keep = _top_per_profile(profiles, self.cms[kind].query(_pair_keys(profiles, hashes)), self.params["candidates"])
+        self.candidates[kind] = (profiles[keep], hashes[keep])
+
+    def _compact(self, kind):
+        parts = [self.exact[kind]] + self.pending[kind]
+        profiles, hashes, counts = _count_pairs(*(np.concatenate(column) for column in zip(*parts)))
+        self.pending[kind], self.pending_rows[kind] = [], 0
+        distinct = np.bincount(profiles, minlength=len(self.profile_index))
+        promote = np.flatnonzero((distinct > self.params["exact_limit"]) & (self.promoted[kind] < 0))
+        if len(promote):
+            with span("promote_profiles", kind=kind, profiles=len(promote)):
+                self.promoted[kind][promote] = self.hll[kind].add_rows(len(promote))
+                moving = self.promoted[kind][profiles] >= 0
+                self._update_sketches(kind, profiles[moving], hashes[moving], counts[moving])
+                profiles, hashes, counts = profiles[~moving], hashes[~moving], counts[~moving]
+        self.exact[kind] = (profiles, hashes, counts)
+
+    def finish(self, entities=None):
+        # -> EntitySummaries; entities: the enrichment store dictionary, to decode store ids into values
+        values = pd.Series(self.values, dtype=object)
+        if entities is not None:
+            names = entities.set_index("entity_id")["value"]
+            values = pd.Series(names.reindex(values.to_numpy()).to_numpy(dtype=object), index=values.index)
+        frames, totals = [], []
+        for kind in self.kinds:
+            self._compact(kind)
+            profiles, hashes, counts = self.exact[kind]
+            distinct = np.bincount(profiles, minlength=len(self.profile_index)).astype(np.float64)
+            heavy = np.flatnonzero(self.promoted[kind] >= 0)
+            distinct[heavy] = self.hll[kind].estimate()[self.promoted[kind][heavy]]
+            candidate_profiles, candidate_hashes = self.candidates[kind]
+            estimates = self.cms[kind].query(_pair_keys(candidate_profiles, candidate_hashes))
+            profiles, hashes = np.r_[profiles, candidate_profiles], np.r_[hashes, candidate_hashes]
+            counts = np.r_[counts, estimates]
+            top = _top_per_profile(profiles, counts, self.params["top_k"])
+            offsets = np.r_[0, np.cumsum(np.bincount(profiles[top], minlength=len(self.profile_index)))]
+            names = values.reindex(hashes[top]).to_numpy(dtype=object)
+            frames.append(pd.DataFrame({
+                "profile_id": self.profile_index.to_numpy(),
+                "kind": kind,
+                "mentions": self.mentions[kind],
+                "distinct": np.round(distinct).astype(np.int64),
+                "approximate": self.promoted[kind] >= 0,
+                "top_entities": pa.ListArray.from_arrays(offsets, pa.array(names, pa.string())).to_pandas(),
+                "top_counts": pa.ListArray.from_arrays(offsets, pa.array(counts[top], pa.int64())).to_pandas(),
+            }))
+            total = self.totals[kind].sort_values(ascending=False)
+            totals.append(pd.DataFrame({"kind": kind, "entity": values.reindex(total.index).to_numpy(dtype=object), "count": total.to_numpy()}))
+        profiles = pd.concat(frames, ignore_index=True)
+        return EntitySummaries(profiles[profiles["mentions"] > 0].reset_index(drop=True), pd.concat(totals, ignore_index=True))
+
+
+class EntitySummaries:
+    def __init__(self, profiles, totals):
+        # profiles: one row per (profile, kind) with mentions; totals: count per (kind, entity) over all posts
+        self.profiles = profiles
+        self.totals = totals
+        self._by_profile = profiles.set_index("profile_id")
+
+    def profile(self, profile_ids):
+        # Summary rows (one per kind with mentions) for one id or a list / Series of them (a mo.ui.table selection)
+        profile_ids = [profile_ids] if np.ndim(profile_ids) == 0 else list(profile_ids)
+        rows = self._by_profile.loc[self._by_profile.index.intersection(profile_ids)]
+        return rows.reset_index()
+
+    def top(self, kind, k=5):
+        # entity -> mentions over every post
+        totals = self.totals[self.totals["kind"] == kind].head(k)
+        return pd.Series(totals["count"].to_numpy(), index=totals["entity"].to_numpy(), name=kind)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.profiles.to_parquet(os.path.join(directory, "profiles.parquet"), index=False)
+        self.totals.to_parquet(os.path.join(directory, "totals.parquet"), index=False)
+        return directory
+
+    @classmethod
+    def load(cls, directory):
+        return cls(pd.read_parquet(os.path.join(directory, "profiles.parquet")), pd.read_parquet(os.path.join(directory, "totals.parquet")))
+
+
+def summarise_table(table, profile_column="profile_id", columns=None, params=None, batch_size=64 * 1024, entities=None):
+    # Summaries from an in-memory arrow table (e.g. the notebook's joined frame); columns: list column -> kind
+    columns = columns or {column: kind for column, kind in ENTITY_COLUMNS.items() if column in table.column_names}
+    builder = EntitySummaryBuilder(list(columns.values()), params)
+    for batch in table.to_batches(max_chunksize=batch_size):
+        builder.update(batch.column(profile_column).to_numpy(zero_copy_only=False),
+                       {kind: batch.column(column) for column, kind in columns.items()})
+    return builder.finish(entities)
+
+
+def summarise_posts(store_dir="enrichment_store", legacy_path="translated_posts.parquet", db_path=None, params=None, batch_size=64 * 1024):
+    # One pass over the enrichment store (entity ids, decoded at the end) or the legacy parquet
+    with span("entity_summaries") as counters:
+        if store_dir and os.path.isdir(os.path.join(store_dir, "posts")):
+            columns = {f"{kind}_ids": kind for kind in KINDS}
+            builder = EntitySummaryBuilder(KINDS, params)
+            for batch in posts_dataset(store_dir).to_batches(columns=["profile_id", *columns], batch_size=batch_size):
+                builder.update(batch.column("profile_id").to_numpy(zero_copy_only=False),
+                               {kind: batch.column(column) for column, kind in columns.items()})
+            summaries = builder.finish(read_entities(store_dir))
+        else:
+            from create_graph import DB_PATH
+            from db_access import profile_activity
+
+            # every (post, profile) link counts, as in load_posts and the enrichment store
+            links = profile_activity(db_path or DB_PATH)[["activity_id", "profile_id"]]
+            builder = EntitySummaryBuilder(KINDS, params)
+            for batch in pq.ParquetFile(legacy_path).iter_batches(batch_size=batch_size, columns=["id", *ENTITY_COLUMNS]):
+                rows = pd.merge(pd.DataFrame({"activity_id": batch.column("id").to_numpy(), "row": np.arange(batch.num_rows)}),
+                                links, on="activity_id", how="inner")
+                batch = batch.take(pa.array(rows["row"].to_numpy()))
+                builder.update(rows["profile_id"].to_numpy(), {kind: batch.column(column) for column, kind in ENTITY_COLUMNS.items()})
+            summaries = builder.finish()
+        counters["profiles"] = summaries.profiles["profile_id"].nunique()
+        counters["approximate"] = int(summaries.profiles["approximate"].sum())
+    return summaries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-profile distinct entity counts and top entities in one streaming pass")
+    parser.add_argument("--db", default="../social_network_anonymized.db")
+    parser.add_argument("--posts", default="translated_posts.parquet")
+    parser.add_argument("--store", default="enrichment_store")
+    parser.add_argument("--out", default="../data/entity_summaries", help="app.py reads data/entity_summaries")
+    parser.add_argument("--exact-limit", type=int, default=DEFAULT_PARAMS["exact_limit"])
+    parser.add_argument("--top-k", type=int, default=DEFAULT_PARAMS["top_k"])
+    args = parser.parse_args()
+
+    summaries = summarise_posts(args.store, args.posts, args.db, {"exact_limit": args.exact_limit, "top_k": args.top_k})
+    summaries.save(args.out)
+    print(f"{summaries.profiles['profile_id'].nunique()} profiles -> {args.out}")
+    for kind in KINDS:
+        print(summaries.top(kind).to_string())
@@ -0,0 +1,196 @@
+import numpy as np
+import pandas as pd
+
+# Column-oriented graph: node ids and attributes as arrays indexed by node position, edges as
+# (src, dst) position arrays plus per-edge attribute arrays. This is what the exporters, loaders and the
+# sparse algorithms work on, instead of networkx dicts. networkx and scipy are only imported by the
+# methods that convert to them.
+
+
+class GraphArrays:
+    def __init__(self, node_ids, src, dst, node_attrs=None, edge_attrs=None):
+        self.node_ids = np.asarray(node_ids)
+        self.src = np.asarray(src, dtype=np.int64)
+        self.dst = np.asarray(dst, dtype=np.int64)
+        self.node_attrs = dict(node_attrs or {})
+        self.edge_attrs = dict(edge_attrs or {})
+        self._index = None
+
+    @property
+    def n_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def n_edges(self):
+        return len(self.src)
+
+    @property
+    def index(self):
+        # node id -> position
+        if self._index is None:
+            self._index = pd.Index(self.node_ids)
+        return self._index
+
+    def positions(self, nodes):
+        # Vectorized id -> position, -1 for ids not in the graph
+        return self.index.get_indexer(np.asarray(list(nodes) if isinstance(nodes, (set, frozenset)) else nodes))
+
+    @classmethod
+    def from_networkx(cls, G):
+        node_ids = np.array(list(G.nodes()))
+        node_data = list(G.nodes.values())
+        node_keys = sorted({key for data in node_data for key in data})
+        node_attrs = {key: np.array([data.get(key) for data in node_data], dtype=object) for key in node_keys}
+        index = pd.Index(node_ids)
+        edges = list(G.edges(data=True))
+        src = index.get_indexer([u for u, _, _ in edges])
+        dst = index.get_indexer([v for _, v, _ in edges])
+        edge_keys = sorted({key for _, _, data in edges for key in data})
+        edge_attrs = {key: np.array([data.get(key) for _, _, data in edges], dtype=object) for key in edge_keys}
+        return cls(node_ids, src, dst, _narrow(node_attrs), _narrow(edge_attrs))
+
+    @classmethod
+    def from_connections(cls, people_profiles, people_connections, connection_types=None):
+        # Same graph as create_person_graph_with_relationship with every connection type switched on,
+        # built with vectorized joins: person nodes with their region, one edge per unordered pair (latest row wins)
+        from create_graph import CONNECTION_EDGE_TYPES
+        connection_types = connection_types or list(CONNECTION_EDGE_TYPES)
+        people_df = people_profiles[people_profiles.profile_type == "person"].drop_duplicates("id")
+        # Connection types are added in the order of create_person_graph_with_relationship
+        type_order = {connection_type: position for position, connection_type in enumerate(CONNECTION_EDGE_TYPES)}
+        connections = people_connections[people_connections["connection_type"].isin(connection_types)]
+        connections = connections.iloc[np.argsort(connections["connection_type"].map(type_order).to_numpy(), kind="stable")]
+        # networkx adds endpoints that are not person profiles as bare nodes
+        endpoints = pd.unique(np.concatenate([connections["source_id"].to_numpy(), connections["target_id"].to_numpy()]))
+        extra = endpoints[~pd.Index(endpoints).isin(people_df.id.to_numpy())]
+        node_ids = np.concatenate([people_df.id.to_numpy(), extra])
+        region = np.concatenate([people_df.region.to_numpy(dtype=object), np.full(len(extra), None, dtype=object)])
+        index = pd.Index(node_ids)
+        src = index.get_indexer(connections["source_id"].to_numpy())
+        dst = index.get_indexer(connections["target_id"].to_numpy())
+        # Undirected, no multi-edges: keep the last row for each unordered pair
+        low, high = np.minimum(src, dst), np.maximum(src, dst)
+        pair = pd.Series(low * len(node_ids) + high)
+        keep = ~pair.duplicated(keep="last").to_numpy()
+        edge_attrs = {
+            "label": connections["connection_type"].map(CONNECTION_EDGE_TYPES).to_numpy(dtype=object)[keep],
+            "unique_id": connections["id"].to_numpy()[keep],
+        }
+        return cls(node_ids, src[keep], dst[keep], {"region": region}, edge_attrs)
+
+    def to_networkx(self):
+        import networkx as nx
+
+        G = nx.Graph()
+        keys = list(self.node_attrs)
+        columns = [self.node_attrs[key] for key in keys]
+        G.add_nodes_from(
+            (node, {key: value for key, value in zip(keys, values) if not _is_null(value)})
+            for node, *values in zip(self.node_ids.tolist(), *[column.tolist() for column in columns])
+        )
+        edge_keys = list(self.edge_attrs)
+        edge_columns = [self.edge_attrs[key].tolist() for key in edge_keys]
+        ids = self.node_ids.tolist()
+        G.add_edges_from(
+            (ids[u], ids[v], {key: value for key, value in zip(edge_keys, values) if not _is_null(value)})
+            for u, v, *values in zip(self.src.tolist(), self.dst.tolist(), *edge_columns)
+        )
+        return G
+
+    def adjacency(self, weights=None, dtype=np.float64):
+        # Symmetric CSR adjacency (n_nodes x n_nodes), optional per-edge weights
+        import scipy.sparse as sp
+
+        data = np.ones(self.n_edges, dtype=dtype) if weights is None else np.asarray(weights, dtype=dtype)
+        rows = np.concatenate([self.src, self.dst])
+        cols = np.concatenate([self.dst, self.src])
+        adjacency = sp.csr_matrix((np.concatenate([data, data]), (rows, cols)), shape=(self.n_nodes, self.n_nodes))
+        adjacency.sum_duplicates()
+        return adjacency
+
+    def subgraph(self, positions):
+        # Induced subgraph on node positions, attributes carried along
+        positions = np.unique(np.asarray(positions, dtype=np.int64))
+        remap = np.full(self.n_nodes, -1, dtype=np.int64)
+        remap[positions] = np.arange(len(positions))
+        keep = (remap[self.src] >= 0) & (remap[self.dst] >= 0)
+        return GraphArrays(
+            self.node_ids[positions],
+            remap[self.src[keep]],
+            remap[self.dst[keep]],
+            {key: values[positions] for key, values in self.node_attrs.items()},
+            {key: values[keep] for key, values in self.edge_attrs.items()},
+        )
+
+
+class NodeTable:
+    # Node attributes as columns indexed by node position. Each column has a `valid` mask instead of
+    # sentinel values, so numeric columns stay numeric and missing values are simply not written back.
+    def __init__(self, node_ids):
+        self.node_ids = np.asarray(node_ids)
+        self.index = pd.Index(self.node_ids)
+        self.values = {}
+        self.valid = {}
+
+    @classmethod
+    def from_graph(cls, G):
+        return cls(list(G.nodes()))
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def positions(self, nodes):
+        return self.index.get_indexer(np.asarray(nodes))
+
+    def set(self, name, positions, values, dtype=None):
+        # values[i] goes to the node at positions[i]; the column is created on first use
+        values = np.asarray(values, dtype=dtype)
+        if name not in self.values:
+            self.values[name] = np.zeros(len(self), dtype=values.dtype) if values.dtype != object else np.full(len(self), None, dtype=object)
+            self.valid[name] = np.zeros(len(self), dtype=bool)
+        self.values[name][positions] = values
+        self.valid[name][positions] = True
+
+    def set_by_id(self, name, nodes, values, dtype=None):
+        # Same as set() keyed by node id, ids not in the table are ignored
+        positions = self.positions(nodes)
+        found = positions >= 0
+        self.set(name, positions[found], np.asarray(values, dtype=dtype)[found])
+
+    def column(self, name):
+        # Values with nulls filled in the numpy way (NaN for numbers, None for objects), e.g. for GraphArrays
+        values, valid = self.values[name], self.valid[name]
+        if valid.all():
+            return values
+        if values.dtype == object:
+            return np.where(valid, values, None)
+        return np.where(valid, values, np.nan)
+
+    def write_to_graph(self, G, names=None):
+        # Set each column as a node attribute, only on the nodes that have a value
+        import networkx as nx
+
+        for name in names or self.values:
+            valid = self.valid[name]
+            nx.set_node_attributes(G, dict(zip(self.node_ids[valid].tolist(), self.values[name][valid].tolist())), name)
+        return G
+
+
+def _is_null(value):
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+def _narrow(attrs):
+    # object arrays -> numeric arrays when every non-null value is numeric (None -> NaN for floats)
+    narrowed = {}
+    for key, values in attrs.items():
+        non_null = [value for value in values if not _is_null(value)]
+        if non_null and all(isinstance(value, (bool, np.bool_)) for value in non_null) and len(non_null) == len(values):
+            narrowed[key] = values.astype(bool)
+        elif non_null and all(isinstance(value, (int, np.integer)) and not isinstance(value, (bool, np.bool_)) for value in non_null) and len(non_null) == len(values):
+            narrowed[key] = values.astype(np.int64)
+        elif non_null and all(isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, (bool, np.bool_)) for value in non_null):
+            narrowed[key] = np.array([np.nan if _is_null(value) else value for value in values], dtype=np.float64)
+        else:
+            narrowed[key] = values
+    return narrowed
@@ -0,0 +1,287 @@
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from graph_arrays import GraphArrays
+from instrumentation import span
+
+# Streaming graph exporters. Nodes and edges are formatted a chunk at a time straight from the GraphArrays
+# columns and appended to the file, so memory stays flat however many edges there are.
+#   GraphML  - networkx, Gephi, yEd
+#   GEXF     - Gephi
+#   Parquet  - <dir>/nodes.parquet (id + attributes) and <dir>/edges.parquet (source, target + attributes)
+# load_graph() reads any of the three back; XML is parsed incrementally with iterparse.
+
+CHUNK_SIZE = 100_000
+
+GRAPHML_NS = "http://graphml.graphdrawing.org/xmlns"
+GEXF_NS = "http://www.gexf.net/1.2draft"
+
+PARSERS = {
+    "boolean": lambda text: text.lower() in ("true", "1"),
+    "long": int,
+    "double": float,
+    "string": str,
+}
+ARROW_TYPES = {"boolean": pa.bool_(), "long": pa.int64(), "double": pa.float64(), "string": pa.string()}
+
+
+def _value_type(values):
+    # Attribute type of a column; object columns (e.g. numbers mixed with strings) are written as strings
+    if values.dtype == bool:
+        return "boolean"
+    if np.issubdtype(values.dtype, np.integer):
+        return "long"
+    if np.issubdtype(values.dtype, np.floating):
+        return "double"
+    return "string"
+
+
+def _escape(strings):
+    return (strings.str.replace("&", "&amp;", regex=False)
+            .str.replace("<", "&lt;", regex=False)
+            .str.replace(">", "&gt;", regex=False)
+            .str.replace('"', "&quot;", regex=False))
+
+
+def _escape_one(text):
+    return _escape(pd.Series([str(text)]))[0]
+
+
+def _formatted(values):
+    # Column chunk -> escaped strings (object Series), NaN where the value is missing
+    series = pd.Series(values, dtype=object if values.dtype == object else None)
+    missing = series.isna().to_numpy()
+    if values.dtype == bool:
+        strings = pd.Series(np.where(values, "true", "false"), dtype=object)
+    elif values.dtype.kind in "iuf":
+        strings = series.astype(str).astype(object)
+    else:
+        strings = _escape(series.astype(str).astype(object))
+    strings[missing] = np.nan
+    return strings
+
+
+def _fragments(values, prefix, suffix):
+    # prefix + value + suffix per row, "" where the value is missing
+    return (prefix + _formatted(values) + suffix).fillna("")
+
+
+def _chunks(n, chunk_size):
+    for start in range(0, n, chunk_size):
+        yield slice(start, min(start + chunk_size, n))
+
+
+def _node_id_strings(arrays):
+    return _escape(pd.Series(arrays.node_ids).astype(str).astype(object)).to_numpy()
+
+
+def write_graphml(arrays, path, chunk_size=CHUNK_SIZE):
+    with span("write_graphml", path=path, nodes=arrays.n_nodes, edges=arrays.n_edges), open(path, "w", encoding="utf-8") as f:
+        f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<graphml xmlns="{GRAPHML_NS}">\n')
+        keys = {"node": {}, "edge": {}}
+        for scope, attrs in (("node", arrays.node_attrs), ("edge", arrays.edge_attrs)):
+            for name, values in attrs.items():
+                key = keys[scope][name] = f"d{len(keys['node']) + len(keys['edge'])}"
+                f.write(f'  <key id="{key}" for="{scope}" attr.name="{_escape_one(name)}" attr.type="{_value_type(values)}"/>\n')
+        f.write('  <graph edgedefault="undirected">\n')
+        ids = _node_id_strings(arrays)
+        for rows in _chunks(arrays.n_nodes, chunk_size):
+            lines = '    <node id="' + pd.Series(ids[rows]) + '">'
+            for name, values in arrays.node_attrs.items():
+                lines = lines + _fragments(values[rows], f'<data key="{keys["node"][name]}">', "</data>")
+            f.write("\n".join(lines + "</node>") + "\n")
+        for rows in _chunks(arrays.n_edges, chunk_size):
+            lines = '    <edge source="' + pd.Series(ids[arrays.src[rows]]) + '" target="' + pd.Series(ids[arrays.dst[rows]]) + '">'
+            for name, values in arrays.edge_attrs.items():
+                lines = lines + _fragments(values[rows], f'<data key="{keys["edge"][name]}">', "</data>")
+            f.write("\n".join(lines + "</edge>") + "\n")
+        f.write("  </graph>\n</graphml>\n")
+    return path
+
+
+def write_gexf(arrays, path, chunk_size=CHUNK_SIZE):
+    with span("write_gexf", path=path, nodes=arrays.n_nodes, edges=arrays.n_edges), open(path, "w", encoding="utf-8") as f:
+        f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<gexf xmlns="{GEXF_NS}" version="1.2">\n')
+        f.write('  <graph mode="static" defaultedgetype="undirected">\n')
+        for scope, attrs in (("node", arrays.node_attrs), ("edge", arrays.edge_attrs)):
+            f.write(f'    <attributes class="{scope}">\n')
+            for position, (name, values) in enumerate(attrs.items()):
+                f.write(f'      <attribute id="{position}" title="{_escape_one(name)}" type="{_value_type(values)}"/>\n')
+            f.write("    </attributes>\n")
+
+        def attvalues(attrs, rows):
+            values = pd.Series([""] * (rows.stop - rows.start), dtype=object)
+            for position, column in enumerate(attrs.values()):
+                values = values + _fragments(column[rows], f'<attvalue for="{position}" value="', '"/>')
+            return "<attvalues>" + values + "</attvalues>" if attrs else values
+
+        ids = _node_id_strings(arrays)
+        f.write("    <nodes>\n")
+        for rows in _chunks(arrays.n_nodes, chunk_size):
+            node_ids = pd.Series(ids[rows])
+            lines = '      <node id="' + node_ids + '" label="' + node_ids + '">' + attvalues(arrays.node_attrs, rows) + "</node>"
+            f.write("\n".join(lines) + "\n")
+        f.write("    </nodes>\n    <edges>\n")
+        for rows in _chunks(arrays.n_edges, chunk_size):
+            edge_ids = pd.Series(np.arange(rows.start, rows.stop)).astype(str).astype(object)
+            lines = ('      <edge id="' + edge_ids + '" source="' + pd.Series(ids[arrays.src[rows]])
+                     + '" target="' + pd.Series(ids[arrays.dst[rows]]) + '">' + attvalues(arrays.edge_attrs, rows) + "</edge>")
+            f.write("\n".join(lines) + "\n")
+        f.write("    </edges>\n  </graph>\n</gexf>\n")
+    return path
+
+
+def _arrow_column(values):
+    value_type = _value_type(values)
+    if value_type == "string":
+        values = pd.Series(values, dtype=object)
+        values = values.where(values.isna(), values.astype(str))
+        return pa.array(values.where(values.notna(), None).to_numpy(dtype=object), type=pa.string())
+    return pa.array(values, type=ARROW_TYPES[value_type], from_pandas=True)
+
+
+def _write_table(path, columns, n_rows, chunk_size):
+    writer = None
+    for rows in _chunks(n_rows, chunk_size):
+        batch = pa.RecordBatch.from_arrays([_arrow_column(values[rows]) for values in columns.values()], names=list(columns))
+        if writer is None:
+            writer = pq.ParquetWriter(path, batch.schema, compression="zstd")
+        writer.write_batch(batch)
+    if writer is None:
+        pq.write_table(pa.Table.from_arrays([_arrow_column(values) for values in columns.values()], names=list(columns)), path)
+    else:
+        writer.close()
+
+
+def write_parquet(arrays, directory, chunk_size=CHUNK_SIZE):
+    # Node table and edge list, edges reference node ids (not positions) so other tools can join on them
+    with span("write_parquet", path=directory, nodes=arrays.n_nodes, edges=arrays.n_edges):
+        os.makedirs(directory, exist_ok=True)
+        _write_table(os.path.join(directory, "nodes.parquet"), {"id": arrays.node_ids, **arrays.node_attrs}, arrays.n_nodes, chunk_size)
+        edge_columns = {"source": arrays.node_ids[arrays.src], "target": arrays.node_ids[arrays.dst], **arrays.edge_attrs}
+        _write_table(os.path.join(directory, "edges.parquet"), edge_columns, arrays.n_edges, chunk_size)
+    return directory
+
+
+def write_graph(arrays, path, chunk_size=CHUNK_SIZE):
+    # Format from the path: .graphml, .gexf, anything else is a Parquet directory
+    if path.endswith(".graphml"):
+        return write_graphml(arrays, path, chunk_size)
+    if path.endswith(".gexf"):
+        return write_gexf(arrays, path, chunk_size)
+    return write_parquet(arrays, path, chunk_size)
+
+
+def _node_ids(ids, node_type):
+    if node_type is None:
+        return np.array(ids, dtype=object)
+    try:
+        return np.array([node_type(node) for node in ids])
+    except ValueError:
+        return np.array(ids, dtype=object)
+
+
+def _columns(rows, declarations):
+    # rows: one {name: value} per element; declarations: name -> type
+    columns = {}
+    for name, value_type in declarations.items():
+        values = [row.get(name) for row in rows]
+        if value_type == "double":
+            columns[name] = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+        elif value_type in ("long", "boolean") and all(value is not None for value in values):
+            columns[name] = np.array(values, dtype=np.int64 if value_type == "long" else bool)
+        else:
+            columns[name] = np.array(values, dtype=object)
+    return columns
+
+
+def _read_xml(path, node_type):
+    # Single pass over the document, every element is cleared once it has been read
+    graphml = f"{{{GRAPHML_NS}}}"
+    gexf = f"{{{GEXF_NS}}}"
+    declarations = {"node": {}, "edge": {}}
+    keys = {}
+    node_ids, node_rows, sources, targets, edge_rows = [], [], [], [], []
+    scope = None
+    for event, element in ET.iterparse(path, events=("start", "end")):
+        tag = element.tag
+        if event == "start":
+            if tag == f"{gexf}attributes":
+                scope = element.get("class")
+            continue
+        if tag == f"{graphml}key":
+            name, value_type = element.get("attr.name"), element.get("attr.type", "string")
+            keys[element.get("id")] = (name, value_type)
+            declarations[element.get("for")][name] = value_type
+        elif tag == f"{gexf}attribute":
+            name, value_type = element.get("title"), element.get("type", "string")
+            keys[(scope, element.get("id"))] = (name, value_type)
+            declarations[scope][name] = value_type
+        elif tag in (f"{graphml}node", f"{graphml}edge"):
+            row = {}
+            for data in element.iter(f"{graphml}data"):
+                name, value_type = keys[data.get("key")]
+                row[name] = PARSERS.get(value_type, str)(data.text or "")
+            if tag == f"{graphml}node":
+                node_ids.append(element.get("id"))
+                node_rows.append(row)
+            else:
+                sources.append(element.get("source"))
+                targets.append(element.get("target"))
+                edge_rows.append(row)
+            element.clear()
+        elif tag in (f"{gexf}node", f"{gexf}edge"):
+            kind = "node" if tag == f"{gexf}node" else "edge"
+            row = {}
+            for data in element.iter(f"{gexf}attvalue"):
+                name, value_type = keys[(kind, data.get("for"))]
+                row[name] = PARSERS.get(value_type, str)(data.get("value"))
+            if kind == "node":
+                node_ids.append(element.get("id"))
+                node_rows.append(row)
+            else:
+                sources.append(element.get("source"))
+                targets.append(element.get("target"))
+                edge_rows.append(row)
+            element.clear()
+    index = pd.Index(node_ids)
+    return GraphArrays(
+        _node_ids(node_ids, node_type),
+        index.get_indexer(sources),
+        index.get_indexer(targets),
+        _columns(node_rows, declarations["node"]),
+        _columns(edge_rows, declarations["edge"]),
+    )
+
+
+def _read_parquet(directory):
+    def columns(table):
+        return {name: table.column(name).to_numpy(zero_copy_only=False) for name in table.column_names}
+
+    nodes = columns(pq.read_table(os.path.join(directory, "nodes.parquet")))
+    edges = columns(pq.read_table(os.path.join(directory, "edges.parquet")))
+    node_ids = nodes.pop("id")
+    index = pd.Index(node_ids)
+    return GraphArrays(node_ids, index.get_indexer(edges.pop("source")), index.get_indexer(edges.pop("target")), nodes, edges)
+
+
+def read_graph_arrays(path, node_type=int):
+    # GraphArrays from a .graphml / .gexf file or a Parquet directory written by write_graph.
+    # XML node ids are converted with node_type when they all parse (ints, like the graph create_graph.py builds)
+    with span("read_graph", path=path) as counters:
+        if os.path.isdir(path):
+            arrays = _read_parquet(path)
+        else:
+            arrays = _read_xml(path, node_type)
+        counters["nodes"] = arrays.n_nodes
+        counters["edges"] = arrays.n_edges
+    return arrays
+
+
+def load_graph(path, node_type=int):
+    return read_graph_arrays(path, node_type).to_networkx()
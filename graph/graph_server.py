@@ -0,0 +1,387 @@
+import argparse
+import http.client
+import json
+import os
+import socket
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import span
+from lod_explorer import LODIndex
+
+# One process serves the graph to the notebook, the dashboard and scripts. The snapshot is a directory of
+# .npy arrays opened with mmap, so the pages live once in the OS page cache however many clients query it.
+#   python graph_server.py snapshot --db ../social_network_anonymized.db --out graph_snapshot
+#   python graph_server.py serve --snapshot graph_snapshot --port 8765      (or --socket /tmp/ethack-graph.sock)
+# Clients use GraphClient("http://127.0.0.1:8765") or GraphClient("unix:///tmp/ethack-graph.sock").
+#
+# Snapshot layout: CSR adjacency (indptr, indices) with the edge label code and unique_id per entry,
+# node ids, one array per node attribute (strings dictionary-encoded, -1 for missing), and the post
+# timeline sorted by node then time with per-node offsets. meta.json holds the dictionaries and a version.
+# The level-of-detail index (lod.*.npy, see lod_explorer.py) adds /viewport for the whole-network explorer.
+
+GRAPH_SERVER_ENV = "ETHACK_GRAPH_SERVER"
+
+
+def _csr(arrays):
+    # Both directions of every edge, sorted by (row, column), keeping the edge index for its attributes
+    rows = np.concatenate([arrays.src, arrays.dst])
+    columns = np.concatenate([arrays.dst, arrays.src])
+    edges = np.concatenate([np.arange(arrays.n_edges)] * 2)
+    order = np.lexsort((columns, rows))
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=arrays.n_nodes))])
+    return indptr.astype(np.int64), columns[order].astype(np.int64), edges[order]
+
+
+def _encode(values):
+    # numeric columns as they are, anything else dictionary-encoded with -1 for missing
+    values = np.asarray(values)
+    if values.dtype.kind in "biuf":
+        return values, None
+    codes, categories = pd.factorize(pd.Series(values, dtype=object))
+    return codes.astype(np.int32), [str(category) for category in categories]
+
+
+def write_snapshot(arrays, directory, node_columns=None, posts=None):
+    # arrays: GraphArrays; node_columns: extra per-node columns (name -> Series by node id, e.g. risk scores);
+    # posts: DataFrame with profile_id, timestamp, traffic_likelihood for the timelines
+    with span("write_snapshot", path=directory, nodes=arrays.n_nodes, edges=arrays.n_edges):
+        os.makedirs(directory, exist_ok=True)
+        indptr, indices, edges = _csr(arrays)
+        meta = {"version": pd.Timestamp.now().isoformat(), "nodes": arrays.n_nodes, "edges": arrays.n_edges,
+                "node_columns": {}, "edge_columns": {}}
+        np.save(os.path.join(directory, "indptr.npy"), indptr)
+        np.save(os.path.join(directory, "indices.npy"), indices)
+        np.save(os.path.join(directory, "node_ids.npy"), arrays.node_ids)
+        columns = dict(arrays.node_attrs)
+        for name, values in (node_columns or {}).items():
+            columns[name] = values.reindex(arrays.node_ids).to_numpy()
+        for name, values in columns.items():
+            encoded, categories = _encode(values)
+            np.save(os.path.join(directory, f"node.{name}.npy"), encoded)
+            meta["node_columns"][name] = categories
+        for name, values in arrays.edge_attrs.items():
+            encoded, categories = _encode(values[edges])
+            np.save(os.path.join(directory, f"edge.{name}.npy"), encoded)
+            meta["edge_columns"][name] = categories
+        if posts is not None:
+            positions = arrays.positions(posts["profile_id"].to_numpy())
+            posts = posts.assign(position=positions)[positions >= 0].sort_values(["position", "timestamp"])
+            offsets = np.searchsorted(posts["position"].to_numpy(), np.arange(arrays.n_nodes + 1))
+            np.save(os.path.join(directory, "timeline.offsets.npy"), offsets.astype(np.int64))
+            np.save(os.path.join(directory, "timeline.timestamp.npy"), posts["timestamp"].to_numpy(dtype=np.int64))
+            np.save(os.path.join(directory, "timeline.traffic_likelihood.npy"), posts["traffic_likelihood"].to_numpy(dtype=np.float64))
+            meta["timeline"] = True
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump(meta, f)
+    return directory
+
+
+class GraphSnapshot:
+    # Read-only, memory-mapped view of a snapshot directory; every query touches only the rows it needs
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+
+        def load(name):
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+        self.indptr = load("indptr")
+        self.indices = load("indices")
+        self.node_ids = np.asarray(load("node_ids"))
+        self.index = pd.Index(self.node_ids)
+        self.node_columns = {name: load(f"node.{name}") for name in self.meta["node_columns"]}
+        self.edge_columns = {name: load(f"edge.{name}") for name in self.meta["edge_columns"]}
+        if self.meta.get("timeline"):
+            self.timeline_offsets = load("timeline.offsets")
+            self.timeline_timestamp = load("timeline.timestamp")
+            self.timeline_traffic_likelihood = load("timeline.traffic_likelihood")
+        self.lod = LODIndex.load(directory) if os.path.exists(os.path.join(directory, "lod.json")) else None
+
+    @property
+    def version(self):
+        return self.meta["version"]
+
+    def position(self, node):
+        position = self.index.get_indexer([node])[0]
+        if position < 0:
+            raise KeyError(node)
+        return position
+
+    def _decode(self, values, categories):
+        if categories is None:
+            return [None if isinstance(value, float) and np.isnan(value) else value for value in np.asarray(values).tolist()]
+        return [categories[code] if code >= 0 else None for code in np.asarray(values).tolist()]
+
+    def node_attributes(self, nodes):
+        positions = self.index.get_indexer(list(nodes))
+        positions = positions[positions >= 0]
+        columns = {name: self._decode(values[positions], self.meta["node_columns"][name]) for name, values in self.node_columns.items()}
+        return [{"id": node, **{name: column[row] for name, column in columns.items()}}
+                for row, node in enumerate(self.node_ids[positions].tolist())]
+
+    def neighbours(self, node):
+        position = self.position(node)
+        start, end = self.indptr[position], self.indptr[position + 1]
+        neighbours = self.node_ids[self.indices[start:end]].tolist()
+        edges = {name: self._decode(values[start:end], self.meta["edge_columns"][name]) for name, values in self.edge_columns.items()}
+        return [{"id": neighbour, **{name: column[row] for name, column in edges.items()}} for row, neighbour in enumerate(neighbours)]
+
+    def ego(self, node, max_nodes=2000):
+        # Node, its neighbours (first max_nodes) and every edge among them, like select_subgraph_with_single_node
+        position = self.position(node)
+        members = np.concatenate([[position], self.indices[self.indptr[position]:self.indptr[position + 1]]])[:max_nodes]
+        member_set = np.sort(members)
+        edges = []
+        for member in members.tolist():
+            start, end = self.indptr[member], self.indptr[member + 1]
+            columns = np.asarray(self.indices[start:end])
+            inside = np.flatnonzero((columns > member) & np.isin(columns, member_set, assume_unique=False))
+            if not len(inside):
+                continue
+            attributes = {name: self._decode(values[start:end][inside], self.meta["edge_columns"][name]) for name, values in self.edge_columns.items()}
+            for row, other in enumerate(columns[inside].tolist()):
+                edges.append({"source": self.node_ids[member].item(), "target": self.node_ids[other].item(),
+                              **{name: column[row] for name, column in attributes.items()}})
+        return {"nodes": self.node_attributes(self.node_ids[members].tolist()), "edges": edges}
+
+    def timeline(self, node):
+        if not self.meta.get("timeline"):
+            return {"timestamp": [], "traffic_likelihood": []}
+        position = self.position(node)
+        start, end = self.timeline_offsets[position], self.timeline_offsets[position + 1]
+        return {"timestamp": self.timeline_timestamp[start:end].tolist(),
+                "traffic_likelihood": self.timeline_traffic_likelihood[start:end].tolist()}
+
+    def top_k(self, column, k=20):
+        values = np.asarray(self.node_columns[column], dtype=np.float64)
+        values = np.where(np.isnan(values), -np.inf, values)
+        k = min(k, len(values))
+        top = np.argpartition(-values, k - 1)[:k] if k else np.empty(0, dtype=np.int64)
+        top = top[np.argsort(-values[top], kind="stable")]
+        return self.node_attributes(self.node_ids[top].tolist())
+
+
+def _node_id(value):
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+class GraphRequestHandler(BaseHTTPRequestHandler):
+    # GET /info, /node?id=1&id=2, /neighbours?id=1, /ego?id=1&max_nodes=500, /timeline?id=1, /top?column=risk_score&k=20,
+    #     /viewport?x0=0&y0=0&x1=1&y1=1&zoom=6&max_nodes=2000
+    snapshot = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        ids = [_node_id(value) for value in query.get("id", [])]
+        snapshot = self.snapshot
+        try:
+            if url.path == "/info":
+                body = {"version": snapshot.version, **{key: snapshot.meta[key] for key in ("nodes", "edges")},
+                        "node_columns": list(snapshot.node_columns), "lod": snapshot.lod is not None}
+            elif url.path == "/node":
+                body = snapshot.node_attributes(ids)
+            elif url.path == "/neighbours":
+                body = snapshot.neighbours(ids[0])
+            elif url.path == "/ego":
+                body = snapshot.ego(ids[0], int(query.get("max_nodes", [2000])[0]))
+            elif url.path == "/timeline":
+                body = snapshot.timeline(ids[0])
+            elif url.path == "/top":
+                body = snapshot.top_k(query["column"][0], int(query.get("k", [20])[0]))
+            elif url.path == "/viewport" and snapshot.lod is not None:
+                bounds = {key: float(query[key][0]) for key in ("x0", "y0", "x1", "y1") if key in query}
+                limits = {key: int(query[key][0]) for key in ("zoom", "max_nodes", "max_edges") if key in query}
+                view = snapshot.lod.query(**bounds, **limits)
+                body = {key: value.to_dict(orient="records") if isinstance(value, pd.DataFrame) else value for key, value in view.items()}
+            else:
+                return self._reply(404, {"error": f"unknown endpoint {url.path}"})
+        except (KeyError, IndexError) as error:
+            return self._reply(404, {"error": f"not found: {error}"})
+        self._reply(200, body)
+
+    def _reply(self, status, body):
+        payload = json.dumps(body, default=lambda value: value.item() if hasattr(value, "item") else str(value)).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("X-Graph-Version", self.snapshot.version)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def address_string(self):
+        # Unix socket peers have no host
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("unix", 0)
+
+
+def serve(snapshot_dir, host="127.0.0.1", port=8765, socket_path=None):
+    handler = type("Handler", (GraphRequestHandler,), {"snapshot": GraphSnapshot(snapshot_dir)})
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, handler)
+        print(f"Serving {snapshot_dir} on unix://{socket_path}")
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        print(f"Serving {snapshot_dir} on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=30):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class GraphClient:
+    # Thin client for the graph server, address "http://host:port" or "unix:///path/to.sock"
+    def __init__(self, address=None, timeout=30):
+        self.address = address or os.environ.get(GRAPH_SERVER_ENV, "http://127.0.0.1:8765")
+        self.timeout = timeout
+        self.version = None
+
+    def _connection(self):
+        url = urlparse(self.address)
+        if url.scheme == "unix":
+            return _UnixHTTPConnection(url.path, self.timeout)
+        return http.client.HTTPConnection(url.hostname, url.port or 80, timeout=self.timeout)
+
+    def _get(self, path, **params):
+        connection = self._connection()
+        try:
+            connection.request("GET", f"{path}?{urlencode(params, doseq=True)}")
+            response = connection.getresponse()
+            body = json.loads(response.read())
+            self.version = response.getheader("X-Graph-Version")
+        finally:
+            connection.close()
+        if response.status == 404:
+            raise KeyError(body["error"])
+        if response.status != 200:
+            raise RuntimeError(f"graph server returned {response.status}: {body}")
+        return body
+
+    def info(self):
+        return self._get("/info")
+
+    def node_attributes(self, nodes):
+        return self._get("/node", id=list(nodes))
+
+    def neighbours(self, node):
+        return self._get("/neighbours", id=node)
+
+    def ego(self, node, max_nodes=2000):
+        return self._get("/ego", id=node, max_nodes=max_nodes)
+
+    def ego_graph(self, node, max_nodes=2000):
+        # networkx graph of the ego network, ready for plot_subgraph_in_plotly
+        import networkx as nx
+        ego = self.ego(node, max_nodes)
+        graph = nx.Graph()
+        graph.add_nodes_from((row.pop("id"), {key: value for key, value in row.items() if value is not None}) for row in ego["nodes"])
+        graph.add_edges_from((row.pop("source"), row.pop("target"), {key: value for key, value in row.items() if value is not None}) for row in ego["edges"])
+        return graph
+
+    def timeline(self, node):
+        return pd.DataFrame(self._get("/timeline", id=node))
+
+    def top_k(self, column="risk_score", k=20):
+        return pd.DataFrame(self._get("/top", column=column, k=k))
+
+    def viewport(self, x0=0.0, y0=0.0, x1=1.0, y1=1.0, zoom=None, max_nodes=2000, max_edges=5000):
+        # Nodes, density tiles and edges inside the viewport, as DataFrames (see LODIndex.query)
+        params = {"x0": x0, "y0": y0, "x1": x1, "y1": y1, "max_nodes": max_nodes, "max_edges": max_edges}
+        if zoom is not None:
+            params["zoom"] = zoom
+        view = self._get("/viewport", **params)
+        return {key: pd.DataFrame(value) if isinstance(value, list) else value for key, value in view.items()}
+
+
+def build_snapshot(db_path, out_dir, posts_path="translated_posts.parquet", store_dir="enrichment_store", seed_params=None, scores_dir="."):
+    # Graph from the DB, per-profile traffic_likelihood, risk scores and harmonic predictions, structural features,
+    # post timelines
+    from create_graph import CONNECTION_EDGE_TYPES
+    from db_access import connections, profiles
+    from enrichment_store import load_posts
+    from graph_arrays import GraphArrays
+    from hybrid_model import read_scores
+    from risk_propagation import personalized_pagerank
+    from seed_selection import profile_aggregates, select_seeds
+    from sharded import sharded_harmonic_function
+    from structural_features import structural_features
+
+    arrays = GraphArrays.from_connections(profiles(db_path, profile_type="person"),
+                                          connections(db_path, connection_types=list(CONNECTION_EDGE_TYPES)))
+    posts = load_posts(["id", "profile_id", "timestamp", "traffic_likelihood"], store_dir=store_dir, legacy_path=posts_path, db_path=db_path)
+    posts = posts.dropna(subset=["profile_id"]).astype({"profile_id": int})
+    aggregates = profile_aggregates(posts)
+    suspicious, not_suspicious = select_seeds(aggregates, seed_params)
+    columns = {"traffic_likelihood": aggregates["sum"], "n_posts": aggregates["n_posts"]}
+    if len(suspicious):
+        columns["risk_score"] = personalized_pagerank(arrays, suspicious)
+        if len(not_suspicious):
+            predictions, _ = sharded_harmonic_function(arrays, aggregates["sum"], suspicious, not_suspicious)
+            columns["suspicious_probability"] = predictions["suspicious_probability"]
+            columns["graph_based_prediction"] = predictions["graph_based_prediction"]
+    # Structural features ride along as node columns: /node, /ego and /top?column=clustering serve them
+    columns.update(structural_features(arrays).items())
+    # hybrid_model.py output, when it has been run against this store
+    hybrid = read_scores(scores_dir)
+    if hybrid is not None:
+        columns["hybrid_score"] = hybrid["hybrid_score"]
+    write_snapshot(arrays, out_dir, columns, posts)
+    # Global layout computed once here; tiles are coloured by mean risk where there is one
+    scores = columns["risk_score"].reindex(arrays.node_ids).to_numpy() if "risk_score" in columns else None
+    LODIndex.build(arrays, scores=scores).save(out_dir)
+    return out_dir
+
+
+if __name__ == "__main__":
+    from create_graph import DB_PATH
+
+    parser = argparse.ArgumentParser(description="Shared graph snapshot server")
+    commands = parser.add_subparsers(dest="command", required=True)
+    snapshot_parser = commands.add_parser("snapshot", help="build a snapshot directory from the DB and the enrichment output")
+    snapshot_parser.add_argument("--db", default=DB_PATH)
+    snapshot_parser.add_argument("--posts", default="translated_posts.parquet")
+    snapshot_parser.add_argument("--store", default="enrichment_store")
+    snapshot_parser.add_argument("--out", default="graph_snapshot")
+    snapshot_parser.add_argument("--seed-thresholds", choices=["absolute", "quantile"], default="absolute")
+    snapshot_parser.add_argument("--scores-dir", default=".", help="where hybrid_model.py / the pipeline wrote profile_scores.parquet")
+    serve_parser = commands.add_parser("serve", help="serve a snapshot over local HTTP or a Unix socket")
+    serve_parser.add_argument("--snapshot", default="graph_snapshot")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--socket", default=None, help="Unix socket path instead of host/port")
+    args = parser.parse_args()
+
+    if args.command == "snapshot":
+        build_snapshot(args.db, args.out, args.posts, args.store, {"thresholds": args.seed_thresholds}, args.scores_dir)
+    else:
+        serve(args.snapshot, args.host, args.port, args.socket)
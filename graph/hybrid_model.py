@@ -0,0 +1,302 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from enrichment_store import ENTITY_COLUMNS
+from instrumentation import span
+from structural_features import simple_csr, structural_features
+
+# One suspicion score per profile from three kinds of features, instead of llm_based_prediction and
+# graph_based_prediction side by side:
+#   graph       structural_features.py columns (typed degree, triangles, clustering, core number, ego density)
+#   neighbours  per-profile mean traffic_likelihood aggregated over the graph with sparse products:
+#               nbr1_* over neighbours, nbr2_* over walks of two steps that do not come back to the profile
+#   posts       n_posts, own llm_sum / llm_mean / llm_max, per-post rates of each SuspiciousActions value and of
+#               species / location / PII mentions
+# The model is scikit-learn's HistGradientBoostingClassifier (missing values are native, so profiles without
+# posts or without posting neighbours need no imputation). Without reviewed labels it is trained on the
+# propagation seeds (select_seeds), which are cut on the profile's own traffic_likelihood totals, so n_posts
+# and the own llm_* columns are left out then (they reproduce the cut); the model learns what the graph and
+# the post content say about those labels and scores every profile, including the ones that never posted.
+# Scores go to <out>/profile_scores.parquet, the held-out calibration report (Brier, log loss, AUC, expected
+# calibration error, reliability table) to profile_scores.calibration.json. Not into the store: it is an input
+# of the pipeline stages, so writing there would invalidate them on every run.
+#   python hybrid_model.py --store enrichment_store [--labels reviewed.parquet] [--out .]
+
+SEED_SOURCE_COLUMNS = ["n_posts", "llm_sum", "llm_mean", "llm_max"]
+# entity list columns in translated_posts.parquet, and their <kind>_ids counterparts in the enrichment store
+MENTION_COLUMNS = {**ENTITY_COLUMNS, **{f"{kind}_ids": kind for kind in ENTITY_COLUMNS.values()}}
+
+DEFAULT_PARAMS = {
+    "max_iter": 300,
+    "learning_rate": 0.05,
+    "max_leaf_nodes": 31,
+    "min_samples_leaf": 20,
+    "l2_regularization": 1.0,
+    "test_size": 0.25,
+    "seed": 0,
+}
+
+
+def post_columns(store_dir="enrichment_store"):
+    # What load_posts has to read for post_features: entity lists are stored as <kind>_ids in the store
+    in_store = bool(store_dir) and os.path.isdir(os.path.join(store_dir, "posts"))
+    entities = [f"{kind}_ids" if in_store else column for column, kind in ENTITY_COLUMNS.items()]
+    return ["profile_id", "traffic_likelihood", "actions"] + entities
+
+
+def _segment_top2(indptr, indices, values):
+    # Per row of the CSR: largest neighbour value, which neighbour holds it, and the second largest (-inf if none)
+    n = len(indptr) - 1
+    top = np.full(n, -np.inf)
+    holder = np.full(n, -1, dtype=np.int64)
+    second = np.full(n, -np.inf)
+    rows = np.flatnonzero(np.diff(indptr))
+    if not len(rows):
+        return top, holder, second
+    entries = values[indices]
+    starts = indptr[rows]
+    top[rows] = np.maximum.reduceat(entries, starts)
+    at_top = np.flatnonzero(entries == np.repeat(top, np.diff(indptr)))
+    first = at_top[np.searchsorted(at_top, starts)]
+    holder[rows] = indices[first]
+    entries[first] = -np.inf
+    second[rows] = np.maximum.reduceat(entries, starts)
+    return top, holder, second
+
+
+def neighbour_scores(indptr, indices, score):
+    # score: per node position, NaN where the profile has no posts
+    import scipy.sparse as sp
+
+    n = len(indptr) - 1
+    has = ~np.isnan(score)
+    value = np.where(has, score, 0.0)
+    degree = np.diff(indptr)
+    adjacency = sp.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(n, n))
+    with span("neighbour_scores", nodes=n):
+        total1, count1 = adjacency @ value, adjacency @ has.astype(np.float64)
+        # two-step walks, minus the degree(v) walks that go out and straight back to v
+        total2 = adjacency @ total1 - degree * value
+        count2 = adjacency @ count1 - degree * has
+        top, holder, second = _segment_top2(indptr, indices, np.where(has, score, -np.inf))
+        # best two-step value through each neighbour u: u's best neighbour, or its second best if that is v itself
+        owners = np.repeat(np.arange(n), degree)
+        through = np.where(holder[indices] == owners, second[indices], top[indices])
+        top2 = np.full(n, -np.inf)
+        rows = np.flatnonzero(degree)
+        if len(rows):
+            top2[rows] = np.maximum.reduceat(through, indptr[rows])
+    return {
+        "nbr1_posting": count1,
+        "nbr1_mean": np.divide(total1, count1, out=np.full(n, np.nan), where=count1 > 0),
+        "nbr1_max": np.where(np.isfinite(top), top, np.nan),
+        "nbr2_mean": np.divide(total2, count2, out=np.full(n, np.nan), where=count2 > 0),
+        "nbr2_max": np.where(np.isfinite(top2), top2, np.nan),
+    }
+
+
+def post_features(posts):
+    # Per-profile post-level features, computed on the arrow list columns without exploding them
+    posts = posts.dropna(subset=["profile_id"])
+    with span("post_features", posts=len(posts)) as counters:
+        profile_codes, profile_ids = pd.factorize(posts["profile_id"].astype(np.int64))
+        n = len(profile_ids)
+        n_posts = np.bincount(profile_codes, minlength=n).astype(np.float64)
+        traffic = posts["traffic_likelihood"].to_numpy(dtype=np.float64)
+        llm_sum = np.bincount(profile_codes, weights=traffic, minlength=n)
+        llm_max = np.full(n, -np.inf)
+        np.maximum.at(llm_max, profile_codes, traffic)
+        columns = {"n_posts": n_posts, "llm_sum": llm_sum, "llm_mean": llm_sum / n_posts, "llm_max": llm_max}
+        table = pa.Table.from_pandas(posts[[column for column in posts.columns if column == "actions" or column in MENTION_COLUMNS]], preserve_index=False)
+        if "actions" in table.column_names:
+            # structured_output pulls in pydantic, only needed here
+            from structured_output import ACTIONS
+
+            actions = table.column("actions").combine_chunks()
+            flat = pc.list_flatten(actions)
+            codes = (pc.index_in(flat.cast(pa.string()), value_set=pa.array(ACTIONS)) if not pa.types.is_integer(flat.type) else flat)
+            codes = codes.to_numpy(zero_copy_only=False)
+            owners = profile_codes[pc.list_parent_indices(actions).to_numpy()]
+            valid = ~pd.isna(codes)
+            counts = np.bincount(owners[valid] * len(ACTIONS) + codes[valid].astype(np.int64), minlength=n * len(ACTIONS))
+            for code, action in enumerate(ACTIONS):
+                columns[f"rate_{action.split()[0].lower()}"] = counts[code::len(ACTIONS)] / n_posts
+        for column, name in MENTION_COLUMNS.items():
+            if column in table.column_names:
+                mentions = pc.list_value_length(table.column(column).combine_chunks()).fill_null(0).to_numpy(zero_copy_only=False)
+                columns[f"{name}_per_post"] = np.bincount(profile_codes, weights=mentions, minlength=n) / n_posts
+        counters["profiles"] = n
+    return pd.DataFrame(columns, index=pd.Index(profile_ids, name="id"))
+
+
+def hybrid_features(arrays, posts, structural=None):
+    # Feature matrix for every graph node (float32), indexed by node id; structural: precomputed
+    # structural_features(arrays), e.g. the pipeline stage output
+    with span("hybrid_features", nodes=arrays.n_nodes, posts=len(posts)):
+        structural = structural if structural is not None else structural_features(arrays)
+        own = post_features(posts).reindex(arrays.node_ids)
+        indptr, indices = simple_csr(arrays)
+        neighbours = neighbour_scores(indptr, indices, own["llm_mean"].to_numpy(dtype=np.float64))
+        features = pd.concat([
+            structural.reindex(arrays.node_ids).drop(columns=["ego_edges"], errors="ignore"),
+            pd.DataFrame(neighbours, index=own.index),
+            own,
+        ], axis=1)
+        features.index.name = "id"
+    return features.astype(np.float32)
+
+
+def seed_labels(aggregates, seed_params=None):
+    # Weak labels from the propagation seeds: 1 suspicious, 0 not_suspicious (which wins overlaps, as in propagation)
+    from seed_selection import select_seeds
+
+    suspicious, not_suspicious = select_seeds(aggregates, seed_params)
+    labels = pd.Series(1, index=pd.Index(suspicious, name="id"), dtype=np.int8)
+    labels = labels.drop(not_suspicious, errors="ignore")
+    return pd.concat([labels, pd.Series(0, index=pd.Index(not_suspicious, name="id"), dtype=np.int8)]).sort_index()
+
+
+def calibration_report(labels, probabilities, bins=10):
+    # Metrics plus a reliability table: per probability bin, mean prediction against the observed rate
+    from sklearn.metrics import brier_score_loss, log_loss, roc_auc_score
+
+    labels = np.asarray(labels)
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    bin_of = np.minimum((probabilities * bins).astype(np.int64), bins - 1)
+    count = np.bincount(bin_of, minlength=bins)
+    predicted = np.bincount(bin_of, weights=probabilities, minlength=bins)
+    observed = np.bincount(bin_of, weights=labels, minlength=bins)
+    filled = count > 0
+    reliability = pd.DataFrame({
+        "bin_start": np.arange(bins)[filled] / bins,
+        "count": count[filled],
+        "mean_predicted": predicted[filled] / count[filled],
+        "observed_rate": observed[filled] / count[filled],
+    })
+    both_classes = len(np.unique(labels)) == 2
+    return {
+        "n": int(len(labels)),
+        "positive_rate": float(labels.mean()) if len(labels) else float("nan"),
+        "brier": float(brier_score_loss(labels, probabilities)),
+        "log_loss": float(log_loss(labels, probabilities, labels=[0, 1])),
+        "auc": float(roc_auc_score(labels, probabilities)) if both_classes else float("nan"),
+        "ece": float(np.abs(reliability["mean_predicted"] - reliability["observed_rate"]) @ reliability["count"] / max(len(labels), 1)),
+        "reliability": reliability,
+    }
+
+
+def untrainable_reason(features, labels):
+    # Why train_model cannot run on these labels (None if it can): the stratified split puts at least one profile
+    # of each class on both sides, so every class needs two labelled profiles in the graph
+    counts = labels.reindex(features.index).value_counts()
+    missing = [f"{name} ({int(counts.get(value, 0))})" for value, name in [(1, "suspicious"), (0, "not suspicious")] if counts.get(value, 0) < 2]
+    return f"training needs at least 2 labelled profiles per class in the graph, got {', '.join(missing)}" if missing else None
+
+
+def train_model(features, labels, params=None, exclude=()):
+    # -> (fitted model, feature columns, calibration report on a stratified held-out split)
+    from sklearn.ensemble import HistGradientBoostingClassifier
+    from sklearn.model_selection import train_test_split
+
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    reason = untrainable_reason(features, labels)
+    if reason:
+        raise ValueError(reason)
+    columns = [column for column in features.columns if column not in set(exclude)]
+    labelled = features.reindex(labels.index).dropna(how="all")
+    y = labels.reindex(labelled.index).to_numpy()
+    # held-out size in profiles, clamped so that both sides can hold one profile of each class
+    test_size = min(max(int(np.ceil(params["test_size"] * len(y))), 2), len(y) - 2)
+    x_train, x_test, y_train, y_test = train_test_split(labelled[columns], y, test_size=test_size, stratify=y, random_state=params["seed"])
+    model = HistGradientBoostingClassifier(
+        max_iter=params["max_iter"], learning_rate=params["learning_rate"], max_leaf_nodes=params["max_leaf_nodes"],
+        min_samples_leaf=params["min_samples_leaf"], l2_regularization=params["l2_regularization"], random_state=params["seed"],
+    )
+    with span("train_hybrid_model", train=len(y_train), test=len(y_test), features=len(columns)) as counters:
+        model.fit(x_train, y_train)
+        counters["iterations"] = model.n_iter_
+    report = calibration_report(y_test, model.predict_proba(x_test)[:, 1])
+    report["train"] = int(len(y_train))
+    return model, columns, report
+
+
+def score_profiles(model, features, columns, chunk_size=1_000_000):
+    # Suspicion probability for every row of the feature matrix, in chunks to bound the per-call memory
+    matrix = features[columns]
+    with span("score_profiles", rows=len(matrix)):
+        scores = np.concatenate([model.predict_proba(matrix.iloc[start:start + chunk_size])[:, 1]
+                                 for start in range(0, len(matrix), chunk_size)]) if len(matrix) else np.empty(0)
+    return pd.Series(scores, index=features.index, name="hybrid_score")
+
+
+def hybrid_scores(arrays, posts, labels=None, seed_params=None, params=None, structural=None):
+    # Features, training (on labels, or on the propagation seeds without SEED_SOURCE_COLUMNS) and scoring.
+    # -> (per-profile DataFrame with hybrid_score, calibration report)
+    from seed_selection import profile_aggregates
+
+    features = hybrid_features(arrays, posts, structural)
+    exclude = ()
+    if labels is None:
+        aggregates = profile_aggregates(posts.dropna(subset=["profile_id"]).astype({"profile_id": np.int64}))
+        labels = seed_labels(aggregates, seed_params)
+        exclude = SEED_SOURCE_COLUMNS
+    reason = untrainable_reason(features, labels)
+    if reason:
+        # e.g. no profile passes the seed thresholds: no scores rather than aborting the pipeline run
+        print(f"hybrid model skipped: {reason}")
+        table = pd.DataFrame({"hybrid_score": np.nan, "label": labels.reindex(features.index)}, index=features.index)
+        return table, {"skipped": reason}
+    model, columns, report = train_model(features, labels, params, exclude)
+    scores = score_profiles(model, features, columns)
+    table = pd.DataFrame({"hybrid_score": scores, "label": labels.reindex(scores.index)})
+    return table, report
+
+
+def write_scores(scores, report, out_dir="."):
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, "profile_scores.parquet")
+    scores.to_parquet(path)
+    with open(os.path.join(out_dir, "profile_scores.calibration.json"), "w") as f:
+        reliability = report.get("reliability")
+        json.dump({**report, "reliability": None if reliability is None else reliability.to_dict(orient="records")}, f, indent=2)
+    return path
+
+
+def read_scores(scores_dir="."):
+    path = os.path.join(scores_dir, "profile_scores.parquet")
+    return pd.read_parquet(path) if os.path.isfile(path) else None
+
+
+if __name__ == "__main__":
+    from create_graph import CONNECTION_EDGE_TYPES, DB_PATH
+    from db_access import connections, profiles
+    from enrichment_store import load_posts
+    from graph_arrays import GraphArrays
+
+    parser = argparse.ArgumentParser(description="Train the hybrid LLM + graph suspicion model and score every profile")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--posts", default="translated_posts.parquet")
+    parser.add_argument("--store", default="enrichment_store")
+    parser.add_argument("--labels", default=None, help="parquet with profile_id and label (0/1) from review, instead of the seeds")
+    parser.add_argument("--seed-thresholds", choices=["absolute", "quantile"], default="absolute")
+    parser.add_argument("--out", default=".", help="directory for profile_scores.parquet and its calibration report")
+    args = parser.parse_args()
+
+    arrays = GraphArrays.from_connections(profiles(args.db, profile_type="person"),
+                                          connections(args.db, connection_types=list(CONNECTION_EDGE_TYPES)))
+    posts = load_posts(post_columns(args.store), store_dir=args.store, legacy_path=args.posts, db_path=args.db)
+    labels = None
+    if args.labels:
+        reviewed = pd.read_parquet(args.labels)
+        labels = pd.Series(reviewed["label"].to_numpy(dtype=np.int8), index=pd.Index(reviewed["profile_id"], name="id"))
+    scores, report = hybrid_scores(arrays, posts, labels, seed_params={"thresholds": args.seed_thresholds})
+    print(f"{len(scores)} profiles -> {write_scores(scores, report, args.out)}")
+    print({key: value for key, value in report.items() if key != "reliability"})
+    if "reliability" in report:
+        print(report["reliability"].to_string(index=False, float_format="{:.3f}".format))
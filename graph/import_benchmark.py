@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+# Cold-start import cost of the graph/ modules, measured with `python -X importtime` in a fresh interpreter
+# per module (best of --repeat runs, since the first one also pays for the disk cache).
+# Heavy dependencies (networkx, scipy, matplotlib, plotly, PIL) are imported inside the functions that use
+# them; the data-only modules below must not pull any of them in, and importing pipeline (what every stage,
+# --list included, pays before doing anything) has to stay under the time budget.
+#   python import_benchmark.py                      (report + check, exit status 1 if a target is missed)
+#   python import_benchmark.py --modules visualisation rendering --top 20
+
+HEAVY = ["networkx", "scipy", "matplotlib", "plotly", "PIL", "sklearn"]
+
+# module -> heavy packages it is allowed to load at import time
+DATA_ONLY = {
+    "pipeline": [],
+    "create_graph": [],
+    "db_access": [],
+    "enrichment_store": [],
+    "graph_arrays": [],
+    "profile_timelines": [],
+    "graph_server": [],
+    "entity_summaries": [],
+    "lod_explorer": [],
+    "visualisation": [],
+    "temporal_graph": [],
+    "triage": [],
+    "similarity_search": [],
+    "plotly_functions": ["plotly"],
+}
+
+COLD_START_MODULE = "pipeline"
+COLD_START_BUDGET_S = 0.8
+
+_PROBE = "import sys, json; import {module}; print(json.dumps(sorted(sys.modules)))"
+
+
+def _parse_importtime(stderr):
+    # "import time: self [us] | cumulative | imported package" lines; indentation of the name is the depth
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us), len(name) - len(name.lstrip()) - 1))
+    return rows
+
+
+def measure_import(module, repeat=3, cwd=None):
+    # Returns total seconds, per top-level package self time and the heavy packages that got loaded
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", _PROBE.format(module=module)],
+                                capture_output=True, text=True, cwd=cwd or os.path.dirname(os.path.abspath(__file__)))
+        if result.returncode:
+            raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+        rows = _parse_importtime(result.stderr)
+        total = sum(cumulative for _, _, cumulative, depth in rows if depth == 0) / 1e6
+        if best is None or total < best["seconds"]:
+            packages = defaultdict(int)
+            for name, self_us, _, _ in rows:
+                packages[name.split(".")[0]] += self_us
+            loaded = set(json.loads(result.stdout))
+            best = {
+                "module": module,
+                "seconds": total,
+                "packages": {name: us / 1e6 for name, us in sorted(packages.items(), key=lambda item: -item[1])},
+                "heavy": [name for name in HEAVY if name in loaded],
+            }
+    return best
+
+
+def check(results, budget=COLD_START_BUDGET_S):
+    # Human-readable list of missed targets, empty if everything passes
+    failures = []
+    for result in results:
+        allowed = DATA_ONLY.get(result["module"])
+        if allowed is not None:
+            extra = [name for name in result["heavy"] if name not in allowed]
+            if extra:
+                failures.append(f"{result['module']} loads {', '.join(extra)} at import time")
+        if result["module"] == COLD_START_MODULE and result["seconds"] > budget:
+            failures.append(f"import {COLD_START_MODULE} took {result['seconds']:.2f}s, budget {budget:.2f}s")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import-time benchmark for the graph modules")
+    parser.add_argument("--modules", nargs="+", default=list(DATA_ONLY))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5, help="heaviest packages to list per module")
+    parser.add_argument("--budget", type=float, default=COLD_START_BUDGET_S)
+    parser.add_argument("--output", default=None, help="also write the results as JSON")
+    args = parser.parse_args()
+
+    results = [measure_import(module, args.repeat) for module in args.modules]
+    for result in results:
+        heaviest = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in list(result["packages"].items())[:args.top])
+        print(f"{result['module']:<20} {result['seconds']:.3f}s  heavy: {', '.join(result['heavy']) or '-'}  ({heaviest})")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    failures = check(results, args.budget)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,261 @@
+import atexit
+import cProfile
+import functools
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Lightweight stage instrumentation: timing spans with counters and peak RSS, exported as a
+# Chrome trace (chrome://tracing, Perfetto) or OTLP-style JSON. Off unless enabled:
+#   ETHACK_TRACE=trace.json            record spans and write the trace at exit (.otlp.json suffix for OTLP)
+#   ETHACK_PROFILE=build_graph,...     cProfile those spans ("*" for all), written to ETHACK_PROFILE_DIR
+#   ETHACK_PYSPY=harmonic_function     attach py-spy to this process for those spans
+
+_state = {
+    "enabled": False,
+    "trace_path": None,
+    "profile_spans": set(),
+    "profile_dir": "profiles",
+    "pyspy_spans": set(),
+    "sample_interval": 0.05,
+}
+_events = []
+_active_spans = []
+_lock = threading.Lock()
+_local = threading.local()
+_span_ids = itertools.count(1)
+_sampler = None
+_start_ns = time.time_ns() - time.perf_counter_ns()
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss_mb():
+    # Resident set size from /proc on Linux, peak RSS from getrusage elsewhere (in bytes on macOS, KiB otherwise)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == "darwin" else 1024)
+
+
+def _now_us():
+    return time.perf_counter_ns() / 1000
+
+
+def _sample_memory(stop):
+    while not stop.wait(_state["sample_interval"]):
+        rss = current_rss_mb()
+        with _lock:
+            _events.append({"name": "rss_mb", "ph": "C", "ts": _now_us(), "pid": os.getpid(), "args": {"rss_mb": round(rss, 1)}})
+            for active in _active_spans:
+                active["peak_rss_mb"] = max(active["peak_rss_mb"], rss)
+
+
+def configure(trace_path=None, profile_spans=(), profile_dir="profiles", pyspy_spans=(), sample_interval=0.05):
+    global _sampler
+    _state.update({
+        "enabled": True,
+        "trace_path": trace_path,
+        "profile_spans": set(profile_spans),
+        "profile_dir": profile_dir,
+        "pyspy_spans": set(pyspy_spans),
+        "sample_interval": sample_interval,
+    })
+    if _sampler is None:
+        stop = threading.Event()
+        _sampler = (threading.Thread(target=_sample_memory, args=(stop,), daemon=True, name="rss-sampler"), stop)
+        _sampler[0].start()
+    if trace_path:
+        atexit.register(export_trace, trace_path)
+
+
+def enabled():
+    return _state["enabled"]
+
+
+def _wants(spans, name):
+    return "*" in spans or name in spans
+
+
+@contextmanager
+def _profiled(name):
+    if not _wants(_state["profile_spans"], name):
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(_state["profile_dir"], exist_ok=True)
+        profiler.dump_stats(os.path.join(_state["profile_dir"], f"{name}-{os.getpid()}-{time.strftime('%H%M%S')}.prof"))
+
+
+@contextmanager
+def _pyspy(name):
+    if not _wants(_state["pyspy_spans"], name):
+        yield
+        return
+    os.makedirs(_state["profile_dir"], exist_ok=True)
+    output = os.path.join(_state["profile_dir"], f"{name}-{os.getpid()}.svg")
+    try:
+        recorder = subprocess.Popen(["py-spy", "record", "--pid", str(os.getpid()), "--output", output], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except OSError:
+        recorder = None
+    try:
+        yield
+    finally:
+        if recorder is not None:
+            # py-spy writes its flame graph on SIGINT
+            recorder.send_signal(2)
+            recorder.wait()
+
+
+@contextmanager
+def span(name, **attributes):
+    # with span("build_graph", source="sqlite") as counters: ...; counters["edges"] = n
+    counters = dict(attributes)
+    if not _state["enabled"]:
+        yield counters
+        return
+    parents = getattr(_local, "stack", None)
+    if parents is None:
+        parents = _local.stack = []
+    record = {
+        "span_id": next(_span_ids),
+        "parent_id": parents[-1]["span_id"] if parents else None,
+        "peak_rss_mb": current_rss_mb(),
+    }
+    parents.append(record)
+    with _lock:
+        _active_spans.append(record)
+    start = _now_us()
+    rss_start = record["peak_rss_mb"]
+    try:
+        with _profiled(name), _pyspy(name):
+            yield counters
+    finally:
+        end = _now_us()
+        rss_end = current_rss_mb()
+        parents.pop()
+        with _lock:
+            _active_spans.remove(record)
+            _events.append({
+                "name": name,
+                "ph": "X",
+                "ts": start,
+                "dur": end - start,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "id": record["span_id"],
+                "parent_id": record["parent_id"],
+                "args": {
+                    **counters,
+                    "rss_start_mb": round(rss_start, 1),
+                    "rss_end_mb": round(rss_end, 1),
+                    "peak_rss_mb": round(max(record["peak_rss_mb"], rss_end), 1),
+                },
+            })
+
+
+def count(name, value):
+    # Standalone counter sample, e.g. rows read or LLM calls made
+    if not _state["enabled"]:
+        return
+    with _lock:
+        _events.append({"name": name, "ph": "C", "ts": _now_us(), "pid": os.getpid(), "args": {name: value}})
+
+
+def traced(name=None):
+    # Decorator form of span()
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def events():
+    with _lock:
+        return list(_events)
+
+
+def chrome_trace():
+    return {"traceEvents": events(), "displayTimeUnit": "ms"}
+
+
+def otlp_trace(service_name="ethack"):
+    # Spans in the OpenTelemetry OTLP/JSON layout (resourceSpans -> scopeSpans -> spans)
+    trace_id = os.urandom(16).hex()
+
+    def span_id(value):
+        return f"{value:016x}" if value else ""
+
+    def attribute(key, value):
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    spans = [{
+        "traceId": trace_id,
+        "spanId": span_id(event["id"]),
+        "parentSpanId": span_id(event["parent_id"]),
+        "name": event["name"],
+        "kind": 1,
+        "startTimeUnixNano": str(int(_start_ns + event["ts"] * 1000)),
+        "endTimeUnixNano": str(int(_start_ns + (event["ts"] + event["dur"]) * 1000)),
+        "attributes": [attribute(key, value) for key, value in event["args"].items()],
+    } for event in events() if event["ph"] == "X"]
+    return {"resourceSpans": [{
+        "resource": {"attributes": [attribute("service.name", service_name)]},
+        "scopeSpans": [{"scope": {"name": "ethack.instrumentation"}, "spans": spans}],
+    }]}
+
+
+def export_trace(path):
+    trace = otlp_trace() if path.endswith(".otlp.json") else chrome_trace()
+    with open(path, "w") as f:
+        # numpy scalars in counters
+        json.dump(trace, f, default=lambda value: value.item() if hasattr(value, "item") else str(value))
+    return path
+
+
+def summary():
+    # Total time and peak RSS per span name, longest first
+    totals = {}
+    for event in events():
+        if event["ph"] != "X":
+            continue
+        total = totals.setdefault(event["name"], {"calls": 0, "seconds": 0.0, "peak_rss_mb": 0.0})
+        total["calls"] += 1
+        total["seconds"] += event["dur"] / 1e6
+        total["peak_rss_mb"] = max(total["peak_rss_mb"], event["args"]["peak_rss_mb"])
+    return dict(sorted(totals.items(), key=lambda item: item[1]["seconds"], reverse=True))
+
+
+def _split(value):
+    return {part.strip() for part in value.split(",") if part.strip()}
+
+
+if os.environ.get("ETHACK_TRACE") or os.environ.get("ETHACK_PROFILE") or os.environ.get("ETHACK_PYSPY"):
+    configure(
+        trace_path=os.environ.get("ETHACK_TRACE"),
+        profile_spans=_split(os.environ.get("ETHACK_PROFILE", "")),
+        profile_dir=os.environ.get("ETHACK_PROFILE_DIR", "profiles"),
+        pyspy_spans=_split(os.environ.get("ETHACK_PYSPY", "")),
+    )
@@ -0,0 +1,54 @@
+import enum
+import hashlib
+import json
+
+from pydantic import BaseModel
+
+# Structured output schema shared by the Gemini enrichment (explore.py) and the graph pipeline, plus the prompt
+# and model it is used with (prompt_version() keys cached LLM output)
+
+
+class TrafficLikelihood(enum.Enum):
+    ONE = 1
+    TWO = 2
+    THREE = 3
+    FOUR = 4
+    FIVE = 5
+
+
+class SuspiciousActions(enum.Enum):
+    S = "selling"
+    B = "buying"
+    AD = "advertising"
+    HU = "hunting"
+    O = "Other suspicious action"
+
+
+class Response(BaseModel):
+    translated_content: str
+    language: str
+    traffic_likelihood: int
+    species_being_mentioned: list[str]
+    location: list[str]
+    pii: list[str]
+    actions: list[SuspiciousActions]
+
+
+TRANSLATION_MODEL = "gemini-2.0-flash"
+
+TRANSLATION_PROMPT = """
+            Provide all the answers in as much detail as is available
+            Translate this text into English: {text}, 
+            return the language being used
+            then give it a likelihood rating of mentioning illegal animal trafficking,
+            list out any animal species in being mentioned, 
+            list out any location being mentioned,
+            list out any personal identifiable information (pii) as: `typeofPII_PII` e.g name_Jack
+            list out any suspicious actions
+            """
+
+
+def prompt_version():
+    # Changes whenever the model, the prompt or the Response schema does, so cached LLM output keyed on it goes stale
+    payload = json.dumps([TRANSLATION_MODEL, TRANSLATION_PROMPT, Response.model_json_schema()], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:12]
@@ -0,0 +1,181 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import span
+
+# Level-of-detail view of the whole network. The layout is computed once for every node, node positions
+# are put on a Z-order (Morton) curve so every quadtree cell is a contiguous slice of the sorted nodes,
+# and a viewport query at a zoom level returns at most max_nodes individual nodes; the remaining cells in
+# view come back as density tiles (count, centroid, mean score) with tile-to-tile edge counts.
+
+BITS = 16  # quadtree depth: positions are quantised to a 2^16 x 2^16 grid
+
+
+def spectral_layout(arrays, seed=0):
+    # 2-D layout from the leading non-trivial eigenvectors of D^-1/2 A D^-1/2, scales to millions of nodes.
+    # Isolated nodes are scattered at random. scipy is only needed here, when a snapshot is built.
+    import scipy.sparse as sp
+    from scipy.sparse.linalg import eigsh
+
+    adjacency = arrays.adjacency()
+    degrees = np.asarray(adjacency.sum(axis=1)).ravel()
+    inverse_sqrt = np.divide(1.0, np.sqrt(degrees), out=np.zeros_like(degrees), where=degrees > 0)
+    normalised = sp.diags(inverse_sqrt) @ adjacency @ sp.diags(inverse_sqrt)
+    rng = np.random.default_rng(seed)
+    with span("spectral_layout", nodes=arrays.n_nodes):
+        _, vectors = eigsh(normalised, k=3, which="LA", v0=rng.random(arrays.n_nodes), tol=1e-4)
+    positions = vectors[:, :2] * inverse_sqrt[:, None]
+    isolated = degrees == 0
+    positions[isolated] = rng.normal(scale=positions[~isolated].std(axis=0) if (~isolated).any() else 1.0, size=(isolated.sum(), 2))
+    return positions
+
+
+def _normalise(positions):
+    # Into [0, 1) with a small margin, so the quantised grid covers the whole layout
+    low, high = positions.min(axis=0), positions.max(axis=0)
+    span_ = np.where(high > low, high - low, 1.0)
+    return (positions - low) / span_ * 0.98 + 0.01
+
+
+def _part1by1(values):
+    # Spread the low 16 bits of each value to the even bit positions
+    values = values.astype(np.uint64) & np.uint64(0xFFFF)
+    values = (values | (values << np.uint64(8))) & np.uint64(0x00FF00FF)
+    values = (values | (values << np.uint64(4))) & np.uint64(0x0F0F0F0F)
+    values = (values | (values << np.uint64(2))) & np.uint64(0x33333333)
+    values = (values | (values << np.uint64(1))) & np.uint64(0x55555555)
+    return values
+
+
+def cell_codes(ix, iy):
+    # Morton code of integer grid cells; at level l it is the prefix shared by every node inside the cell
+    return _part1by1(np.asarray(ix)) | (_part1by1(np.asarray(iy)) << np.uint64(1))
+
+
+def morton_codes(x, y):
+    scale = 2 ** BITS
+    return cell_codes(np.minimum((x * scale).astype(np.int64), scale - 1),
+                      np.minimum((y * scale).astype(np.int64), scale - 1))
+
+
+class LODIndex:
+    def __init__(self, node_ids, x, y, scores, codes, order, indptr, indices, tile_edges):
+        # x, y, scores, codes are in Morton order; order maps that order back to node positions
+        self.node_ids = node_ids
+        self.x, self.y, self.scores, self.codes, self.order = x, y, scores, codes, order
+        self.indptr, self.indices = indptr, indices
+        self.tile_edges = tile_edges
+        # prefix sums so any cell's centroid and mean score is O(1)
+        self._cumulative = {name: np.concatenate([[0.0], np.cumsum(np.nan_to_num(values))])
+                            for name, values in (("x", x), ("y", y), ("score", scores))}
+
+    @classmethod
+    def build(cls, arrays, positions=None, scores=None, max_tile_level=10):
+        # positions: (n, 2) layout (default spectral); scores: per-node values to average in tiles (e.g. risk).
+        # Tile-to-tile edge counts are precomputed for zoom levels 0..max_tile_level (at most 16).
+        with span("build_lod_index", nodes=arrays.n_nodes, edges=arrays.n_edges):
+            positions = _normalise(spectral_layout(arrays) if positions is None else np.asarray(positions, dtype=np.float64))
+            codes = morton_codes(positions[:, 0], positions[:, 1])
+            order = np.argsort(codes, kind="stable")
+            scores = np.zeros(arrays.n_nodes) if scores is None else np.asarray(scores, dtype=np.float64)
+            # adjacency in Morton order
+            adjacency = arrays.adjacency()[order][:, order].tocsr()
+            tile_edges = {}
+            src_codes, dst_codes = codes[arrays.src], codes[arrays.dst]
+            for level in range(max_tile_level + 1):
+                shift = np.uint64(2 * (BITS - level))
+                a, b = src_codes >> shift, dst_codes >> shift
+                low, high = np.minimum(a, b), np.maximum(a, b)
+                between = low != high
+                # cell codes have 2 * level <= 32 bits, so a pair packs into one uint64 key
+                keys, counts = np.unique((low[between] << np.uint64(32)) | high[between], return_counts=True)
+                tile_edges[level] = (keys >> np.uint64(32), keys & np.uint64(0xFFFFFFFF), counts)
+            return cls(arrays.node_ids[order], positions[order, 0], positions[order, 1], scores[order], codes[order], order,
+                       adjacency.indptr.astype(np.int64), adjacency.indices.astype(np.int64), tile_edges)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        arrays = {"node_ids": self.node_ids, "x": self.x, "y": self.y, "scores": self.scores, "codes": self.codes,
+                  "order": self.order, "indptr": self.indptr, "indices": self.indices}
+        for level, (a, b, counts) in self.tile_edges.items():
+            arrays.update({f"tile_edges_{level}_a": a, f"tile_edges_{level}_b": b, f"tile_edges_{level}_count": counts})
+        for name, values in arrays.items():
+            np.save(os.path.join(directory, f"lod.{name}.npy"), values)
+        with open(os.path.join(directory, "lod.json"), "w") as f:
+            json.dump({"tile_levels": sorted(self.tile_edges)}, f)
+        return directory
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        with open(os.path.join(directory, "lod.json")) as f:
+            meta = json.load(f)
+
+        def load(name):
+            return np.load(os.path.join(directory, f"lod.{name}.npy"), mmap_mode=mmap_mode)
+        tile_edges = {level: (load(f"tile_edges_{level}_a"), load(f"tile_edges_{level}_b"), load(f"tile_edges_{level}_count"))
+                      for level in meta["tile_levels"]}
+        return cls(np.asarray(load("node_ids")), load("x"), load("y"), load("scores"), load("codes"), load("order"),
+                   load("indptr"), load("indices"), tile_edges)
+
+    def _cells_in_view(self, x0, y0, x1, y1, level):
+        side = 2 ** level
+        ix = np.arange(max(int(x0 * side), 0), min(int(x1 * side), side - 1) + 1)
+        iy = np.arange(max(int(y0 * side), 0), min(int(y1 * side), side - 1) + 1)
+        grid_x, grid_y = np.meshgrid(ix, iy)
+        prefixes = np.sort(cell_codes(grid_x.ravel(), grid_y.ravel()))
+        shift = np.uint64(2 * (BITS - level))
+        starts = np.searchsorted(self.codes, prefixes << shift, side="left")
+        ends = np.searchsorted(self.codes, (prefixes + np.uint64(1)) << shift, side="left")
+        occupied = ends > starts
+        return prefixes[occupied], starts[occupied], ends[occupied]
+
+    def query(self, x0=0.0, y0=0.0, x1=1.0, y1=1.0, zoom=None, max_nodes=2000, max_edges=5000, max_cells=4096):
+        # Everything in the viewport [x0, x1] x [y0, y1] (layout coordinates in [0, 1]).
+        # zoom is the quadtree level of the tiles; by default the finest level with at most max_cells cells in view.
+        # A requested zoom is lowered if the viewport would cover more than max_cells cells, so work stays bounded.
+        width, height = max(x1 - x0, 1e-9), max(y1 - y0, 1e-9)
+        finest = int(np.clip(np.floor(0.5 * np.log2(max_cells / (width * height))), 0, max(self.tile_edges)))
+        zoom = finest if zoom is None else max(min(int(zoom), finest), 0)
+        prefixes, starts, ends = self._cells_in_view(x0, y0, x1, y1, zoom)
+        counts = ends - starts
+        # Expand the sparsest cells into individual nodes while the node budget lasts
+        by_size = np.argsort(counts, kind="stable")
+        expand = np.zeros(len(counts), dtype=bool)
+        expand[by_size[np.cumsum(counts[by_size]) <= max_nodes]] = True
+        if expand.any():
+            members = np.concatenate([np.arange(start, end) for start, end in zip(starts[expand], ends[expand])])
+            inside = (self.x[members] >= x0) & (self.x[members] <= x1) & (self.y[members] >= y0) & (self.y[members] <= y1)
+            members = members[inside]
+        else:
+            members = np.empty(0, dtype=np.int64)
+        tile_start, tile_end, tile_codes = starts[~expand], ends[~expand], prefixes[~expand]
+        tile_counts = tile_end - tile_start
+        cumulative = self._cumulative
+
+        def tile_mean(name):
+            return (cumulative[name][tile_end] - cumulative[name][tile_start]) / tile_counts
+        tiles = pd.DataFrame({"tile": tile_codes, "count": tile_counts, "x": tile_mean("x"), "y": tile_mean("y"), "score": tile_mean("score")})
+        nodes = pd.DataFrame({"id": self.node_ids[members], "x": self.x[members], "y": self.y[members], "score": self.scores[members]})
+        edges = self._edges_among(members, max_edges)
+        tile_edges = self._tile_edges(zoom, tile_codes, max_edges)
+        return {"zoom": zoom, "nodes": nodes, "tiles": tiles, "edges": edges, "tile_edges": tile_edges}
+
+    def _edges_among(self, members, max_edges):
+        if not len(members):
+            return pd.DataFrame({"source": [], "target": []})
+        lengths = self.indptr[members + 1] - self.indptr[members]
+        owners = np.repeat(members, lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        others = np.asarray(self.indices)[np.repeat(self.indptr[members], lengths) + offsets]
+        keep = (others > owners) & np.isin(others, members)
+        owners, others = owners[keep][:max_edges], others[keep][:max_edges]
+        return pd.DataFrame({"source": self.node_ids[owners], "target": self.node_ids[others]})
+
+    def _tile_edges(self, level, tile_codes, max_edges):
+        a, b, counts = self.tile_edges[level]
+        keep = np.isin(a, tile_codes) & np.isin(b, tile_codes)
+        edges = pd.DataFrame({"a": np.asarray(a)[keep], "b": np.asarray(b)[keep], "count": np.asarray(counts)[keep]})
+        return edges.nlargest(max_edges, "count")
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+
+import polars as pl
+
+from instrumentation import span
+
+# Persistent caching for the expensive explore.py cells. marimo re-runs a cell whenever anything upstream
+# changes; these helpers make the rerun a parquet read unless the inputs that matter changed:
+#   SQL loads     keyed on the normalised SQL text + the DB file fingerprint (size, mtime, incl. the -wal file)
+#   LLM output    keyed on llm_schema.prompt_version() + the fingerprints of what was sent
+# Entries live in data/.notebook_cache/<name>.<key>.parquet; writing a new key drops the older ones for that name.
+# ProfileIndex sorts a frame by profile once, so the per-profile cells slice it instead of filtering every row.
+
+CACHE_DIR = "data/.notebook_cache"
+
+
+def file_fingerprint(path):
+    # [name, size, mtime] of the file and of its SQLite -wal companion (WAL-mode writes land there first)
+    parts = []
+    for candidate in (path, path + "-wal"):
+        if os.path.isfile(candidate):
+            stat = os.stat(candidate)
+            parts.append([os.path.basename(candidate), stat.st_size, stat.st_mtime_ns])
+    return parts or None
+
+
+def cache_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def cached_frame(name, key_parts, compute, cache_dir=CACHE_DIR):
+    # compute() -> polars DataFrame, only called when there is no entry for (name, key_parts)
+    key = cache_key(name, key_parts)
+    filename = f"{name}.{key}.parquet"
+    path = os.path.join(cache_dir, filename)
+    if os.path.isfile(path):
+        with span("notebook_cache_hit", entry=name, key=key):
+            return pl.read_parquet(path)
+    with span("notebook_cache_miss", entry=name, key=key) as counters:
+        frame = compute()
+        os.makedirs(cache_dir, exist_ok=True)
+        frame.write_parquet(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        for stale in os.listdir(cache_dir):
+            if stale.startswith(f"{name}.") and stale.endswith(".parquet") and stale != filename:
+                os.remove(os.path.join(cache_dir, stale))
+        counters["rows"] = len(frame)
+    return frame
+
+
+def cached_query(name, sql, db_path, run=None, cache_dir=CACHE_DIR):
+    # run(sql) -> polars DataFrame, e.g. lambda sql: mo.sql(sql, output=False, engine=engine); defaults to
+    # db_access.connect + polars. Whitespace in the SQL does not change the key.
+    def compute():
+        if run is not None:
+            return run(sql)
+        from db_access import connect
+
+        conn = connect(db_path)
+        try:
+            return pl.read_database(sql, conn)
+        finally:
+            conn.close()
+    return cached_frame(name, [" ".join(sql.split()), file_fingerprint(db_path)], compute, cache_dir)
+
+
+class ProfileIndex:
+    # frame sorted by (key, *order) plus id -> (offset, length); rows(ids) are zero-copy slices
+    def __init__(self, frame, key="id", order=()):
+        self.key = key
+        self.frame = frame.sort([key, *order])
+        bounds = self.frame[key].rle()
+        lengths = bounds.struct.field("len")
+        offsets = lengths.cum_sum() - lengths
+        self.slices = dict(zip(bounds.struct.field("value").to_list(), zip(offsets.to_list(), lengths.to_list())))
+
+    def rows(self, ids):
+        # ids: one id or a list / Series of them (a mo.ui.table selection), unknown ids give no rows
+        ids = [ids] if not isinstance(ids, (list, tuple, pl.Series)) else list(ids)
+        slices = [self.frame.slice(*self.slices[profile_id]) for profile_id in ids if profile_id in self.slices]
+        return pl.concat(slices) if slices else self.frame.clear()
@@ -0,0 +1,376 @@
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from create_graph import (
+    CONNECTION_EDGE_TYPES,
+    DB_PATH,
+    create_person_graph_with_relationship,
+    predict_with_harmonic_function,
+    seed_labels_from_seed_sets,
+    select_neighbourhood_subgraph,
+)
+from db_access import connections, profiles
+from enrichment_store import load_posts
+from graph_arrays import GraphArrays
+from graph_io import write_graph
+from instrumentation import span
+from profile_timelines import ProfileTimelines, timeline_features
+from seed_selection import SCORES, profile_aggregates, select_seeds
+from suspect_paths import suspect_paths
+
+# The create_graph.py steps as a DAG of cached stages:
+#   extract_profiles, extract_connections, load_posts -> build_graph -> neighbourhood_subgraph
+#   load_posts -> profile_aggregates
+#   neighbourhood_subgraph, profile_aggregates -> seed_labels -> propagate -> export
+#   extract_profiles, extract_connections -> graph_arrays; graph_arrays, profile_aggregates -> risk_scores, suspect_paths
+#   graph_arrays, load_posts, profile_aggregates -> sharded_propagate (region-sharded alternative to propagate)
+#   graph_arrays -> structural_features (degree/clustering/triangle/k-core/ego features, node_features.parquet)
+#   graph_arrays, structural_features -> hybrid_scores (LLM + graph model, <out_dir>/profile_scores.parquet)
+# Every artefact is pickled under the cache dir, keyed by a hash of the stage source, its config,
+# the fingerprints of the files it reads and the keys of its upstream stages, so only invalidated stages re-run.
+# networkx and scipy are imported inside the stages that need them, so --list and the data-only stages start
+# without them (python import_benchmark.py checks this).
+
+STAGES = {}
+
+DEFAULT_CONFIG = {
+    "db": DB_PATH,
+    "posts": "translated_posts.parquet",
+    "store": "enrichment_store",
+    "out_dir": ".",
+    "seed_score": "sum",
+    "seed_thresholds": "absolute",
+    "suspicious_threshold": 100,
+    "not_suspicious_threshold": 1,
+    "suspicious_quantile": 0.99,
+    "not_suspicious_quantile": 0.5,
+    "min_posts": 1,
+    "ppr_alpha": 0.15,
+    "max_hops": 4,
+    "shard_by": "region",
+    "shard_jobs": 0,
+    "feature_jobs": 0,
+    # where app.py looks for the entity summaries (relative to graph/, the pipeline's working directory)
+    "entity_summaries_dir": "../data/entity_summaries",
+    "timeline_window_days": 30,
+    "burst_days": 7,
+}
+
+SEED_PARAMS = {
+    "seed_score": "score",
+    "seed_thresholds": "thresholds",
+    "suspicious_threshold": "suspicious_threshold",
+    "not_suspicious_threshold": "not_suspicious_threshold",
+    "suspicious_quantile": "suspicious_quantile",
+    "not_suspicious_quantile": "not_suspicious_quantile",
+    "min_posts": "min_posts",
+}
+
+
+def stage(name, deps=(), inputs=(), params=(), version=1):
+    # inputs: config keys holding file paths to fingerprint; params: config keys that change the output
+    def decorator(fn):
+        STAGES[name] = {"fn": fn, "deps": list(deps), "inputs": list(inputs), "params": list(params), "version": version}
+        return fn
+    return decorator
+
+
+@stage("extract_profiles", inputs=["db"], version=2)
+def extract_profiles(config):
+    # Filters pushed into SQL (db_access.py): only person profiles and the connection types that become edges
+    return profiles(config["db"], profile_type="person")
+
+
+@stage("extract_connections", inputs=["db"], version=2)
+def extract_connections(config):
+    return connections(config["db"], connection_types=list(CONNECTION_EDGE_TYPES))
+
+
+@stage("load_posts", inputs=["db", "posts", "store"])
+def load_post_scores(config):
+    combined_data = load_posts(["id", "profile_id", "traffic_likelihood"], store_dir=config["store"], legacy_path=config["posts"], db_path=config["db"])
+    combined_data = combined_data.dropna(subset=['profile_id'])
+    combined_data['profile_id'] = combined_data['profile_id'].astype(int)
+    return combined_data
+
+
+@stage("profile_timelines", inputs=["db", "posts", "store"], params=["timeline_window_days", "burst_days"])
+def profile_timelines(config):
+    # Cumulative traffic curves for every profile and their acceleration / burst features
+    posts = load_posts(["profile_id", "timestamp", "traffic_likelihood"], store_dir=config["store"], legacy_path=config["posts"], db_path=config["db"])
+    timelines = ProfileTimelines.from_posts(posts)
+    return timelines, timeline_features(timelines, config["timeline_window_days"], config["burst_days"])
+
+
+@stage("build_graph", deps=["extract_profiles", "extract_connections"])
+def build_graph(config, people_profiles, people_connections):
+    return create_person_graph_with_relationship(people_profiles, people_connections, only_connected_nodes=False, friends_conn=True, group_conn=True, follow_conn=True, comment_conn=True, tagged_conn=True)
+
+
+@stage("neighbourhood_subgraph", deps=["build_graph", "load_posts"])
+def neighbourhood_subgraph(config, graph, combined_data):
+    # Copy so the artefact does not drag the whole graph along when pickled
+    import networkx as nx
+
+    return nx.Graph(select_neighbourhood_subgraph(graph, set(combined_data['profile_id'])))
+
+
+@stage("profile_aggregates", deps=["load_posts"])
+def aggregate_profiles(config, combined_data):
+    return profile_aggregates(combined_data)
+
+
+@stage("seed_labels", deps=["neighbourhood_subgraph", "load_posts", "profile_aggregates"], params=list(SEED_PARAMS))
+def seed_labels(config, subgraph, combined_data, aggregates):
+    traffic_likelihood = combined_data.groupby("profile_id")[["traffic_likelihood"]].sum()
+    suspicious, not_suspicious = select_seeds(aggregates, {param: config[key] for key, param in SEED_PARAMS.items()})
+    subgraph = seed_labels_from_seed_sets(subgraph, suspicious, not_suspicious)
+    return subgraph, traffic_likelihood
+
+
+@stage("graph_arrays", deps=["extract_profiles", "extract_connections"])
+def build_graph_arrays(config, people_profiles, people_connections):
+    return GraphArrays.from_connections(people_profiles, people_connections)
+
+
+@stage("risk_scores", deps=["graph_arrays", "profile_aggregates"], params=list(SEED_PARAMS) + ["ppr_alpha"])
+def risk_scores(config, arrays, aggregates):
+    # Personalized PageRank from the suspicious seeds over the whole graph, alongside the harmonic function
+    from risk_propagation import personalized_pagerank
+
+    suspicious, _ = select_seeds(aggregates, {param: config[key] for key, param in SEED_PARAMS.items()})
+    return personalized_pagerank(arrays, suspicious, alpha=config["ppr_alpha"])
+
+
+@stage("suspect_paths", deps=["graph_arrays", "profile_aggregates"], params=list(SEED_PARAMS) + ["max_hops"])
+def paths_between_suspects(config, arrays, aggregates):
+    # Shortest paths between suspicious seeds, connection_subgraph(arrays, paths) turns them into a plot
+    suspicious, _ = select_seeds(aggregates, {param: config[key] for key, param in SEED_PARAMS.items()})
+    # jobs=1: stages already run in the pipeline's worker processes
+    return suspect_paths(arrays, suspicious, max_hops=config["max_hops"], jobs=1)
+
+
+@stage("sharded_propagate", deps=["graph_arrays", "load_posts", "profile_aggregates"], params=list(SEED_PARAMS) + ["shard_by"])
+def sharded_propagate(config, arrays, combined_data, aggregates):
+    # The neighbourhood_subgraph -> seed_labels -> propagate chain over the whole graph, one shard per region.
+    # Returns (per-node predictions, per-shard stats); shard_jobs 0 uses every core
+    from sharded import sharded_harmonic_function
+
+    traffic_likelihood = combined_data.groupby("profile_id")[["traffic_likelihood"]].sum()
+    suspicious, not_suspicious = select_seeds(aggregates, {param: config[key] for key, param in SEED_PARAMS.items()})
+    return sharded_harmonic_function(arrays, traffic_likelihood, suspicious, not_suspicious, by=config["shard_by"], jobs=config["shard_jobs"] or None)
+
+
+@stage("structural_features", deps=["graph_arrays"], params=["out_dir"])
+def node_features(config, arrays):
+    # Per-node structural features, also written to node_features.parquet for the dashboard; feature_jobs 0 uses every core
+    from structural_features import structural_features
+
+    features = structural_features(arrays, jobs=config["feature_jobs"] or None)
+    features.to_parquet(os.path.join(config["out_dir"], "node_features.parquet"))
+    return features
+
+
+@stage("hybrid_scores", deps=["graph_arrays", "structural_features"], inputs=["db", "posts", "store"], params=list(SEED_PARAMS) + ["out_dir"])
+def hybrid_scores(config, arrays, structural):
+    # Gradient-boosted model over graph, neighbour and post features, trained on the seeds; returns (scores, calibration report)
+    from hybrid_model import hybrid_scores as train_and_score, post_columns, write_scores
+
+    posts = load_posts(post_columns(config["store"]), store_dir=config["store"], legacy_path=config["posts"], db_path=config["db"])
+    scores, report = train_and_score(arrays, posts, seed_params={param: config[key] for key, param in SEED_PARAMS.items()}, structural=structural)
+    write_scores(scores, report, config["out_dir"])
+    return scores, report
+
+
+@stage("entity_summaries", inputs=["db", "posts", "store"], params=["entity_summaries_dir"])
+def entity_summaries(config):
+    # Per-profile distinct entity counts and top entities in one streaming pass, written where the dashboard reads them
+    from entity_summaries import summarise_posts
+
+    summaries = summarise_posts(config["store"], config["posts"], config["db"])
+    summaries.save(config["entity_summaries_dir"])
+    return summaries
+
+
+@stage("propagate", deps=["seed_labels"])
+def propagate(config, seeded):
+    subgraph, traffic_likelihood = seeded
+    return predict_with_harmonic_function(subgraph, traffic_likelihood)
+
+
+@stage("export", deps=["build_graph", "neighbourhood_subgraph", "propagate"], params=["out_dir"])
+def export(config, graph, subgraph, predicted):
+    predictions = GraphArrays.from_networkx(predicted)
+    paths = {
+        "overall_graph.graphml": GraphArrays.from_networkx(graph),
+        "subgraph.graphml": GraphArrays.from_networkx(subgraph),
+        "subgraph_with_predictions.graphml": predictions,
+        "subgraph_with_predictions": predictions,
+    }
+    return [write_graph(arrays, os.path.join(config["out_dir"], filename)) for filename, arrays in paths.items()]
+
+
+def _fingerprint(path):
+    # Size and mtime of a file, or of every file under a directory
+    if not path or not os.path.exists(path):
+        return None
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+    entries = []
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            stat = os.stat(os.path.join(root, name))
+            entries.append([os.path.relpath(os.path.join(root, name), path), stat.st_size, stat.st_mtime_ns])
+    return sorted(entries)
+
+
+def stage_keys(config):
+    keys = {}
+    for name in topological_order():
+        spec = STAGES[name]
+        payload = {
+            "name": name,
+            "version": spec["version"],
+            "source": inspect.getsource(spec["fn"]),
+            "params": {param: config[param] for param in spec["params"]},
+            "inputs": {path_key: _fingerprint(config[path_key]) for path_key in spec["inputs"]},
+            "deps": [keys[dep] for dep in spec["deps"]],
+        }
+        keys[name] = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return keys
+
+
+def topological_order():
+    order, seen = [], set()
+
+    def visit(name):
+        if name in seen:
+            return
+        seen.add(name)
+        for dep in STAGES[name]["deps"]:
+            visit(dep)
+        order.append(name)
+    for name in STAGES:
+        visit(name)
+    return order
+
+
+def required_stages(targets):
+    needed = set()
+    stack = list(targets)
+    while stack:
+        name = stack.pop()
+        if name not in needed:
+            needed.add(name)
+            stack.extend(STAGES[name]["deps"])
+    return [name for name in topological_order() if name in needed]
+
+
+def artefact_path(cache_dir, name, key):
+    return os.path.join(cache_dir, f"{name}-{key}.pickle")
+
+
+def _is_cached(cache_dir, name, key):
+    path = artefact_path(cache_dir, name, key)
+    if not os.path.isfile(path):
+        return False
+    if name == "export":
+        # export's artefact is the list of files it wrote, they must still be there
+        with open(path, "rb") as f:
+            return all(os.path.exists(written) for written in pickle.load(f))
+    return True
+
+
+def run_stage(name, key, config, cache_dir, dep_paths):
+    # Runs in a worker process: load upstream artefacts, compute, write atomically
+    inputs = []
+    for dep_path in dep_paths:
+        with open(dep_path, "rb") as f:
+            inputs.append(pickle.load(f))
+    start = time.perf_counter()
+    with span(f"stage:{name}"):
+        artefact = STAGES[name]["fn"](config, *inputs)
+    path = artefact_path(cache_dir, name, key)
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(artefact, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+    return name, time.perf_counter() - start
+
+
+def run_pipeline(config, targets=None, force=(), jobs=1, cache_dir=".pipeline_cache"):
+    # Runs the stages needed for `targets` (default: everything), reusing cached artefacts.
+    # Stages whose upstream artefacts are ready run in parallel across `jobs` processes.
+    os.makedirs(cache_dir, exist_ok=True)
+    keys = stage_keys(config)
+    stages = required_stages(targets or list(STAGES))
+    done = {name for name in stages if name not in force and _is_cached(cache_dir, name, keys[name])}
+    for name in stages:
+        if name in done:
+            print(f"{name:<24} cached ({keys[name]})")
+    pending = [name for name in stages if name not in done]
+
+    def ready():
+        return [name for name in pending if all(dep in done for dep in STAGES[name]["deps"])]
+
+    def arguments(name):
+        return name, keys[name], config, cache_dir, [artefact_path(cache_dir, dep, keys[dep]) for dep in STAGES[name]["deps"]]
+
+    if jobs <= 1:
+        # In-process, one stage at a time, so breakpoints and tracebacks work as usual
+        while pending:
+            name = ready()[0]
+            _, seconds = run_stage(*arguments(name))
+            print(f"{name:<24} ran in {seconds:.2f}s")
+            pending.remove(name)
+            done.add(name)
+        return keys
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        running = {}
+        while pending or running:
+            for name in ready():
+                if name not in running.values():
+                    running[pool.submit(run_stage, *arguments(name))] = name
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, seconds = future.result()
+                print(f"{name:<24} ran in {seconds:.2f}s")
+                del running[future]
+                pending.remove(name)
+                done.add(name)
+    return keys
+
+
+def load_artefact(name, config, cache_dir=".pipeline_cache"):
+    # Cached output of a stage, e.g. load_artefact("propagate", config) in a notebook
+    key = stage_keys(config)[name]
+    with open(artefact_path(cache_dir, name, key), "rb") as f:
+        return pickle.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the graph pipeline as a cached stage DAG")
+    parser.add_argument("stages", nargs="*", help=f"stages to bring up to date (default: all). One of {', '.join(STAGES)}")
+    parser.add_argument("--force", nargs="*", default=[], help="re-run these stages even if cached")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes, 1 runs in-process")
+    parser.add_argument("--cache-dir", default=".pipeline_cache")
+    parser.add_argument("--list", action="store_true", help="show stages and whether they are cached")
+    for option, default in DEFAULT_CONFIG.items():
+        parser.add_argument(f"--{option.replace('_', '-')}", type=type(default), default=default,
+                            choices={"seed_score": SCORES, "seed_thresholds": ["absolute", "quantile"], "shard_by": ["region", "hash"]}.get(option))
+    args = parser.parse_args()
+    config = {option: getattr(args, option) for option in DEFAULT_CONFIG}
+
+    if args.list:
+        keys = stage_keys(config)
+        for name in topological_order():
+            status = "cached" if _is_cached(args.cache_dir, name, keys[name]) else "stale"
+            print(f"{name:<24} {status:<7} deps: {', '.join(STAGES[name]['deps']) or '-'}")
+    else:
+        run_pipeline(config, args.stages or None, force=set(args.force), jobs=args.jobs, cache_dir=args.cache_dir)
@@ -1,24 +1,41 @@
 import plotly.graph_objects as go
-import networkx as nx
-import sqlite3
+import numpy as np
 import pandas as pd
+import pyarrow.compute as pc
+
+from db_access import read_query
+from enrichment_store import load_posts
+from graph_io import load_graph
+from graph_server import GraphClient
+from instrumentation import span, traced
+
+DB_PATH = "../social_network_anonymized.db"
 
 
 def select_subgraph_with_single_node(graph, node):
-    neighbors = set()
-    target_nodes = {node}
-    for node in target_nodes:
-        neighbors.update(graph.neighbors(node))
-    # Combine target nodes with their neighbors
-    nodes_to_include = target_nodes.union(neighbors)
-    # Create subgraph with the selected nodes
-    subgraph = graph.subgraph(nodes_to_include)
-    print(f"Number of nodes in subgraph: {subgraph.number_of_nodes()}")
-    print(f"Number of edges in subgraph: {subgraph.number_of_edges()}")
+    # graph can also be a graph_server.GraphClient, then the ego network comes from the shared server
+    if isinstance(graph, GraphClient):
+        return graph.ego_graph(node)
+    with span("ego_subgraph", node=node) as counters:
+        neighbors = set()
+        target_nodes = {node}
+        for node in target_nodes:
+            neighbors.update(graph.neighbors(node))
+        # Combine target nodes with their neighbors
+        nodes_to_include = target_nodes.union(neighbors)
+        # Create subgraph with the selected nodes
+        subgraph = graph.subgraph(nodes_to_include)
+        counters["nodes"] = subgraph.number_of_nodes()
+        counters["edges"] = subgraph.number_of_edges()
+    print(f"Number of nodes in subgraph: {counters['nodes']}")
+    print(f"Number of edges in subgraph: {counters['edges']}")
     return subgraph
 
 
+@traced("plotly_figure")
 def plot_subgraph_in_plotly(subgraph):
+    import networkx as nx
+
     # Compute positions using spring layout
     pos = nx.spring_layout(subgraph)
 
@@ -137,38 +154,93 @@ def plot_subgraph_in_plotly(subgraph):
     return fig
 
 
-def load_networkx_graph(file_path):
-    # example file path = "graph_with_attributes.graphml"
-    graph_loaded = nx.read_graphml(file_path)
-    return graph_loaded
+def _segments(frame, positions, source, target):
+    # x, y lists for one line trace, edges separated by None
+    start = positions.reindex(frame[source].to_numpy()).to_numpy()
+    end = positions.reindex(frame[target].to_numpy()).to_numpy()
+    gap = np.full((len(frame), 1), None)
+    x = np.hstack([start[:, :1], end[:, :1], gap]).ravel().tolist()
+    y = np.hstack([start[:, 1:], end[:, 1:], gap]).ravel().tolist()
+    return x, y
 
 
-def extract_data_with_query(query):
-    # Connect to SQLite database
-    conn = sqlite3.connect("../social_network_anonymized.db")
+def plot_viewport_in_plotly(view):
+    # Figure for one LODIndex.query / GraphClient.viewport result: individual nodes coloured by score,
+    # density tiles sized by node count, edges and tile-to-tile edges as two line traces.
+    # Positions come from the precomputed global layout, so panning and zooming never re-run a layout.
+    nodes, tiles = view["nodes"], view["tiles"]
+    node_positions = nodes.set_index("id")[["x", "y"]] if len(nodes) else pd.DataFrame(columns=["x", "y"])
+    tile_positions = tiles.set_index("tile")[["x", "y"]] if len(tiles) else pd.DataFrame(columns=["x", "y"])
+    edge_x, edge_y = _segments(view["edges"], node_positions, "source", "target") if len(view["edges"]) else ([], [])
+    tile_edge_x, tile_edge_y = _segments(view["tile_edges"], tile_positions, "a", "b") if len(view["tile_edges"]) else ([], [])
+    traces = [
+        go.Scatter(x=tile_edge_x, y=tile_edge_y, mode='lines', line=dict(width=0.5, color='#ccc'), hoverinfo='none'),
+        go.Scatter(x=edge_x, y=edge_y, mode='lines', line=dict(width=0.5, color='#888'), hoverinfo='none'),
+        go.Scatter(
+            x=tiles["x"] if len(tiles) else [], y=tiles["y"] if len(tiles) else [],
+            mode='markers',
+            hoverinfo='text',
+            text=[f"{count} profiles<br>mean score: {score:.3f}" for count, score in zip(tiles.get("count", []), tiles.get("score", []))],
+            marker=dict(
+                symbol='square',
+                size=np.clip(4 * np.log2(1 + np.asarray(tiles.get("count", []), dtype=float)), 4, 40),
+                color=tiles.get("score", []),
+                colorscale='YlOrRd',
+                opacity=0.6)),
+        go.Scatter(
+            x=nodes["x"] if len(nodes) else [], y=nodes["y"] if len(nodes) else [],
+            mode='markers',
+            hoverinfo='text',
+            text=[f"Node: {node}<br>score: {score:.3f}" for node, score in zip(nodes.get("id", []), nodes.get("score", []))],
+            marker=dict(
+                showscale=True,
+                colorscale='YlOrRd',
+                color=nodes.get("score", []),
+                size=8,
+                colorbar=dict(thickness=15, title=dict(text='Score', side='right'), xanchor='left'),
+                line_width=1)),
+    ]
+    fig = go.Figure(
+        data=traces,
+        layout=go.Layout(
+            showlegend=False,
+            hovermode='closest',
+            margin=dict(b=20, l=5, r=5, t=40),
+            xaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
+            yaxis=dict(showgrid=False, zeroline=False, showticklabels=False))
+    )
+    return fig
+
 
-    # Execute the query
-    data = pd.read_sql_query(query, conn)
+def load_networkx_graph(file_path):
+    # example file path = "graph_with_attributes.graphml", also .gexf or a Parquet export directory
+    graph_loaded = load_graph(file_path)
+    return graph_loaded
 
-    # Close the connection
-    conn.close()
 
-    return data
+def extract_data_with_query(query, db_path=DB_PATH):
+    # Connection with the read pragmas from db_access.py
+    return read_query(query, db_path=db_path)
 
 
-def plot_profile_traffic(profile_id):
-    extra_data = pd.read_parquet("translated_posts.parquet")
-    profile_actvitity_link = extract_data_with_query("SELECT * FROM ProfileActivity")
-    combined_data = pd.merge(extra_data, profile_actvitity_link[["profile_id", "activity_id"]], left_on='id', right_on='activity_id', how='left')
-    # Filter data for the specified profile
-    profile_data = combined_data[combined_data['profile_id'] == profile_id].copy()
+def plot_profile_traffic(profile_id, client=None, timelines=None):
+    if timelines is not None:
+        # Precomputed curve from a profile_timelines.ProfileTimelines store, already sorted and accumulated
+        profile_data = timelines.timeline(profile_id)
+    elif client is not None:
+        # Timeline from the graph server, already sorted by time
+        profile_data = client.timeline(profile_id)
+    else:
+        # Filter data for the specified profile, pushed down into the parquet scan
+        profile_data = load_posts(["id", "profile_id", "timestamp", "traffic_likelihood"], filter=pc.field("profile_id") == profile_id)
     
-    # Make sure the data is sorted by timestamp
-    profile_data.sort_values('timestamp', inplace=True)
-    latest_time = profile_data['timestamp'].max()
-    profile_data['days_from_latest'] = (profile_data['timestamp'] - latest_time) / 1000/ 3600/24
-    # Compute the cumulative sum of traffic_likelihood
-    profile_data['cumulative_traffic'] = profile_data['traffic_likelihood'].cumsum()
+    if timelines is None:
+        # Make sure the data is sorted by timestamp
+        profile_data.sort_values('timestamp', inplace=True)
+        latest_time = profile_data['timestamp'].max()
+        profile_data['days_from_latest'] = (profile_data['timestamp'] - latest_time) / 1000/ 3600/24
+        # Compute the cumulative sum of traffic_likelihood
+        profile_data['cumulative_traffic'] = profile_data['traffic_likelihood'].cumsum()
     
     # Create the Plotly figure
     fig = go.Figure(
@@ -0,0 +1,244 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+from instrumentation import count, span
+
+# Near-duplicate clustering in front of translate_with_gemini. Shared posts repeat the same (or almost the
+# same) text across many profiles, so each cluster is translated once and the response is fanned out to
+# every member row.
+#   1. exact: posts with the same normalised text (lowercase, no URLs/punctuation, collapsed whitespace)
+#   2. near-duplicates: MinHash signatures over character 5-gram shingles, LSH banding to find candidates,
+#      candidates kept when the estimated Jaccard similarity passes the threshold, clusters = connected components
+# The cluster map (post id -> cluster, plus the representatives' signatures) is kept on disk, so a later run
+# only hashes new posts and attaches them to existing clusters. Responses are kept per cluster in an
+# append-only JSONL store, so an interrupted run resumes without repeating calls.
+#   python post_dedup.py --db ../social_network_anonymized.db      (LLM call reduction on the Activity table)
+
+DEFAULT_PARAMS = {"num_perm": 64, "bands": 16, "threshold": 0.9, "shingle_size": 5, "seed": 1}
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_URL_PATTERN = re.compile(r"https?://\S+|www\.\S+")
+_NON_WORD_PATTERN = re.compile(r"[^\w\s]+")
+_SPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalise_text(text):
+    text = _URL_PATTERN.sub(" ", (text or "").lower())
+    return _SPACE_PATTERN.sub(" ", _NON_WORD_PATTERN.sub(" ", text)).strip()
+
+
+def text_hashes(texts):
+    # 64-bit hash of the normalised text, equal for exact duplicates
+    return np.array([int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little", signed=True)
+                     for text in texts], dtype=np.int64)
+
+
+def _permutations(num_perm, seed):
+    rng = np.random.default_rng(seed)
+    return (rng.integers(1, 1 << 32, num_perm, dtype=np.uint64), rng.integers(0, 1 << 32, num_perm, dtype=np.uint64))
+
+
+def minhash_signatures(texts, num_perm=64, shingle_size=5, seed=1, batch_size=5_000):
+    # (n_texts, num_perm) uint32 signatures. Shingles are hashed to 32 bits, so (a * x + b) fits in uint64.
+    a, b = _permutations(num_perm, seed)
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        shingles = [[text[i:i + shingle_size] for i in range(max(len(text) - shingle_size + 1, 1))] for text in batch]
+        lengths = np.array([len(text_shingles) for text_shingles in shingles])
+        flat = np.array([shingle for text_shingles in shingles for shingle in text_shingles], dtype=object)
+        hashed = pd.util.hash_array(flat) & np.uint64(0xFFFFFFFF)
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        for perm in range(num_perm):
+            values = (a[perm] * hashed + b[perm]) % _MERSENNE_PRIME
+            signatures[start:start + len(batch), perm] = np.minimum.reduceat(values, offsets) & np.uint64(0xFFFFFFFF)
+    return signatures
+
+
+def lsh_components(signatures, bands=16, threshold=0.8):
+    # Component label per row: rows sharing an LSH bucket in any band are linked if their signatures agree on
+    # at least threshold of the positions (estimated Jaccard similarity)
+    n, num_perm = signatures.shape
+    rows_per_band = num_perm // bands
+    sources, targets = [], []
+    for band in range(bands):
+        block = np.ascontiguousarray(signatures[:, band * rows_per_band:(band + 1) * rows_per_band])
+        _, first, buckets = np.unique(block.view(np.dtype((np.void, block.dtype.itemsize * rows_per_band))).ravel(),
+                                      return_index=True, return_inverse=True)
+        # link every row to the first row of its bucket
+        leaders = first[buckets.ravel()]
+        candidates = np.flatnonzero(leaders != np.arange(n))
+        similar = (signatures[candidates] == signatures[leaders[candidates]]).mean(axis=1) >= threshold
+        sources.append(candidates[similar])
+        targets.append(leaders[candidates[similar]])
+    sources, targets = np.concatenate(sources), np.concatenate(targets)
+    graph = sp.csr_matrix((np.ones(len(sources)), (sources, targets)), shape=(n, n))
+    return connected_components(graph, directed=False)[1]
+
+
+class ClusterMap:
+    # post id -> cluster, with one representative (text hash + signature) per cluster for later runs
+    def __init__(self, params=None, mapping=None, representatives=None, signatures=None):
+        self.params = {**DEFAULT_PARAMS, **(params or {})}
+        self.mapping = mapping if mapping is not None else pd.DataFrame(
+            {"id": pd.Series(dtype=np.int64), "text_hash": pd.Series(dtype=np.int64), "cluster": pd.Series(dtype=np.int64)})
+        self.representatives = representatives if representatives is not None else pd.DataFrame(
+            {"cluster": pd.Series(dtype=np.int64), "representative_id": pd.Series(dtype=np.int64), "text_hash": pd.Series(dtype=np.int64)})
+        self.signatures = signatures if signatures is not None else np.empty((0, self.params["num_perm"]), dtype=np.uint32)
+
+    @classmethod
+    def load(cls, directory, params=None):
+        # A missing directory, or one built with other MinHash parameters, starts an empty map
+        meta_path = os.path.join(directory, "meta.json")
+        if not os.path.exists(meta_path):
+            return cls(params)
+        with open(meta_path) as f:
+            stored = json.load(f)
+        if params and any(stored.get(key) != value for key, value in params.items()):
+            return cls(params)
+        return cls(stored, pd.read_parquet(os.path.join(directory, "mapping.parquet")),
+                   pd.read_parquet(os.path.join(directory, "representatives.parquet")),
+                   np.load(os.path.join(directory, "signatures.npy")))
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.mapping.to_parquet(os.path.join(directory, "mapping.parquet"), index=False)
+        self.representatives.to_parquet(os.path.join(directory, "representatives.parquet"), index=False)
+        np.save(os.path.join(directory, "signatures.npy"), self.signatures)
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump(self.params, f)
+        return directory
+
+    def assign(self, ids, texts):
+        # Cluster per post (Series indexed by id); posts already in the map keep their cluster
+        ids = np.asarray(ids, dtype=np.int64)
+        new = ~pd.Index(ids).isin(self.mapping["id"])
+        if new.any():
+            self._add(ids[new], [texts[i] for i in np.flatnonzero(new)])
+        return self.mapping.set_index("id")["cluster"].reindex(ids)
+
+    def _add(self, ids, texts):
+        params = self.params
+        with span("dedup_posts", posts=len(ids)) as counters:
+            normalised = [normalise_text(text) for text in texts]
+            hashes = text_hashes(normalised)
+            # 1. exact duplicates, against each other and the existing representatives
+            unique_hashes, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+            existing = pd.Index(self.representatives["text_hash"]).get_indexer(unique_hashes)
+            fresh = np.flatnonzero(existing < 0)
+            # 2. near-duplicates among the new distinct texts and the existing representatives
+            signatures = minhash_signatures([normalised[first[i]] for i in fresh], params["num_perm"],
+                                            params["shingle_size"], params["seed"])
+            n_existing = len(self.representatives)
+            labels = lsh_components(np.vstack([self.signatures, signatures]), params["bands"], params["threshold"])
+            # a component keeps the oldest existing cluster in it, otherwise it becomes a new cluster
+            component_cluster = pd.Series(self.representatives["cluster"].to_numpy(), index=labels[:n_existing])
+            component_cluster = component_cluster.groupby(level=0).min()
+            fresh_labels = labels[n_existing:]
+            next_cluster = int(self.representatives["cluster"].max()) + 1 if n_existing else 0
+            unseen = pd.unique(fresh_labels[~pd.Index(fresh_labels).isin(component_cluster.index)])
+            component_cluster = pd.concat([component_cluster, pd.Series(np.arange(next_cluster, next_cluster + len(unseen)), index=unseen)])
+            cluster_of_unique = np.empty(len(unique_hashes), dtype=np.int64)
+            cluster_of_unique[existing >= 0] = self.representatives["cluster"].to_numpy()[existing[existing >= 0]]
+            cluster_of_unique[fresh] = component_cluster.reindex(fresh_labels).to_numpy()
+            clusters = cluster_of_unique[inverse]
+            # every new distinct text becomes a representative too, so later near-duplicates can match it
+            self.representatives = pd.concat([self.representatives, pd.DataFrame({
+                "cluster": cluster_of_unique[fresh], "representative_id": ids[first[fresh]], "text_hash": unique_hashes[fresh]})],
+                ignore_index=True)
+            self.signatures = np.vstack([self.signatures, signatures])
+            self.mapping = pd.concat([self.mapping, pd.DataFrame({"id": ids, "text_hash": hashes, "cluster": clusters})], ignore_index=True)
+            counters["distinct_texts"] = len(unique_hashes)
+            counters["new_clusters"] = len(unseen)
+
+
+class ResponseStore:
+    # Raw LLM response per cluster in an append-only JSONL file. Each line is flushed as soon as it is
+    # written, so a crash loses at most the call in flight; a torn last line is skipped on load.
+    def __init__(self, path):
+        self.path = path
+        self.responses = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.responses[record["cluster"]] = record["raw"]
+
+    def __contains__(self, cluster):
+        return cluster in self.responses
+
+    def get(self, cluster):
+        return self.responses[cluster]
+
+    def put(self, cluster, raw_text):
+        self.responses[cluster] = raw_text
+        with open(self.path, "a") as f:
+            f.write(json.dumps({"cluster": int(cluster), "raw": raw_text}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def translate_deduplicated(rows, translate_fn, clusters, store, text_column="content", id_column="id"):
+    # Drop-in for structured_output.translate_rows: yields (row, raw response or exception) for every row,
+    # but calls translate_fn once per cluster. clusters: Series id -> cluster (ClusterMap.assign).
+    # Failed calls are not stored, they are retried on the next run (and dead-lettered for every member now).
+    failed = {}
+    n_calls = n_reused = 0
+    for row in rows:
+        cluster = int(clusters[row[id_column]])
+        if cluster in store:
+            raw_text = store.get(cluster)
+            n_reused += 1
+            count("llm_calls_saved", n_reused)
+        elif cluster in failed:
+            raw_text = failed[cluster]
+        else:
+            try:
+                with span("llm_call", characters=len(row[text_column] or ""), cluster=cluster):
+                    raw_text = translate_fn(row[text_column])
+                store.put(cluster, raw_text)
+            except Exception as error:
+                raw_text = failed[cluster] = error
+            n_calls += 1
+            count("llm_calls", n_calls)
+        yield row, raw_text
+
+
+def call_reduction(ids, texts, params=None):
+    # How many LLM calls exact hashing and MinHash/LSH clustering save on these posts
+    cluster_map = ClusterMap(params)
+    clusters = cluster_map.assign(ids, texts)
+    distinct_texts = cluster_map.mapping["text_hash"].nunique()
+    n_clusters = clusters.nunique()
+    return {
+        "posts": len(ids),
+        "distinct_texts": int(distinct_texts),
+        "clusters": int(n_clusters),
+        "exact_reduction": float(1 - distinct_texts / max(len(ids), 1)),
+        "llm_call_reduction": float(1 - n_clusters / max(len(ids), 1)),
+    }
+
+
+if __name__ == "__main__":
+    from db_access import DB_PATH, activities
+
+    parser = argparse.ArgumentParser(description="Measure how many LLM calls post deduplication saves")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--types", nargs="+", default=["commented-on-facebook", "shared-a-post-on-facebook", "posted-to-story-on-facebook"])
+    parser.add_argument("--threshold", type=float, default=DEFAULT_PARAMS["threshold"])
+    args = parser.parse_args()
+
+    posts = activities(args.db, args.types, with_content=True, columns=["id", "type", "content"])
+    for post_type, group in [("all", posts)] + list(posts.groupby("type")):
+        print(post_type, call_reduction(group["id"].to_numpy(), group["content"].tolist(), {"threshold": args.threshold}))
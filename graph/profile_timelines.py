@@ -0,0 +1,185 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import span
+
+# plot_profile_traffic's curve (days_from_latest, cumulative_traffic) for every profile at once.
+# Posts are sorted once by (profile_id, timestamp); each profile is then a contiguous segment of the sorted
+# arrays, described by offsets (a ragged array). The cumulative traffic is one global cumsum minus the value
+# at each segment start, relative time one subtraction of the segment's last timestamp.
+# Features per profile, relative to the latest post overall (so "recent" means the same for everyone):
+#   recent_traffic / rate_recent   traffic in the last window_days (and per day)
+#   rate_before                    per day in the window_days before that
+#   acceleration                   rate_recent - rate_before
+#   slope                          least-squares slope of the cumulative curve over the last window_days
+#   peak_burst, burst_start        most traffic in any burst_days window, and when that window starts
+#   burst_ratio, burst             peak_burst against the profile's average rate; burst if >= burst_ratio_threshold
+#   python profile_timelines.py --out profile_timelines     (store + features.parquet, top profiles by acceleration)
+
+MS_PER_DAY = 1000 * 3600 * 24
+
+
+class ProfileTimelines:
+    # Ragged store: profile i owns rows offsets[i]:offsets[i + 1] of the flat, time-sorted columns
+    COLUMNS = ["timestamp", "traffic_likelihood", "days_from_latest", "cumulative_traffic"]
+
+    def __init__(self, profile_ids, offsets, timestamp, traffic_likelihood, days_from_latest, cumulative_traffic):
+        self.profile_ids = profile_ids
+        self.offsets = offsets
+        self.timestamp = timestamp
+        self.traffic_likelihood = traffic_likelihood
+        self.days_from_latest = days_from_latest
+        self.cumulative_traffic = cumulative_traffic
+        self.index = pd.Index(profile_ids)
+
+    @property
+    def n_profiles(self):
+        return len(self.profile_ids)
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def segment(self):
+        # profile position of every flat row
+        return np.repeat(np.arange(self.n_profiles), self.lengths)
+
+    @classmethod
+    def from_posts(cls, posts):
+        # posts: DataFrame with profile_id, timestamp, traffic_likelihood (posts without a profile are dropped)
+        posts = posts.dropna(subset=["profile_id", "timestamp"])
+        with span("build_timelines", posts=len(posts)):
+            profile_id = posts["profile_id"].to_numpy(dtype=np.int64)
+            timestamp = posts["timestamp"].to_numpy(dtype=np.int64)
+            order = np.lexsort((timestamp, profile_id))
+            profile_id, timestamp = profile_id[order], timestamp[order]
+            traffic = posts["traffic_likelihood"].to_numpy(dtype=np.float64)[order]
+            traffic = np.nan_to_num(traffic)
+            starts = np.flatnonzero(np.r_[True, profile_id[1:] != profile_id[:-1]])
+            offsets = np.r_[starts, len(profile_id)].astype(np.int64)
+            lengths = np.diff(offsets)
+            # segmented cumsum: global running total minus the total before each segment
+            running = np.cumsum(traffic)
+            before = np.r_[0.0, running][starts]
+            cumulative = running - np.repeat(before, lengths)
+            latest = timestamp[offsets[1:] - 1]
+            days = (timestamp - np.repeat(latest, lengths)) / MS_PER_DAY
+        return cls(profile_id[starts], offsets, timestamp, traffic, days, cumulative)
+
+    def timeline(self, profile_id):
+        # One profile's curve, the columns plot_profile_traffic draws
+        position = self.index.get_indexer([profile_id])[0]
+        if position < 0:
+            return pd.DataFrame({column: [] for column in self.COLUMNS})
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return pd.DataFrame({column: np.asarray(getattr(self, column)[start:end]) for column in self.COLUMNS})
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name in ["profile_ids", "offsets"] + self.COLUMNS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump({"profiles": self.n_profiles, "posts": int(self.offsets[-1])}, f)
+        return directory
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+                  for name in ["profile_ids", "offsets"] + cls.COLUMNS}
+        arrays["profile_ids"] = np.asarray(arrays["profile_ids"])
+        arrays["offsets"] = np.asarray(arrays["offsets"])
+        return cls(**arrays)
+
+
+def _segment_sums(values, segment, n_segments):
+    return np.bincount(segment, weights=values, minlength=n_segments)
+
+
+def timeline_features(timelines, window_days=30, burst_days=7, burst_ratio_threshold=3.0, reference=None):
+    # One row per profile (indexed by profile_id), see the module comment. reference: timestamp (ms) that
+    # "recent" is measured back from, the latest post overall by default.
+    n = timelines.n_profiles
+    timestamp = np.asarray(timelines.timestamp)
+    traffic = np.asarray(timelines.traffic_likelihood)
+    cumulative = np.asarray(timelines.cumulative_traffic)
+    offsets, lengths, segment = timelines.offsets, timelines.lengths, timelines.segment
+    if not n:
+        return pd.DataFrame(columns=["posts", "total_traffic", "recent_traffic", "rate_recent", "rate_before", "acceleration",
+                                     "slope", "peak_burst", "burst_start", "burst_ratio", "burst"])
+    # every profile in the store has at least one post
+    with span("timeline_features", profiles=n, posts=len(timestamp)):
+        reference = int(timestamp.max()) if reference is None else reference
+        window = window_days * MS_PER_DAY
+        age = reference - timestamp
+        recent = age < window
+        previous = (age >= window) & (age < 2 * window)
+        recent_traffic = _segment_sums(np.where(recent, traffic, 0.0), segment, n)
+        previous_traffic = _segment_sums(np.where(previous, traffic, 0.0), segment, n)
+        # least-squares slope of cumulative traffic against days, over the recent posts of each profile
+        x = np.where(recent, -age / MS_PER_DAY, 0.0)
+        y = np.where(recent, cumulative, 0.0)
+        k = _segment_sums(recent.astype(np.float64), segment, n)
+        sx, sy = _segment_sums(x, segment, n), _segment_sums(y, segment, n)
+        sxx, sxy = _segment_sums(x * x, segment, n), _segment_sums(x * y, segment, n)
+        denominator = k * sxx - sx * sx
+        slope = np.divide(k * sxy - sx * sy, denominator, out=np.zeros(n), where=(k >= 2) & (denominator > 0))
+        # bursts: for every post, the traffic in [t, t + burst_days) of the same profile. Sorting by
+        # (profile, time) makes (segment, time) one increasing key, so a single searchsorted finds each window end.
+        burst = burst_days * MS_PER_DAY
+        span_ms = int(timestamp.max() - timestamp.min()) + burst + 1
+        key = segment.astype(np.int64) * span_ms + (timestamp - timestamp.min())
+        window_end = np.searchsorted(key, key + burst, side="left")
+        running = np.r_[0.0, np.cumsum(traffic)]
+        in_window = running[window_end] - running[:-1]
+        peak_burst = np.maximum.reduceat(in_window, offsets[:-1])
+        # the first post whose window reaches the peak
+        at_peak = np.flatnonzero(in_window == np.repeat(peak_burst, lengths))
+        burst_start = timestamp[at_peak[np.searchsorted(at_peak, offsets[:-1])]]
+        # expected traffic in burst_days at the profile's average rate since its first post
+        total = cumulative[offsets[1:] - 1]
+        active_days = np.maximum((reference - timestamp[offsets[:-1]]) / MS_PER_DAY, burst_days)
+        expected = total / active_days * burst_days
+        burst_ratio = np.divide(peak_burst, expected, out=np.zeros(n), where=expected > 0)
+        features = pd.DataFrame({
+            "posts": lengths,
+            "total_traffic": total,
+            "recent_traffic": recent_traffic,
+            "rate_recent": recent_traffic / window_days,
+            "rate_before": previous_traffic / window_days,
+            "acceleration": (recent_traffic - previous_traffic) / window_days,
+            "slope": slope,
+            "peak_burst": peak_burst,
+            "burst_start": burst_start,
+            "burst_ratio": burst_ratio,
+            "burst": burst_ratio >= burst_ratio_threshold,
+        }, index=pd.Index(timelines.profile_ids, name="profile_id"))
+    return features
+
+
+if __name__ == "__main__":
+    from enrichment_store import load_posts
+
+    parser = argparse.ArgumentParser(description="Cumulative traffic timelines and risk-acceleration features for every profile")
+    parser.add_argument("--db", default="../social_network_anonymized.db")
+    parser.add_argument("--posts", default="translated_posts.parquet")
+    parser.add_argument("--store", default="enrichment_store")
+    parser.add_argument("--out", default="profile_timelines")
+    parser.add_argument("--window-days", type=int, default=30)
+    parser.add_argument("--burst-days", type=int, default=7)
+    args = parser.parse_args()
+
+    posts = load_posts(["profile_id", "timestamp", "traffic_likelihood"], store_dir=args.store, legacy_path=args.posts, db_path=args.db)
+    start = time.perf_counter()
+    timelines = ProfileTimelines.from_posts(posts)
+    features = timeline_features(timelines, args.window_days, args.burst_days)
+    elapsed = time.perf_counter() - start
+    timelines.save(args.out)
+    features.to_parquet(os.path.join(args.out, "features.parquet"))
+    print(f"{timelines.n_profiles} profiles, {len(posts)} posts in {elapsed:.2f}s")
+    print(features.sort_values("acceleration", ascending=False).head(20).to_string())
@@ -0,0 +1,84 @@
+import hashlib
+import io
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Background rendering for the dashboard: layout + figure are computed in a process pool and cached by
+# (graph version, colouring inputs). While a new render runs the dashboard keeps showing its last finished one.
+
+SCORE_BANDS = np.array([0.4, 0.7])
+BAND_COLOURS = np.array(["green", "orange", "red"])
+
+
+def score_colours(scores, bands=SCORE_BANDS, colours=BAND_COLOURS):
+    # One colour per score: <= 0.4 green, <= 0.7 orange, above that red
+    return colours[np.searchsorted(bands, np.asarray(scores, dtype=np.float64), side="left")]
+
+
+def render_key(graph_version, *inputs):
+    digest = hashlib.sha256(str(graph_version).encode())
+    for value in inputs:
+        digest.update(np.ascontiguousarray(value).tobytes() if isinstance(value, np.ndarray) else repr(value).encode())
+    return digest.hexdigest()[:16]
+
+
+def render_network_png(nodes, edges, node_colours, seed=42, figsize=(10, 8)):
+    # Spring layout and matplotlib drawing, off the pyplot state machine so it is safe in any worker
+    import networkx as nx
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    graph = nx.Graph()
+    graph.add_nodes_from(nodes)
+    graph.add_edges_from(edges)
+    pos = nx.spring_layout(graph, seed=seed)
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    nx.draw_networkx(graph, pos, ax=ax, nodelist=list(nodes), with_labels=True,
+                     node_color=list(node_colours),
+                     node_size=500,
+                     font_size=10,
+                     font_weight='bold',
+                     edge_color='gray',
+                     width=1.0,
+                     alpha=0.8)
+    ax.axis('off')
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches="tight")
+    return buffer.getvalue()
+
+
+class RenderCache:
+    # Render futures by key, shared by every dashboard session (st.cache_resource)
+    def __init__(self, max_workers=2, max_entries=32):
+        # spawn: the Streamlit server is multi-threaded, forking it is unsafe
+        self.pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        self.max_entries = max_entries
+        self.futures = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args, **kwargs):
+        with self._lock:
+            if key not in self.futures:
+                if len(self.futures) >= self.max_entries:
+                    # drop the oldest finished render
+                    oldest = next((old for old, future in self.futures.items() if future.done()), None)
+                    if oldest is not None:
+                        del self.futures[oldest]
+                self.futures[key] = self.pool.submit(fn, *args, **kwargs)
+            return self.futures[key]
+
+    def result(self, key):
+        # The finished render for key, None while it is still running
+        future = self.futures.get(key)
+        if future is not None and future.done() and future.exception() is None:
+            return future.result()
+        return None
+
+    def error(self, key):
+        future = self.futures.get(key)
+        return future.exception() if future is not None and future.done() else None
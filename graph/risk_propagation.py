@@ -0,0 +1,139 @@
+from collections import deque
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from instrumentation import span
+
+# Risk scores by personalized PageRank (random walk with restart) from the suspicious seeds, over the
+# sparse ProfileConnection graph (GraphArrays). Each edge type gets its own weight, so a friendship can
+# count for more than being in the same group. Three ways to compute it:
+#   personalized_pagerank  - power iteration over the whole graph, one seed set
+#   batched_pagerank       - power iteration for many seed sets at once (one column each)
+#   push_pagerank          - approximate local push; only touches the neighbourhood that gets score > epsilon
+
+DEFAULT_EDGE_TYPE_WEIGHTS = {
+    "friend_with": 1.0,
+    "commented_on": 0.7,
+    "tagged": 0.7,
+    "follower": 0.5,
+    "in_same_group": 0.3,
+}
+
+
+def edge_weights(arrays, edge_type_weights=None, default_weight=0.0):
+    # One weight per edge from its label; unknown labels get default_weight (0 drops them)
+    edge_type_weights = DEFAULT_EDGE_TYPE_WEIGHTS if edge_type_weights is None else edge_type_weights
+    labels = pd.Series(arrays.edge_attrs["label"])
+    return labels.map(edge_type_weights).fillna(default_weight).to_numpy(dtype=np.float64)
+
+
+def transition_matrix(arrays, edge_type_weights=None):
+    # Row-stochastic P = D^-1 W and the weighted degrees (0 for nodes with no weighted edges)
+    adjacency = arrays.adjacency(edge_weights(arrays, edge_type_weights))
+    adjacency.eliminate_zeros()
+    degrees = np.asarray(adjacency.sum(axis=1)).ravel()
+    inverse = np.divide(1.0, degrees, out=np.zeros_like(degrees), where=degrees > 0)
+    return sp.diags(inverse) @ adjacency, degrees
+
+
+def _restart_vectors(n_nodes, seed_sets):
+    # Column j is the uniform restart distribution over seed_sets[j]
+    if any(len(seeds) == 0 for seeds in seed_sets):
+        raise ValueError("every seed set needs at least one node in the graph")
+    rows = np.concatenate([np.asarray(seeds, dtype=np.int64) for seeds in seed_sets])
+    cols = np.repeat(np.arange(len(seed_sets)), [len(seeds) for seeds in seed_sets])
+    values = np.concatenate([np.full(len(seeds), 1.0 / len(seeds)) for seeds in seed_sets])
+    return sp.csr_matrix((values, (rows, cols)), shape=(n_nodes, len(seed_sets))).toarray()
+
+
+def batched_pagerank(transition, degrees, seed_sets, alpha=0.15, tol=1e-8, max_iter=200):
+    # x = alpha * s + (1 - alpha) * P^T x for every seed set at once; walkers stuck on nodes without
+    # edges restart at their seeds. Returns an (n_nodes, n_seed_sets) array whose columns sum to 1.
+    restart = _restart_vectors(transition.shape[0], seed_sets)
+    dangling = degrees == 0
+    transposed = transition.T.tocsr()
+    scores = restart.copy()
+    with span("batched_pagerank", nodes=transition.shape[0], seed_sets=len(seed_sets)) as counters:
+        for iteration in range(1, max_iter + 1):
+            stuck = scores[dangling].sum(axis=0)
+            updated = alpha * restart + (1 - alpha) * (transposed @ scores + restart * stuck)
+            change = np.abs(updated - scores).sum(axis=0).max()
+            scores = updated
+            if change < tol:
+                break
+        counters["iterations"] = iteration
+    return scores
+
+
+def personalized_pagerank(arrays, seeds, alpha=0.15, edge_type_weights=None, tol=1e-8, max_iter=200):
+    # Risk score per node id (pd.Series), seeds are node ids
+    positions = arrays.positions(seeds)
+    positions = positions[positions >= 0]
+    if not len(positions):
+        # no seed in the graph (e.g. no profile passes the seed thresholds): nothing to propagate
+        return pd.Series(np.zeros(arrays.n_nodes), index=arrays.node_ids, name="risk_score")
+    transition, degrees = transition_matrix(arrays, edge_type_weights)
+    scores = batched_pagerank(transition, degrees, [positions], alpha, tol, max_iter)[:, 0]
+    return pd.Series(scores, index=arrays.node_ids, name="risk_score")
+
+
+def push_pagerank(transition, degrees, seeds, alpha=0.15, epsilon=1e-6):
+    # Forward push (Andersen, Chung & Lang): residual mass is pushed out of a node while it exceeds
+    # epsilon * degree, so the work depends on how far the score spreads, not on the graph size.
+    # Scores are within epsilon * degree of the exact PPR. Returns {position: score} for touched nodes.
+    indptr, indices, data = transition.indptr, transition.indices, transition.data
+    seeds = np.asarray(seeds, dtype=np.int64)
+    if len(seeds) == 0:
+        raise ValueError("no seed nodes in the graph")
+    estimate = {}
+    residual = dict.fromkeys(seeds.tolist(), 1.0 / len(seeds))
+    queue = deque(residual)
+    queued = set(queue)
+    with span("push_pagerank", seeds=len(seeds)) as counters:
+        n_pushes = 0
+        while queue:
+            node = queue.popleft()
+            queued.discard(node)
+            mass = residual.pop(node, 0.0)
+            if mass == 0.0:
+                continue
+            n_pushes += 1
+            estimate[node] = estimate.get(node, 0.0) + alpha * mass
+            start, end = indptr[node], indptr[node + 1]
+            spread = (1 - alpha) * mass
+            if start == end:
+                # no edges: the walk restarts at the seeds, as in batched_pagerank
+                neighbours, probabilities = seeds.tolist(), [1.0 / len(seeds)] * len(seeds)
+            else:
+                neighbours, probabilities = indices[start:end].tolist(), data[start:end].tolist()
+            for neighbour, probability in zip(neighbours, probabilities):
+                value = residual.get(neighbour, 0.0) + spread * probability
+                residual[neighbour] = value
+                if neighbour not in queued and value > epsilon * degrees[neighbour]:
+                    queue.append(neighbour)
+                    queued.add(neighbour)
+        counters["pushes"] = n_pushes
+        counters["touched"] = len(estimate)
+    return estimate
+
+
+def local_risk_scores(arrays, seeds, alpha=0.15, epsilon=1e-6, edge_type_weights=None, transition=None):
+    # push_pagerank by node id, only the nodes that received score, highest first.
+    # Pass transition=(P, degrees) from transition_matrix to reuse it across calls.
+    transition, degrees = transition or transition_matrix(arrays, edge_type_weights)
+    positions = arrays.positions(seeds)
+    estimate = push_pagerank(transition, degrees, positions[positions >= 0], alpha, epsilon)
+    touched = np.fromiter(estimate, dtype=np.int64, count=len(estimate))
+    scores = pd.Series(np.fromiter(estimate.values(), dtype=np.float64, count=len(estimate)), index=arrays.node_ids[touched], name="risk_score")
+    return scores.sort_values(ascending=False)
+
+
+def batched_risk_scores(arrays, seed_sets, alpha=0.15, edge_type_weights=None, tol=1e-8, max_iter=200):
+    # seed_sets: name -> node ids (e.g. one set per region or per investigation). DataFrame, one column per set
+    positions = {name: arrays.positions(seeds) for name, seeds in seed_sets.items()}
+    positions = {name: found[found >= 0] for name, found in positions.items()}
+    transition, degrees = transition_matrix(arrays, edge_type_weights)
+    scores = batched_pagerank(transition, degrees, list(positions.values()), alpha, tol, max_iter)
+    return pd.DataFrame(scores, index=arrays.node_ids, columns=list(positions))
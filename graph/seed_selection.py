@@ -0,0 +1,182 @@
+import hashlib
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import span
+
+# Seed selection for the label propagation. Per-profile traffic_likelihood aggregates are computed once,
+# turned into a score (sum, mean, max or a post-count-aware shrunk mean) and cut either at absolute
+# thresholds or at quantiles estimated with a mergeable streaming sketch, so changing thresholds never
+# re-reads the posts. Seed sets are cached on disk by aggregate fingerprint + parameters.
+
+SCORES = ["sum", "mean", "max", "shrunk_mean"]
+
+DEFAULT_PARAMS = {
+    "score": "sum",
+    "thresholds": "absolute",  # or "quantile"
+    "suspicious_threshold": 100,
+    "not_suspicious_threshold": 1,
+    "suspicious_quantile": 0.99,
+    "not_suspicious_quantile": 0.5,
+    "min_posts": 1,
+    "prior_posts": 5,  # shrunk_mean: pseudo-posts at the global mean
+}
+
+
+def profile_aggregates(posts):
+    # One groupby over the posts: post count, sum, mean and max traffic_likelihood per profile
+    with span("profile_aggregates", posts=len(posts)) as counters:
+        aggregates = posts.groupby("profile_id")["traffic_likelihood"].agg(["count", "sum", "mean", "max"])
+        aggregates = aggregates.rename(columns={"count": "n_posts"})
+        aggregates.index = aggregates.index.astype(int)
+        counters["profiles"] = len(aggregates)
+    return aggregates
+
+
+def profile_scores(aggregates, score="sum", prior_posts=5):
+    if score not in SCORES:
+        raise ValueError(f"score must be one of {SCORES}, got {score!r}")
+    if score == "shrunk_mean":
+        # Mean pulled towards the global mean by prior_posts pseudo-posts, so one 5/5 post does not outrank 50 posts at 4/5
+        global_mean = aggregates["sum"].sum() / aggregates["n_posts"].sum()
+        return (aggregates["sum"] + prior_posts * global_mean) / (aggregates["n_posts"] + prior_posts)
+    return aggregates[score].astype(np.float64)
+
+
+class QuantileSketch:
+    # KLL-style sketch: levels of sorted samples, each level compacted by keeping every other item
+    # (random offset) and promoting them with double weight. Memory is O(k log(n / k)), sketches merge.
+    def __init__(self, k=256, seed=0):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.n = 0
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        self.n += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compact()
+        return self
+
+    def merge(self, other):
+        for level, items in enumerate(other.levels):
+            if level >= len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self._compact()
+        return self
+
+    def _compact(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.k:
+                items = np.sort(items)
+                if len(items) % 2:
+                    # keep the odd one out at this level
+                    kept, items = items[-1:], items[:-1]
+                else:
+                    kept = np.empty(0)
+                promoted = items[self._rng.integers(2)::2]
+                self.levels[level] = kept
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def quantile(self, q):
+        # q may be a scalar or an array of quantiles in [0, 1]; NaN while the sketch is empty
+        values = np.concatenate(self.levels)
+        if not len(values):
+            return np.full(np.shape(q), np.nan)[()]
+        weights = np.concatenate([np.full(len(items), 2.0 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        values, cumulative = values[order], np.cumsum(weights[order])
+        ranks = np.asarray(q, dtype=np.float64) * cumulative[-1]
+        positions = np.minimum(np.searchsorted(cumulative, ranks, side="left"), len(values) - 1)
+        return values[positions]
+
+
+def sketch_scores(scores, k=256, chunk_size=100_000):
+    # Feed a score column into a sketch chunk by chunk, as it would be streamed from a larger-than-memory table
+    sketch = QuantileSketch(k)
+    values = np.asarray(scores, dtype=np.float64)
+    for start in range(0, len(values), chunk_size):
+        sketch.update(values[start:start + chunk_size])
+    return sketch
+
+
+def select_seeds(aggregates, params=None, sketch=None):
+    # -> (suspicious profile ids, not_suspicious profile ids)
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    eligible = aggregates[aggregates["n_posts"] >= params["min_posts"]]
+    scores = profile_scores(eligible, params["score"], params["prior_posts"])
+    if params["thresholds"] == "quantile":
+        sketch = sketch or sketch_scores(scores)
+        suspicious_threshold, not_suspicious_threshold = sketch.quantile([params["suspicious_quantile"], params["not_suspicious_quantile"]])
+    elif params["thresholds"] == "absolute":
+        suspicious_threshold, not_suspicious_threshold = params["suspicious_threshold"], params["not_suspicious_threshold"]
+    else:
+        raise ValueError(f"thresholds must be 'absolute' or 'quantile', got {params['thresholds']!r}")
+    values = scores.to_numpy()
+    ids = scores.index.to_numpy()
+    suspicious = ids[values >= suspicious_threshold]
+    # A profile in both sets ends up not_suspicious, same as seed_labels_from_traffic_likelihood
+    not_suspicious = ids[values <= not_suspicious_threshold]
+    return suspicious, not_suspicious
+
+
+def aggregates_fingerprint(aggregates):
+    return hashlib.sha256(pd.util.hash_pandas_object(aggregates, index=True).to_numpy().tobytes()).hexdigest()[:16]
+
+
+def cached_seeds(aggregates, params=None, cache_dir=".seed_cache", fingerprint=None):
+    # select_seeds, memoised on disk as <cache_dir>/<key>.npz
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    fingerprint = fingerprint or aggregates_fingerprint(aggregates)
+    key = hashlib.sha256(json.dumps({"aggregates": fingerprint, "params": params}, sort_keys=True).encode()).hexdigest()[:16]
+    path = os.path.join(cache_dir, f"{key}.npz")
+    if os.path.isfile(path):
+        with np.load(path) as cached:
+            return cached["suspicious"], cached["not_suspicious"]
+    suspicious, not_suspicious = select_seeds(aggregates, params)
+    os.makedirs(cache_dir, exist_ok=True)
+    np.savez(path + ".tmp.npz", suspicious=suspicious, not_suspicious=not_suspicious)
+    os.replace(path + ".tmp.npz", path)
+    return suspicious, not_suspicious
+
+
+def _sweep_point(aggregates, fingerprint, params, cache_dir):
+    suspicious, not_suspicious = cached_seeds(aggregates, params, cache_dir, fingerprint)
+    n_posts = aggregates["n_posts"]
+    return {
+        **params,
+        "n_suspicious": len(suspicious),
+        "n_not_suspicious": len(not_suspicious),
+        # how much the seed set leans towards prolific posters
+        "median_posts_suspicious": float(n_posts.reindex(suspicious).median()) if len(suspicious) else np.nan,
+        "median_posts_all": float(n_posts.median()),
+    }
+
+
+def sweep_thresholds(aggregates, grid, jobs=1, cache_dir=".seed_cache"):
+    # grid: param name -> list of values, every combination is evaluated (in `jobs` processes), seed sets cached
+    # e.g. sweep_thresholds(aggregates, {"score": ["sum", "shrunk_mean"], "thresholds": ["quantile"], "suspicious_quantile": [0.95, 0.99]})
+    fingerprint = aggregates_fingerprint(aggregates)
+    names = list(grid)
+    points = [{**DEFAULT_PARAMS, **dict(zip(names, values))} for values in itertools.product(*grid.values())]
+    with span("sweep_thresholds", points=len(points), jobs=jobs):
+        if jobs <= 1:
+            rows = [_sweep_point(aggregates, fingerprint, params, cache_dir) for params in points]
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                rows = list(pool.map(_sweep_point, itertools.repeat(aggregates), itertools.repeat(fingerprint), points, itertools.repeat(cache_dir)))
+    return pd.DataFrame(rows)
@@ -0,0 +1,218 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from instrumentation import span
+
+# Partitioned execution of the create_graph.py steps. Nodes are sharded by region (or hashed into n shards);
+# each shard owns its nodes and sees a one-hop halo of neighbours owned by other shards. The graph (CSR),
+# the per-node inputs and the propagation state live in shared memory, so workers attach instead of copying.
+#   1. extraction + aggregation: each shard marks which of its nodes are in the neighbourhood subgraph
+#      (profiles with posts and their neighbours) and aggregates its traffic_likelihood
+#   2. propagation: the harmonic function iteration F <- D^-1 A F with the seeds clamped, run per shard
+#      with the halo rows fixed, then the owned rows are published (double buffered) and every shard picks
+#      up its new halo values in the next round. With inner_iterations=1 this is exactly the global
+#      iteration networkx runs, just spread over processes.
+
+_worker = {}
+
+
+class SharedArrays:
+    # numpy arrays copied into named shared memory blocks; pass .spec to workers and attach() there
+    def __init__(self, arrays):
+        self.blocks = {}
+        self.spec = {}
+        for name, values in arrays.items():
+            values = np.ascontiguousarray(values)
+            block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            np.ndarray(values.shape, values.dtype, buffer=block.buf)[...] = values
+            self.blocks[name] = block
+            self.spec[name] = (block.name, values.shape, values.dtype.str)
+
+    def __getitem__(self, name):
+        block_name, shape, dtype = self.spec[name]
+        return np.ndarray(shape, np.dtype(dtype), buffer=self.blocks[name].buf)
+
+    def close(self):
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach(spec):
+    # Views on the shared blocks; the SharedMemory handles are kept alive alongside
+    blocks = {name: shared_memory.SharedMemory(name=block_name) for name, (block_name, _, _) in spec.items()}
+    views = {name: np.ndarray(shape, np.dtype(dtype), buffer=blocks[name].buf) for name, (_, shape, dtype) in spec.items()}
+    return views, blocks
+
+
+def _init_worker(spec):
+    _worker["arrays"], _worker["blocks"] = attach(spec)
+    _worker["shards"] = {}
+
+
+def partition_nodes(arrays, by="region", n_shards=None):
+    # Shard number per node position and the shard names
+    if by == "region":
+        regions = pd.Series(arrays.node_attrs["region"], dtype=object).fillna("unknown")
+        codes, names = pd.factorize(regions, sort=True)
+        return codes.astype(np.int32), list(names)
+    if by == "hash":
+        n_shards = n_shards or os.cpu_count()
+        codes = pd.util.hash_array(np.asarray(arrays.node_ids)) % n_shards
+        return codes.astype(np.int32), [f"shard_{shard}" for shard in range(n_shards)]
+    raise ValueError(f"by must be 'region' or 'hash', got {by!r}")
+
+
+def _shard(shard):
+    # Owned rows, halo and the shard-local CSR, built once per worker and shard
+    if shard in _worker["shards"]:
+        return _worker["shards"][shard]
+    arrays = _worker["arrays"]
+    indptr, indices = arrays["indptr"], arrays["indices"]
+    owned = np.flatnonzero(arrays["shard_of"] == shard)
+    starts = indptr[owned]
+    lengths = indptr[owned + 1] - starts
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    columns = indices[np.repeat(starts, lengths) + offsets]
+    rows = np.repeat(np.arange(len(owned)), lengths)
+    structure = {"owned": owned, "rows": rows, "columns": columns}
+    _worker["shards"][shard] = structure
+    return structure
+
+
+def _extract_and_aggregate(shard):
+    # Neighbourhood subgraph membership for the owned nodes (a node is active if it, or a neighbour, has posts)
+    arrays = _worker["arrays"]
+    structure = _shard(shard)
+    owned, rows, columns = structure["owned"], structure["rows"], structure["columns"]
+    has_posts = ~np.isnan(arrays["score"])
+    active = has_posts[owned].copy()
+    np.logical_or.at(active, rows, has_posts[columns])
+    arrays["active"][owned] = active
+    scores = arrays["score"][owned]
+    return {
+        "shard": shard,
+        "nodes": len(owned),
+        "active_nodes": int(active.sum()),
+        "profiles_with_posts": int(has_posts[owned].sum()),
+        "traffic_likelihood": float(np.nansum(scores)),
+        "suspicious_seeds": int((arrays["seed"][owned] == 1).sum()),
+        "not_suspicious_seeds": int((arrays["seed"][owned] == 0).sum()),
+        "halo_edges": int((arrays["shard_of"][columns] != shard).sum()),
+        "internal_edges": int((arrays["shard_of"][columns] == shard).sum()) // 2,
+    }
+
+
+def _propagation_operator(shard):
+    # Row-normalised adjacency among active nodes: owned active rows x (owned active + halo) columns
+    structure = _shard(shard)
+    if "operator" in structure:
+        return structure
+    arrays = _worker["arrays"]
+    active = arrays["active"]
+    owned, rows, columns = structure["owned"], structure["rows"], structure["columns"]
+    keep = active[owned][rows] & active[columns]
+    owned_active = owned[active[owned]]
+    local_rows = np.full(len(owned), -1, dtype=np.int64)
+    local_rows[active[owned]] = np.arange(len(owned_active))
+    halo = np.setdiff1d(columns[keep], owned_active)
+    local_nodes = np.concatenate([owned_active, halo])
+    lookup = pd.Index(local_nodes)
+    matrix = sp.csr_matrix((np.ones(keep.sum()), (local_rows[rows[keep]], lookup.get_indexer(columns[keep]))),
+                           shape=(len(owned_active), len(local_nodes)))
+    degrees = np.asarray(matrix.sum(axis=1)).ravel()
+    inverse = np.divide(1.0, degrees, out=np.zeros_like(degrees), where=degrees > 0)
+    seeds = arrays["seed"][owned_active]
+    structure.update({
+        "operator": sp.diags(inverse) @ matrix,
+        "local_nodes": local_nodes,
+        "clamped": np.flatnonzero(seeds >= 0),
+        "clamped_values": np.eye(2)[seeds[seeds >= 0]],
+    })
+    return structure
+
+
+def _propagate_round(shard, read, inner_iterations):
+    # One round for one shard: iterate with the halo fixed, publish the owned rows into the other buffer
+    arrays = _worker["arrays"]
+    structure = _propagation_operator(shard)
+    source, target = arrays[f"F{read}"], arrays[f"F{1 - read}"]
+    local = source[structure["local_nodes"]]
+    n_owned = structure["operator"].shape[0]
+    before = local[:n_owned].copy()
+    for _ in range(inner_iterations):
+        local[:n_owned] = structure["operator"] @ local
+        local[structure["clamped"]] = structure["clamped_values"]
+    target[structure["local_nodes"][:n_owned]] = local[:n_owned]
+    return float(np.abs(local[:n_owned] - before).max()) if n_owned else 0.0
+
+
+def sharded_harmonic_function(arrays, traffic_likelihood, suspicious, not_suspicious, by="region", n_shards=None,
+                              jobs=None, max_rounds=30, inner_iterations=1, tol=0.0):
+    # Neighbourhood subgraph + harmonic function for the whole graph, shard by shard in a process pool.
+    # traffic_likelihood: per-profile sums (Series or the create_graph.py DataFrame), seeds are node ids.
+    # Returns (per-node DataFrame: shard, active, suspicious_probability, graph_based_prediction,
+    #          per-shard DataFrame of sizes and aggregates)
+    if isinstance(traffic_likelihood, pd.DataFrame):
+        traffic_likelihood = traffic_likelihood["traffic_likelihood"]
+    jobs = jobs or os.cpu_count()
+    shard_of, names = partition_nodes(arrays, by, n_shards)
+    adjacency = arrays.adjacency()
+    score = np.full(arrays.n_nodes, np.nan)
+    positions = arrays.positions(traffic_likelihood.index.to_numpy())
+    score[positions[positions >= 0]] = traffic_likelihood.to_numpy(dtype=np.float64)[positions >= 0]
+    # -1 unlabelled, 0 not_suspicious, 1 suspicious (column order of F); not_suspicious wins overlaps as before
+    seed = np.full(arrays.n_nodes, -1, dtype=np.int8)
+    for value, nodes in ((1, suspicious), (0, not_suspicious)):
+        found = arrays.positions(np.asarray(nodes))
+        seed[found[found >= 0]] = value
+    initial = np.zeros((arrays.n_nodes, 2))
+    initial[seed == 1, 1] = 1.0
+    initial[seed == 0, 0] = 1.0
+    shared = SharedArrays({
+        "indptr": adjacency.indptr.astype(np.int64),
+        "indices": adjacency.indices.astype(np.int64),
+        "shard_of": shard_of,
+        "score": score,
+        "seed": seed,
+        "active": np.zeros(arrays.n_nodes, dtype=bool),
+        "F0": initial,
+        "F1": initial,
+    })
+    shards = list(range(len(names)))
+    with shared, span("sharded_harmonic_function", shards=len(shards), jobs=jobs) as counters:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(shared.spec,)) as pool:
+            with span("shard_extract_aggregate"):
+                stats = list(pool.map(_extract_and_aggregate, shards))
+            read = 0
+            for round_number in range(1, max_rounds + 1):
+                with span("shard_propagation_round", round=round_number):
+                    change = max(pool.map(_propagate_round, shards, [read] * len(shards), [inner_iterations] * len(shards)))
+                read = 1 - read
+                if change <= tol:
+                    break
+        counters["rounds"] = round_number
+        active = shared["active"].copy()
+        F = shared[f"F{read}"].copy()
+    prediction = np.where(F[:, 1] > F[:, 0], "suspicious", "not_suspicious").astype(object)
+    prediction[~active] = None
+    total = F.sum(axis=1)
+    nodes = pd.DataFrame({
+        "shard": np.asarray(names, dtype=object)[shard_of],
+        "active": active,
+        "suspicious_probability": np.divide(F[:, 1], total, out=np.full(len(total), np.nan), where=total > 0),
+        "graph_based_prediction": prediction,
+    }, index=pd.Index(arrays.node_ids, name="id"))
+    shard_stats = pd.DataFrame(stats).assign(shard=lambda frame: [names[shard] for shard in frame["shard"]]).set_index("shard")
+    return nodes, shard_stats
@@ -0,0 +1,251 @@
+import json
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+# Hashed TF-IDF embeddings: every unigram/bigram is hashed into HASH_BUCKETS idf slots and then
+# scattered into a small dense vector with a fixed sparse random projection. Fully local, no model download.
+HASH_BUCKETS = 2 ** 20
+EMBEDDING_DIM = 256
+PROJECTIONS_PER_TERM = 4
+
+
+def iter_text_batches(parquet_path, batch_size=50_000, text_column="translated_content"):
+    parquet_file = pq.ParquetFile(parquet_path)
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=["id", text_column]):
+        yield batch.column("id").to_numpy(zero_copy_only=False), batch.column(text_column).to_pylist()
+
+
+def _hashed_terms(texts):
+    # Returns (row in batch, hash bucket) for every unigram and bigram in the batch
+    tokens = pd.Series(texts, dtype=object).fillna("").str.lower().str.findall(r"\w+").explode().dropna()
+    doc = tokens.index.to_numpy(dtype=np.int64)
+    words = tokens.to_numpy(dtype=object)
+    same_doc = doc[1:] == doc[:-1]
+    bigrams = words[:-1][same_doc] + " " + words[1:][same_doc]
+    terms = np.concatenate([words, bigrams])
+    term_doc = np.concatenate([doc, doc[:-1][same_doc]])
+    if len(terms) == 0:
+        return term_doc, np.zeros(0, dtype=np.int64)
+    buckets = (pd.util.hash_array(terms) % HASH_BUCKETS).astype(np.int64)
+    return term_doc, buckets
+
+
+@lru_cache(maxsize=4)
+def _projection(dim, seed):
+    rng = np.random.default_rng(seed)
+    columns = rng.integers(0, dim, size=(HASH_BUCKETS, PROJECTIONS_PER_TERM), dtype=np.int32)
+    signs = rng.choice(np.array([-1.0, 1.0], dtype=np.float32), size=(HASH_BUCKETS, PROJECTIONS_PER_TERM))
+    return columns, signs
+
+
+def document_frequencies(texts):
+    term_doc, buckets = _hashed_terms(texts)
+    unique_pairs = np.unique(term_doc * HASH_BUCKETS + buckets)
+    return np.bincount(unique_pairs % HASH_BUCKETS, minlength=HASH_BUCKETS)
+
+
+def fit_idf(parquet_path, batch_size=50_000, text_column="translated_content"):
+    # First pass over the parquet: document frequency per hash bucket
+    df = np.zeros(HASH_BUCKETS, dtype=np.int64)
+    n_docs = 0
+    for _, texts in iter_text_batches(parquet_path, batch_size, text_column):
+        df += document_frequencies(texts)
+        n_docs += len(texts)
+    idf = (np.log((1 + n_docs) / (1 + df)) + 1).astype(np.float32)
+    return idf
+
+
+def embed_texts(texts, idf, dim=EMBEDDING_DIM, seed=0):
+    # Sublinear tf * idf, projected to `dim` and L2 normalised, one bincount per batch
+    term_doc, buckets = _hashed_terms(texts)
+    pairs, tf = np.unique(term_doc * HASH_BUCKETS + buckets, return_counts=True)
+    doc, bucket = pairs // HASH_BUCKETS, pairs % HASH_BUCKETS
+    weights = (1 + np.log(tf)) * idf[bucket]
+    columns, signs = _projection(dim, seed)
+    flat = (doc[:, None] * dim + columns[bucket]).ravel()
+    values = (weights[:, None] * signs[bucket]).ravel()
+    vectors = np.bincount(flat, weights=values, minlength=len(texts) * dim).reshape(len(texts), dim).astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+def _spherical_kmeans(vectors, n_clusters, n_iter=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        # Re-seed empty clusters from random points
+        empty = counts == 0
+        sums[empty] = vectors[rng.choice(len(vectors), size=empty.sum())]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-12)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    # Inverted-file ANN index persisted in a directory:
+    #   meta.json, idf.npy, centroids.npy and append-only raw files for vectors / ids / list assignments.
+    # Vectors are memory-mapped, so the index can be larger than RAM and new posts are appended in place.
+
+    def __init__(self, index_dir, idf, centroids, dim=EMBEDDING_DIM, seed=0):
+        self.index_dir = index_dir
+        self.idf = idf
+        self.centroids = centroids
+        self.dim = dim
+        self.seed = seed
+        self._lists = None
+        self._id_positions = None
+
+    @classmethod
+    def load(cls, index_dir):
+        with open(os.path.join(index_dir, "meta.json")) as f:
+            meta = json.load(f)
+        idf = np.load(os.path.join(index_dir, "idf.npy"))
+        centroids = np.load(os.path.join(index_dir, "centroids.npy"))
+        return cls(index_dir, idf, centroids, dim=meta["dim"], seed=meta["seed"])
+
+    def _path(self, name):
+        return os.path.join(self.index_dir, name)
+
+    def save(self):
+        # Writes a fresh, empty index: the raw files are truncated, since rows embedded with an older idf / centroids
+        # do not belong with the new ones (add() is the only thing that appends)
+        os.makedirs(self.index_dir, exist_ok=True)
+        np.save(self._path("idf.npy"), self.idf)
+        np.save(self._path("centroids.npy"), self.centroids)
+        with open(self._path("meta.json"), "w") as f:
+            json.dump({"dim": self.dim, "seed": self.seed, "n_lists": len(self.centroids)}, f)
+        for name in ["vectors.f32", "ids.i64", "lists.i32"]:
+            open(self._path(name), "wb").close()
+        self._lists = None
+        self._id_positions = None
+
+    def __len__(self):
+        return os.path.getsize(self._path("ids.i64")) // 8
+
+    @property
+    def vectors(self):
+        if len(self) == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.memmap(self._path("vectors.f32"), dtype=np.float32, mode="r", shape=(len(self), self.dim))
+
+    @property
+    def ids(self):
+        if len(self) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.memmap(self._path("ids.i64"), dtype=np.int64, mode="r")
+
+    def embed(self, texts):
+        return embed_texts(texts, self.idf, self.dim, self.seed)
+
+    def add(self, vectors, ids):
+        # Incremental add: assign to the nearest list and append to the raw files
+        assignment = np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+        with open(self._path("vectors.f32"), "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self._path("ids.i64"), "ab") as f:
+            f.write(np.asarray(ids, dtype=np.int64).tobytes())
+        with open(self._path("lists.i32"), "ab") as f:
+            f.write(assignment.tobytes())
+        self._lists = None
+        self._id_positions = None
+
+    def _inverted_lists(self):
+        # Row positions grouped by list, plus offsets into that order
+        if self._lists is None:
+            assignment = np.fromfile(self._path("lists.i32"), dtype=np.int32)
+            order = np.argsort(assignment, kind="stable")
+            offsets = np.searchsorted(assignment[order], np.arange(len(self.centroids) + 1))
+            self._lists = (order, offsets)
+        return self._lists
+
+    def position_of(self, post_id):
+        if self._id_positions is None:
+            self._id_positions = pd.Index(np.asarray(self.ids))
+        return self._id_positions.get_loc(post_id)
+
+    def search(self, queries, k=10, n_probe=8):
+        queries = np.atleast_2d(queries).astype(np.float32)
+        order, offsets = self._inverted_lists()
+        vectors = self.vectors
+        ids = self.ids
+        probe = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :n_probe]
+        result_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        result_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for i, lists in enumerate(probe):
+            candidates = np.concatenate([order[offsets[l]:offsets[l + 1]] for l in lists])
+            if len(candidates) == 0:
+                continue
+            candidates.sort()
+            scores = vectors[candidates] @ queries[i]
+            top = np.argsort(-scores)[:k] if len(scores) <= k else np.argpartition(-scores, k)[:k]
+            top = top[np.argsort(-scores[top])]
+            result_ids[i, :len(top)] = ids[candidates[top]]
+            result_scores[i, :len(top)] = scores[top]
+        return result_ids, result_scores
+
+
+def build_index(parquet_path, index_dir, n_lists=None, batch_size=50_000, train_size=200_000, text_column="translated_content", seed=0):
+    # Two passes over the translated parquet: idf, then embed + add in batches
+    idf = fit_idf(parquet_path, batch_size, text_column)
+    n_rows = pq.ParquetFile(parquet_path).metadata.num_rows
+    if n_lists is None:
+        n_lists = int(max(1, min(4096, np.sqrt(n_rows))))
+    # Train the coarse quantiser on the first batches
+    train = []
+    n_train = 0
+    for _, texts in iter_text_batches(parquet_path, batch_size, text_column):
+        train.append(embed_texts(texts, idf, seed=seed))
+        n_train += len(texts)
+        if n_train >= train_size:
+            break
+    train = np.concatenate(train)
+    centroids = _spherical_kmeans(train, min(n_lists, len(train)), seed=seed)
+    index = IVFIndex(index_dir, idf, centroids, seed=seed)
+    index.save()
+    for ids, texts in iter_text_batches(parquet_path, batch_size, text_column):
+        index.add(index.embed(texts), ids)
+    return index
+
+
+def add_new_posts(parquet_path, index, batch_size=50_000, text_column="translated_content"):
+    # Only embed posts whose id is not in the index yet
+    known = pd.Index(np.asarray(index.ids))
+    added = 0
+    for ids, texts in iter_text_batches(parquet_path, batch_size, text_column):
+        new = ~pd.Index(ids).isin(known)
+        if new.any():
+            index.add(index.embed([text for text, keep in zip(texts, new) if keep]), ids[new])
+            added += int(new.sum())
+    return added
+
+
+def similar_posts(index, query, k=10, n_probe=8):
+    # `query` is either a post id already in the index or free text
+    if isinstance(query, str):
+        vector = index.embed([query])
+    else:
+        vector = np.asarray(index.vectors[index.position_of(query)])[None, :]
+    ids, scores = index.search(vector, k=k + (0 if isinstance(query, str) else 1), n_probe=n_probe)
+    matches = pd.DataFrame({"id": ids[0], "similarity": scores[0]})
+    matches = matches[matches["id"] >= 0]
+    if not isinstance(query, str):
+        matches = matches[matches["id"] != query]
+    return matches.head(k).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    if os.path.isdir("post_index"):
+        index = IVFIndex.load("post_index")
+        print(f"Added {add_new_posts('translated_posts.parquet', index)} new posts")
+    else:
+        index = build_index("translated_posts.parquet", "post_index")
+    print(f"Number of posts in index: {len(index)}")
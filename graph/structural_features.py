@@ -0,0 +1,195 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import span
+from sharded import SharedArrays, attach
+from suspect_paths import _expand
+
+# Per-node structural features over the sparse adjacency, for anomaly detection next to traffic_likelihood:
+#   degree, degree_<label>   incident edges, overall and per edge label (friend_with, follower, ...)
+#   triangles, clustering    triangles through the node, and triangles / possible neighbour pairs
+#   core_number              largest k such that the node is in the k-core
+#   ego_edges, ego_density   edges inside the node's ego network (node + neighbours) and their density
+# Triangles: nodes are ranked by degree and every edge points from lower to higher rank, so each node keeps at
+# most sqrt(2m) out-neighbours. Each triangle a < b < c is then found exactly once as a wedge b <- a -> c closed
+# by the edge b -> c (one searchsorted over the sorted edge keys). Rank ranges with about wedges_per_task wedges
+# are counted in a process pool over the forward CSR in shared memory.
+# k-core: batch peeling, every node at or below the current k is removed at once and only its neighbours' degrees
+# are updated. ego_edges = degree + triangles, so the ego features come for free.
+#   python structural_features.py --out node_features.parquet
+
+_worker = {}
+
+
+def _init_worker(spec):
+    _worker["arrays"], _worker["blocks"] = attach(spec)
+
+
+def simple_csr(arrays):
+    # Symmetric CSR without self-loops or duplicate edges (what clustering, triangles and cores are defined on)
+    # edges as row * n + col keys, so one int64 sort orders them by row then column
+    n = arrays.n_nodes
+    keep = arrays.src != arrays.dst
+    low = np.minimum(arrays.src[keep], arrays.dst[keep])
+    high = np.maximum(arrays.src[keep], arrays.dst[keep])
+    pairs = np.sort(low * n + high)
+    pairs = pairs[np.r_[True, pairs[1:] != pairs[:-1]]]
+    low, high = pairs // n, pairs % n
+    keys = np.sort(np.concatenate([pairs, high * n + low]))
+    indptr = np.r_[0, np.cumsum(np.bincount(keys // n, minlength=n))].astype(np.int64)
+    return indptr, keys % n
+
+
+def degree_by_type(arrays, attribute="label"):
+    # Incident edges per node, overall and per value of the edge attribute (self-loops count twice, as in networkx)
+    columns = {"degree": np.bincount(arrays.src, minlength=arrays.n_nodes) + np.bincount(arrays.dst, minlength=arrays.n_nodes)}
+    if attribute in arrays.edge_attrs:
+        codes, labels = pd.factorize(pd.Series(arrays.edge_attrs[attribute], dtype=object), sort=True)
+        for code, label in enumerate(labels):
+            edges = codes == code
+            columns[f"degree_{label}"] = (np.bincount(arrays.src[edges], minlength=arrays.n_nodes)
+                                          + np.bincount(arrays.dst[edges], minlength=arrays.n_nodes))
+    return columns
+
+
+def _forward_csr(indptr, indices):
+    # Relabel nodes by (degree, position) rank and keep the edges pointing to a higher rank, rows sorted
+    n = len(indptr) - 1
+    degree = np.diff(indptr)
+    order = np.lexsort((np.arange(n), degree))
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n)
+    rows = rank[np.repeat(np.arange(n), degree)]
+    cols = rank[indices]
+    forward = rows < cols
+    rows, cols = rows[forward], cols[forward]
+    keys = np.sort(rows * n + cols)
+    forward_indptr = np.r_[0, np.cumsum(np.bincount(rows, minlength=n))].astype(np.int64)
+    return order, forward_indptr, keys % n, keys
+
+
+def _count_triangles(start, stop):
+    # Worker task: triangles whose lowest-ranked node is in [start, stop), as (rank, count) pairs
+    indptr, indices, keys = _worker["arrays"]["indptr"], _worker["arrays"]["indices"], _worker["arrays"]["keys"]
+    n = len(indptr) - 1
+    lengths = np.diff(indptr[start:stop + 1])
+    first_entry = indptr[start]
+    entries = np.arange(first_entry, indptr[stop])
+    owners = np.repeat(np.arange(start, stop), lengths)
+    # every entry pairs with the entries after it in the same row: wedge (a; b, c) with b < c
+    after = indptr[owners + 1] - entries - 1
+    total = after.sum()
+    if not total:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    first = np.repeat(entries, after)
+    second = first + 1 + np.arange(total) - np.repeat(np.cumsum(after) - after, after)
+    b, c = indices[first], indices[second]
+    wanted = b * n + c
+    found = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+    closed = keys[found] == wanted
+    corners = np.concatenate([np.repeat(owners, after)[closed], b[closed], c[closed]])
+    return np.unique(corners, return_counts=True)
+
+
+def _tasks(indptr, wedges_per_task):
+    # Contiguous rank ranges with roughly wedges_per_task wedges each
+    out_degree = np.diff(indptr)
+    cumulative = np.cumsum(out_degree * (out_degree - 1) // 2)
+    n_tasks = max(1, int(np.ceil(cumulative[-1] / wedges_per_task))) if len(cumulative) else 1
+    bounds = np.unique(np.r_[0, np.searchsorted(cumulative, np.arange(1, n_tasks) * wedges_per_task), len(out_degree)])
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def triangle_counts(indptr, indices, jobs=None, wedges_per_task=2_000_000):
+    # Triangles through every node of a simple symmetric CSR
+    n = len(indptr) - 1
+    jobs = jobs or os.cpu_count()
+    order, forward_indptr, forward_indices, keys = _forward_csr(indptr, indices)
+    tasks = _tasks(forward_indptr, wedges_per_task)
+    counts = np.zeros(n, dtype=np.int64)
+    with span("triangle_counts", nodes=n, tasks=len(tasks), jobs=jobs) as counters:
+        with SharedArrays({"indptr": forward_indptr, "indices": forward_indices, "keys": keys}) as shared:
+            if jobs <= 1 or len(tasks) < 2:
+                _init_worker(shared.spec)
+                results = [_count_triangles(start, stop) for start, stop in tasks]
+                _worker.clear()
+            else:
+                with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(shared.spec,)) as pool:
+                    results = list(pool.map(_count_triangles, *zip(*tasks)))
+            for ranks, found in results:
+                counts[ranks] += found
+        counters["triangles"] = int(counts.sum() // 3)
+    # back from rank to node position
+    triangles = np.empty(n, dtype=np.int64)
+    triangles[order] = counts
+    return triangles
+
+
+def core_numbers(indptr, indices):
+    # k-core number of every node of a simple symmetric CSR, by batch peeling
+    n = len(indptr) - 1
+    degree = np.diff(indptr).astype(np.int64)
+    core = np.zeros(n, dtype=np.int64)
+    alive = np.ones(n, dtype=bool)
+    remaining = n
+    k = 0
+    with span("core_numbers", nodes=n) as counters:
+        rounds = 0
+        while remaining:
+            k = max(k, int(degree[alive].min()))
+            frontier = np.flatnonzero(alive & (degree <= k))
+            while len(frontier):
+                rounds += 1
+                core[frontier] = k
+                alive[frontier] = False
+                remaining -= len(frontier)
+                _, neighbours = _expand(indptr, indices, frontier)
+                neighbours = neighbours[alive[neighbours]]
+                touched, removed = np.unique(neighbours, return_counts=True)
+                degree[touched] -= removed
+                frontier = touched[degree[touched] <= k]
+        counters["max_core"] = k
+        counters["rounds"] = rounds
+    return core
+
+
+def structural_features(arrays, jobs=None, wedges_per_task=2_000_000):
+    # One row per node, indexed by node id (see the module comment for the columns)
+    with span("structural_features", nodes=arrays.n_nodes, edges=arrays.n_edges):
+        columns = degree_by_type(arrays)
+        indptr, indices = simple_csr(arrays)
+        neighbours = np.diff(indptr)
+        triangles = triangle_counts(indptr, indices, jobs, wedges_per_task)
+        pairs = neighbours * (neighbours - 1) / 2
+        ego_edges = neighbours + triangles
+        columns.update({
+            "triangles": triangles,
+            "clustering": np.divide(triangles, pairs, out=np.zeros(arrays.n_nodes), where=pairs > 0),
+            "core_number": core_numbers(indptr, indices),
+            "ego_edges": ego_edges,
+            "ego_density": np.divide(ego_edges, pairs + neighbours, out=np.zeros(arrays.n_nodes), where=neighbours > 0),
+        })
+    return pd.DataFrame(columns, index=pd.Index(arrays.node_ids, name="id"))
+
+
+if __name__ == "__main__":
+    from create_graph import CONNECTION_EDGE_TYPES, DB_PATH
+    from db_access import connections, profiles
+    from graph_arrays import GraphArrays
+
+    parser = argparse.ArgumentParser(description="Degree, clustering, triangle, k-core and ego-net features for every node")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--out", default="node_features.parquet")
+    parser.add_argument("--jobs", type=int, default=None)
+    args = parser.parse_args()
+
+    arrays = GraphArrays.from_connections(profiles(args.db, profile_type="person"),
+                                          connections(args.db, connection_types=list(CONNECTION_EDGE_TYPES)))
+    features = structural_features(arrays, jobs=args.jobs)
+    features.to_parquet(args.out)
+    print(f"{len(features)} nodes -> {args.out}")
+    print(features.describe().T.to_string())
@@ -0,0 +1,122 @@
+import json
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pydantic import ValidationError
+
+from instrumentation import count, span
+from llm_schema import Response, SuspiciousActions, TrafficLikelihood
+
+# Decode Gemini responses one at a time as they arrive, straight into typed Arrow columns.
+# A bad response goes to a dead-letter JSONL file instead of failing the whole batch.
+
+ACTIONS = [action.value for action in SuspiciousActions]
+ACTION_CODES = {action: code for code, action in enumerate(SuspiciousActions)}
+
+RESPONSE_FIELDS = [
+    pa.field("translated_content", pa.string()),
+    pa.field("language", pa.string()),
+    pa.field("traffic_likelihood", pa.int8()),
+    pa.field("species_being_mentioned", pa.list_(pa.string())),
+    pa.field("location", pa.list_(pa.string())),
+    pa.field("pii", pa.list_(pa.string())),
+    # enum codes, the position in SuspiciousActions; the labels are kept in the field metadata
+    pa.field("actions", pa.list_(pa.int8()), metadata={"enum": json.dumps(ACTIONS)}),
+]
+
+
+def output_schema(passthrough_schema):
+    # Activity columns (minus the raw content) followed by the typed response columns
+    return pa.schema(list(passthrough_schema) + RESPONSE_FIELDS)
+
+
+def decode_actions(codes):
+    return [ACTIONS[code] for code in codes]
+
+
+def translate_rows(rows, translate_fn, text_column="content"):
+    # Call the LLM per row; a failed call is passed on as the exception so it ends up in the dead letters
+    n_calls = 0
+    for row in rows:
+        try:
+            with span("llm_call", characters=len(row[text_column] or "")):
+                raw_text = translate_fn(row[text_column])
+        except Exception as error:
+            raw_text = error
+        n_calls += 1
+        count("llm_calls", n_calls)
+        yield row, raw_text
+
+
+class StructuredOutputDecoder:
+    def __init__(self, passthrough_schema, dead_letter_path, batch_size=1000):
+        self.passthrough_schema = passthrough_schema
+        self.schema = output_schema(passthrough_schema)
+        self.dead_letter_path = dead_letter_path
+        self.batch_size = batch_size
+        self.n_decoded = 0
+        self.n_dead_letters = 0
+        self._columns = {field.name: [] for field in self.schema}
+
+    def _dead_letter(self, row, raw_text, error):
+        self.n_dead_letters += 1
+        with open(self.dead_letter_path, "a") as f:
+            f.write(json.dumps({
+                "row": {name: row.get(name) for name in self.passthrough_schema.names},
+                "raw": raw_text if isinstance(raw_text, str) else None,
+                "error": f"{type(error).__name__}: {error}",
+            }, default=str) + "\n")
+
+    def add(self, row, raw_text):
+        # Returns a RecordBatch whenever batch_size rows have been decoded, otherwise None
+        if isinstance(raw_text, Exception):
+            self._dead_letter(row, None, raw_text)
+            return None
+        try:
+            response = Response.model_validate_json(raw_text)
+            TrafficLikelihood(response.traffic_likelihood)
+        except (ValidationError, ValueError) as error:
+            self._dead_letter(row, raw_text, error)
+            return None
+        for name in self.passthrough_schema.names:
+            self._columns[name].append(row.get(name))
+        self._columns["translated_content"].append(response.translated_content)
+        self._columns["language"].append(response.language)
+        self._columns["traffic_likelihood"].append(response.traffic_likelihood)
+        self._columns["species_being_mentioned"].append(response.species_being_mentioned)
+        self._columns["location"].append(response.location)
+        self._columns["pii"].append(response.pii)
+        self._columns["actions"].append([ACTION_CODES[action] for action in response.actions])
+        self.n_decoded += 1
+        if len(self._columns["translated_content"]) >= self.batch_size:
+            return self.flush()
+        return None
+
+    def flush(self):
+        if not self._columns["translated_content"]:
+            return None
+        batch = pa.RecordBatch.from_pydict(self._columns, schema=self.schema)
+        self._columns = {field.name: [] for field in self.schema}
+        return batch
+
+
+def decode_responses(rows, passthrough_schema, dead_letter_path, batch_size=1000):
+    # rows yields (row dict, raw response text or exception), e.g. from translate_rows
+    decoder = StructuredOutputDecoder(passthrough_schema, dead_letter_path, batch_size)
+    for row, raw_text in rows:
+        batch = decoder.add(row, raw_text)
+        if batch is not None:
+            yield batch
+    batch = decoder.flush()
+    if batch is not None:
+        yield batch
+
+
+def write_responses(rows, passthrough_schema, path, dead_letter_path, batch_size=1000):
+    # Stream decoded batches into a parquet file, returns the number of rows written
+    n_rows = 0
+    with pq.ParquetWriter(path, output_schema(passthrough_schema)) as writer:
+        for batch in decode_responses(rows, passthrough_schema, dead_letter_path, batch_size):
+            writer.write_batch(batch)
+            n_rows += batch.num_rows
+    return n_rows
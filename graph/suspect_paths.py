@@ -0,0 +1,132 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from graph_arrays import GraphArrays
+from instrumentation import span
+
+# How flagged profiles connect: shortest paths between every pair of suspects, found with one
+# level-synchronous BFS per suspect over the CSR adjacency (a whole frontier is expanded with numpy at once).
+# Each BFS stops at max_hops or as soon as every later suspect has been reached; sources are spread over
+# worker processes. The result feeds connection_subgraph() -> plot_subgraph_in_plotly.
+
+_worker = {}
+
+
+def _init_worker(indptr, indices):
+    _worker["indptr"] = indptr
+    _worker["indices"] = indices
+    # BFS predecessor per position: -2 unvisited, -1 the source; reset after every search
+    _worker["parent"] = np.full(len(indptr) - 1, -2, dtype=np.int64)
+
+
+def _expand(indptr, indices, frontier):
+    # All (node, neighbour) pairs leaving the frontier, without a Python loop over nodes
+    starts = indptr[frontier]
+    lengths = indptr[frontier + 1] - starts
+    owners = np.repeat(frontier, lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return owners, indices[np.repeat(starts, lengths) + offsets]
+
+
+def _bfs_paths(indptr, indices, parent, source, targets, max_hops):
+    # Paths (lists of positions) from source to each reachable target within max_hops
+    parent[source] = -1
+    visited = [np.array([source])]
+    n_remaining = len(targets) - int(source in targets)
+    frontier = visited[0]
+    hops = 0
+    while n_remaining > 0 and len(frontier) and hops < max_hops:
+        owners, neighbours = _expand(indptr, indices, frontier)
+        unseen = parent[neighbours] == -2
+        neighbours, first = np.unique(neighbours[unseen], return_index=True)
+        parent[neighbours] = owners[unseen][first]
+        n_remaining -= np.isin(neighbours, targets, assume_unique=True).sum()
+        visited.append(neighbours)
+        frontier = neighbours
+        hops += 1
+    paths = []
+    for target in targets.tolist():
+        if target == source or parent[target] == -2:
+            continue
+        path = [target]
+        while parent[path[-1]] != -1:
+            path.append(int(parent[path[-1]]))
+        paths.append(path[::-1])
+    parent[np.concatenate(visited)] = -2
+    return paths
+
+
+def _paths_from_sources(sources, suspects, max_hops):
+    # Worker task: each source only searches for suspects after it, so every pair is computed once
+    indptr, indices, parent = _worker["indptr"], _worker["indices"], _worker["parent"]
+    order = {node: rank for rank, node in enumerate(suspects.tolist())}
+    results = []
+    for source in sources:
+        later = suspects[order[source] + 1:]
+        results.extend((source, path) for path in _bfs_paths(indptr, indices, parent, source, later, max_hops))
+    return results
+
+
+def suspect_paths(arrays, suspects, max_hops=4, jobs=None):
+    # One shortest path per pair of suspects connected within max_hops:
+    # DataFrame with source, target (node ids), hops and path (list of node ids)
+    positions = arrays.positions(suspects)
+    positions = np.unique(positions[positions >= 0])
+    adjacency = arrays.adjacency()
+    indptr, indices = adjacency.indptr.astype(np.int64), adjacency.indices.astype(np.int64)
+    jobs = jobs or os.cpu_count()
+    with span("suspect_paths", suspects=len(positions), max_hops=max_hops, jobs=jobs) as counters:
+        sources = positions[:-1].tolist()
+        if jobs <= 1 or len(sources) < 2 * jobs:
+            _init_worker(indptr, indices)
+            found = _paths_from_sources(sources, positions, max_hops)
+        else:
+            # Interleave sources so early (longer) searches do not pile up in one chunk
+            chunks = [sources[offset::jobs * 4] for offset in range(jobs * 4)]
+            found = []
+            with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(indptr, indices)) as pool:
+                for results in pool.map(_paths_from_sources, chunks, [positions] * len(chunks), [max_hops] * len(chunks)):
+                    found.extend(results)
+        counters["pairs"] = len(found)
+    ids = arrays.node_ids
+    return pd.DataFrame({
+        "source": [ids[path[0]] for _, path in found],
+        "target": [ids[path[-1]] for _, path in found],
+        "hops": [len(path) - 1 for _, path in found],
+        "path": [ids[path].tolist() for _, path in found],
+    })
+
+
+def shared_intermediaries(paths, suspects=()):
+    # Non-suspect profiles that sit on the most suspect-to-suspect paths
+    intermediaries = paths["path"].map(lambda path: path[1:-1]).explode().dropna()
+    intermediaries = intermediaries[~intermediaries.isin(set(suspects))]
+    return intermediaries.value_counts().rename("paths")
+
+
+def connection_subgraph(arrays, paths, suspects=()):
+    # Only the edges that lie on the paths, with their attributes, as a networkx graph for plot_subgraph_in_plotly.
+    # Suspects get suspect=True, intermediaries the number of paths through them.
+    steps = [(u, v) for path in paths["path"] for u, v in zip(path[:-1], path[1:])]
+    if not steps:
+        return GraphArrays(np.empty(0, dtype=arrays.node_ids.dtype), [], []).to_networkx()
+    steps = np.array(steps)
+    src, dst = arrays.positions(steps[:, 0]), arrays.positions(steps[:, 1])
+    low, high = np.minimum(src, dst), np.maximum(src, dst)
+    wanted = pd.Index(np.unique(low * arrays.n_nodes + high))
+    edge_keys = np.minimum(arrays.src, arrays.dst) * arrays.n_nodes + np.maximum(arrays.src, arrays.dst)
+    keep = np.flatnonzero(pd.Index(edge_keys).isin(wanted))
+    nodes = np.unique(np.concatenate([arrays.src[keep], arrays.dst[keep]]))
+    remap = np.full(arrays.n_nodes, -1, dtype=np.int64)
+    remap[nodes] = np.arange(len(nodes))
+    node_ids = arrays.node_ids[nodes]
+    on_paths = shared_intermediaries(paths, suspects)
+    node_attrs = {name: values[nodes] for name, values in arrays.node_attrs.items()}
+    node_attrs["suspect"] = pd.Index(node_ids).isin(list(suspects))
+    node_attrs["paths_through"] = pd.Series(node_ids).map(on_paths).fillna(0).to_numpy(dtype=np.int64)
+    sub = GraphArrays(node_ids, remap[arrays.src[keep]], remap[arrays.dst[keep]], node_attrs,
+                      {name: values[keep] for name, values in arrays.edge_attrs.items()})
+    return sub.to_networkx()
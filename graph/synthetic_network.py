@@ -0,0 +1,178 @@
+import argparse
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from create_graph import CONNECTION_EDGE_TYPES
+from structured_output import ACTIONS, output_schema
+
+# Seeded generator for a fake social_network_anonymized.db (same tables and columns as the real one)
+# plus a matching translated_posts.parquet, so every stage can be benchmarked without the real data.
+
+ENTRY_TYPES = ["commented-on-facebook", "shared-a-post-on-facebook", "posted-to-story-on-facebook"]
+OTHER_ACTIVITY_TYPES = ["liked-a-post-on-facebook", "updated-profile-picture-on-facebook"]
+REGIONS = ["amazonas", "andes", "caribe", "orinoquia", "pacifico", "lagos", "sahel", "mekong", "borneo", "sumatra"]
+LANGUAGES = ["spanish", "portuguese", "english", "indonesian", "french", "vietnamese"]
+SPECIES = ["tiger", "pangolin", "rhino", "parrot", "macaw", "turtle", "shark", "elephant", "jaguar", "monkey"]
+BENIGN_WORDS = (
+    "happy birthday friend party tonight football match family photo beautiful day weekend music "
+    "church school work coffee beach holiday food recipe congratulations love thanks morning"
+).split()
+TRAFFIC_WORDS = "selling ivory scales horn price whatsapp available stock delivery cash live skin cheap".split()
+
+START_MS = int(pd.Timestamp("2023-01-01").timestamp() * 1000)
+SPAN_MS = 730 * 24 * 3600 * 1000
+CHUNK_SIZE = 1_000_000
+
+SCHEMA = """
+CREATE TABLE Profiles (id INTEGER PRIMARY KEY, name TEXT, profile_url TEXT, region TEXT, profile_type TEXT);
+CREATE TABLE ProfileConnection (id INTEGER PRIMARY KEY, source_id INTEGER, target_id INTEGER, connection_type TEXT, timestamp INTEGER);
+CREATE TABLE Activity (id INTEGER PRIMARY KEY, type TEXT, content TEXT, timestamp INTEGER);
+CREATE TABLE ProfileActivity (id INTEGER PRIMARY KEY, profile_id INTEGER, activity_id INTEGER);
+"""
+
+
+def _insert(conn, table, frame):
+    columns = ", ".join(frame.columns)
+    placeholders = ", ".join("?" for _ in frame.columns)
+    conn.executemany(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", frame.itertuples(index=False, name=None))
+
+
+def _texts(rng, n, suspicious):
+    # Eight random words per post, trafficking vocabulary mixed in for suspicious authors
+    benign = np.array(BENIGN_WORDS, dtype=object)[rng.integers(0, len(BENIGN_WORDS), size=(n, 8))]
+    traffic = np.array(TRAFFIC_WORDS + SPECIES, dtype=object)[rng.integers(0, len(TRAFFIC_WORDS) + len(SPECIES), size=(n, 8))]
+    mix = suspicious[:, None] & (rng.random((n, 8)) < 0.6)
+    words = np.where(mix, traffic, benign)
+    return [" ".join(row) for row in words.tolist()]
+
+
+def generate_profiles(rng, n_profiles, suspicious_fraction=0.02):
+    ids = np.arange(1, n_profiles + 1)
+    region = np.array(REGIONS, dtype=object)[rng.integers(0, len(REGIONS), n_profiles)]
+    profile_type = np.where(rng.random(n_profiles) < 0.9, "person", np.where(rng.random(n_profiles) < 0.5, "group", "page"))
+    # Suspicious profiles are concentrated in a few regions, like the real data
+    hot_region = np.isin(region, REGIONS[:3])
+    suspicious = rng.random(n_profiles) < np.where(hot_region, suspicious_fraction * 3, suspicious_fraction / 3)
+    profiles = pd.DataFrame({
+        "id": ids,
+        "name": [f"profile_{i}" for i in ids],
+        "profile_url": [f"https://facebook.com/profile_{i}" for i in ids],
+        "region": region,
+        "profile_type": profile_type,
+    })
+    return profiles, suspicious
+
+
+def generate_connections(rng, profiles, n_edges, same_region_probability=0.8):
+    # Heavy-tailed degree via Zipf-like source weights, targets mostly from the same region
+    n_profiles = len(profiles)
+    weights = rng.permutation(1.0 / np.arange(1, n_profiles + 1) ** 0.8)
+    weights /= weights.sum()
+    region_codes, region_names = pd.factorize(profiles["region"])
+    order = np.argsort(region_codes, kind="stable")
+    region_start = np.searchsorted(region_codes[order], np.arange(len(region_names)))
+    region_size = np.bincount(region_codes, minlength=len(region_names))
+    connection_types = np.array(list(CONNECTION_EDGE_TYPES), dtype=object)
+    ids = profiles["id"].to_numpy()
+    next_id = 1
+    for start in range(0, n_edges, CHUNK_SIZE):
+        size = min(CHUNK_SIZE, n_edges - start)
+        source = rng.choice(n_profiles, size=size, p=weights)
+        source_region = region_codes[source]
+        local_target = order[region_start[source_region] + (rng.random(size) * region_size[source_region]).astype(np.int64)]
+        global_target = rng.choice(n_profiles, size=size, p=weights)
+        target = np.where(rng.random(size) < same_region_probability, local_target, global_target)
+        keep = source != target
+        chunk = pd.DataFrame({
+            "id": np.arange(next_id, next_id + keep.sum()),
+            "source_id": ids[source[keep]],
+            "target_id": ids[target[keep]],
+            "connection_type": connection_types[rng.integers(0, len(connection_types), keep.sum())],
+            "timestamp": START_MS + rng.integers(0, SPAN_MS, keep.sum()),
+        })
+        next_id += len(chunk)
+        yield chunk
+
+
+def generate_activities(rng, profiles, suspicious, n_activities):
+    activity_types = np.array(ENTRY_TYPES + OTHER_ACTIVITY_TYPES, dtype=object)
+    next_id = 1
+    for start in range(0, n_activities, CHUNK_SIZE):
+        size = min(CHUNK_SIZE, n_activities - start)
+        author = rng.integers(0, len(profiles), size)
+        activity_type = activity_types[rng.choice(len(activity_types), size=size, p=[0.3, 0.25, 0.15, 0.2, 0.1])]
+        has_text = np.isin(activity_type, ENTRY_TYPES) & (rng.random(size) < 0.9)
+        content = np.where(has_text, np.array(_texts(rng, size, suspicious[author]), dtype=object), "")
+        activity_ids = np.arange(next_id, next_id + size)
+        next_id += size
+        activities = pd.DataFrame({
+            "id": activity_ids,
+            "type": activity_type,
+            "content": content,
+            "timestamp": START_MS + rng.integers(0, SPAN_MS, size),
+        })
+        profile_activity = pd.DataFrame({"id": activity_ids, "profile_id": profiles["id"].to_numpy()[author], "activity_id": activity_ids})
+        yield activities, profile_activity, suspicious[author]
+
+
+def fake_enrichment(rng, activities, suspicious_author):
+    # Response columns shaped like the Gemini structured output, more likely to be high for suspicious authors
+    n = len(activities)
+    traffic_likelihood = np.where(suspicious_author, rng.integers(3, 6, n), np.where(rng.random(n) < 0.9, 1, 2))
+    n_species = np.where(suspicious_author, rng.integers(1, 3, n), (rng.random(n) < 0.05).astype(int))
+    species = np.array(SPECIES, dtype=object)
+    n_actions = np.where(suspicious_author, rng.integers(1, 3, n), 0)
+    return pa.table({
+        "id": pa.array(activities["id"].to_numpy(), pa.int64()),
+        "type": pa.array(activities["type"].to_numpy(), pa.string()),
+        "timestamp": pa.array(activities["timestamp"].to_numpy(), pa.int64()),
+        "translated_content": pa.array(activities["content"].to_numpy(), pa.string()),
+        "language": pa.array(np.array(LANGUAGES, dtype=object)[rng.integers(0, len(LANGUAGES), n)], pa.string()),
+        "traffic_likelihood": pa.array(traffic_likelihood, pa.int8()),
+        "species_being_mentioned": pa.array([list(species[rng.integers(0, len(species), k)]) for k in n_species], pa.list_(pa.string())),
+        "location": pa.array([[region] if rng.random() < 0.3 else [] for region in np.array(REGIONS, dtype=object)[rng.integers(0, len(REGIONS), n)]], pa.list_(pa.string())),
+        "pii": pa.array([[] for _ in range(n)], pa.list_(pa.string())),
+        "actions": pa.array([list(rng.integers(0, len(ACTIONS), k)) for k in n_actions], pa.list_(pa.int8())),
+    })
+
+
+def generate_social_network(db_path, posts_path, n_edges, n_profiles=None, n_activities=None, seed=0):
+    # Defaults keep the real data's proportions roughly: ~10 edges and ~2 activities per profile
+    rng = np.random.default_rng(seed)
+    n_profiles = n_profiles or max(100, n_edges // 10)
+    n_activities = n_activities or 2 * n_profiles
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    profiles, suspicious = generate_profiles(rng, n_profiles)
+    _insert(conn, "Profiles", profiles)
+    for chunk in generate_connections(rng, profiles, n_edges):
+        _insert(conn, "ProfileConnection", chunk)
+    schema = output_schema(pa.schema([("id", pa.int64()), ("type", pa.string()), ("timestamp", pa.int64())]))
+    with pq.ParquetWriter(posts_path, schema) as writer:
+        for activities, profile_activity, suspicious_author in generate_activities(rng, profiles, suspicious, n_activities):
+            _insert(conn, "Activity", activities)
+            _insert(conn, "ProfileActivity", profile_activity)
+            enriched = activities["content"].to_numpy() != ""
+            writer.write_table(fake_enrichment(rng, activities[enriched], suspicious_author[enriched]).cast(schema))
+    conn.commit()
+    conn.close()
+    return {"profiles": n_profiles, "edges": n_edges, "activities": n_activities, "suspicious_profiles": int(suspicious.sum())}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic social network DB and translated_posts.parquet")
+    parser.add_argument("--edges", type=int, default=100_000)
+    parser.add_argument("--profiles", type=int, default=None)
+    parser.add_argument("--activities", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", default="synthetic_social_network.db")
+    parser.add_argument("--posts", default="synthetic_translated_posts.parquet")
+    args = parser.parse_args()
+    print(generate_social_network(args.db, args.posts, args.edges, args.profiles, args.activities, args.seed))
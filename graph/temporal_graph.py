@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+
+from create_graph import CONNECTION_EDGE_TYPES, DB_PATH
+from db_access import connections, profile_activity
+
+MS_PER_DAY = 1000 * 3600 * 24
+MS_PER_WEEK = 7 * MS_PER_DAY
+
+
+def build_temporal_edge_index(people_connections, time_column="timestamp"):
+    # One row per ProfileConnection edge, sorted once by time (ms epochs).
+    # Every snapshot / window query afterwards is a binary search on this frame.
+    connections = people_connections[people_connections["connection_type"].isin(CONNECTION_EDGE_TYPES.keys())]
+    edge_index = pd.DataFrame({
+        "timestamp": connections[time_column].to_numpy(dtype="int64"),
+        "source_id": connections["source_id"].to_numpy(),
+        "target_id": connections["target_id"].to_numpy(),
+        "edge_type": connections["connection_type"].map(CONNECTION_EDGE_TYPES).astype("category"),
+        "id": connections["id"].to_numpy(),
+    })
+    return edge_index.sort_values("timestamp", kind="stable").reset_index(drop=True)
+
+
+def build_post_index(posts, profile_activity):
+    # Same idea for the LLM output: (timestamp, profile_id, traffic_likelihood) sorted by time
+    combined_data = pd.merge(posts[["id", "timestamp", "traffic_likelihood"]], profile_activity[["profile_id", "activity_id"]], left_on="id", right_on="activity_id", how="inner")
+    post_index = pd.DataFrame({
+        "timestamp": combined_data["timestamp"].to_numpy(dtype="int64"),
+        "profile_id": combined_data["profile_id"].to_numpy(dtype="int64"),
+        "traffic_likelihood": combined_data["traffic_likelihood"].to_numpy(),
+    })
+    return post_index.sort_values("timestamp", kind="stable").reset_index(drop=True)
+
+
+def _window_slice(index, start=None, end=None):
+    # Half-open window [start, end) on a time-sorted index, None means unbounded
+    timestamps = index["timestamp"].to_numpy()
+    lo = 0 if start is None else np.searchsorted(timestamps, start, side="left")
+    hi = len(timestamps) if end is None else np.searchsorted(timestamps, end, side="left")
+    return index.iloc[lo:hi]
+
+
+def edges_in_window(edge_index, start=None, end=None):
+    return _window_slice(edge_index, start, end)
+
+
+def edges_as_of(edge_index, t):
+    # Everything that happened up to and including t
+    return _window_slice(edge_index, None, t + 1)
+
+
+def person_regions(people_profiles):
+    people_df = people_profiles[people_profiles.profile_type == "person"]
+    return pd.Series(people_df.region.to_numpy(), index=people_df.id.to_numpy())
+
+
+def materialise_graph(edges, node_regions=None):
+    # Build the same graph shape as create_person_graph_with_relationship from an edge slice.
+    # Edges are in time order so a repeated (u, v) pair keeps the attributes of its latest connection.
+    # networkx only here, the edge / post indexes and window queries do not need it
+    import networkx as nx
+
+    G = nx.Graph()
+    if node_regions is not None:
+        G.add_nodes_from((node, {"region": region}) for node, region in node_regions.items())
+    G.add_edges_from(
+        (u, v, {"label": label, "unique_id": id})
+        for u, v, label, id in zip(edges["source_id"].to_numpy(), edges["target_id"].to_numpy(), edges["edge_type"].to_numpy(), edges["id"].to_numpy())
+    )
+    return G
+
+
+def graph_as_of(edge_index, t, node_regions=None):
+    return materialise_graph(edges_as_of(edge_index, t), node_regions)
+
+
+def graph_in_window(edge_index, start, end, node_regions=None):
+    return materialise_graph(edges_in_window(edge_index, start, end), node_regions)
+
+
+def traffic_likelihood_in_window(post_index, start=None, end=None):
+    # Per-profile traffic_likelihood sum and post count for posts in [start, end)
+    posts = _window_slice(post_index, start, end)
+    return posts.groupby("profile_id")["traffic_likelihood"].agg(traffic_likelihood="sum", post_count="size")
+
+
+def traffic_likelihood_over_windows(post_index, window=4 * MS_PER_WEEK, step=MS_PER_WEEK, origin=None):
+    # Sliding-window aggregates for every profile in one pass.
+    # Posts are bucketed by `step`, then each window is the sum of its window // step trailing buckets.
+    if window % step != 0:
+        raise ValueError("window must be a multiple of step")
+    if len(post_index) == 0:
+        return pd.DataFrame(columns=["window_start", "profile_id", "traffic_likelihood", "post_count"])
+    if origin is None:
+        origin = int(post_index["timestamp"].iloc[0])
+    buckets = pd.DataFrame({
+        "bucket": (post_index["timestamp"].to_numpy() - origin) // step,
+        "profile_id": post_index["profile_id"].to_numpy(),
+        "traffic_likelihood": post_index["traffic_likelihood"].to_numpy(),
+    })
+    per_bucket = buckets.groupby(["bucket", "profile_id"])["traffic_likelihood"].agg(traffic_likelihood="sum", post_count="size").reset_index()
+    # A bucket contributes to the windows ending in it and the next (window // step - 1) buckets
+    shifted = [per_bucket.assign(bucket=per_bucket["bucket"] + k) for k in range(window // step)]
+    last_bucket = per_bucket["bucket"].max()
+    windows = pd.concat(shifted, ignore_index=True)
+    windows = windows[windows["bucket"] <= last_bucket]
+    windows = windows.groupby(["bucket", "profile_id"], sort=True)[["traffic_likelihood", "post_count"]].sum().reset_index()
+    # Label each window by its start time
+    windows["window_start"] = origin + (windows["bucket"] + 1) * step - window
+    return windows[["window_start", "profile_id", "traffic_likelihood", "post_count"]]
+
+
+def suspicious_clusters_in_window(edge_index, post_index, start, end, min_traffic_likelihood=100):
+    # Connected groups of profiles whose traffic_likelihood within the window passes the threshold,
+    # linked through edges that exist in the same window
+    scores = traffic_likelihood_in_window(post_index, start, end)
+    suspicious = set(scores.index[scores["traffic_likelihood"] >= min_traffic_likelihood])
+    import networkx as nx
+
+    graph = graph_in_window(edge_index, start, end)
+    graph.add_nodes_from(suspicious)
+    clusters = [component for component in nx.connected_components(graph.subgraph(suspicious))]
+    return sorted(clusters, key=len, reverse=True)
+
+
+if __name__ == "__main__":
+    people_connections = connections(DB_PATH, connection_types=list(CONNECTION_EDGE_TYPES))
+    edge_index = build_temporal_edge_index(people_connections)
+    extra_data = pd.read_parquet("translated_posts.parquet", columns=["id", "timestamp", "traffic_likelihood"])
+    profile_actvitity_link = profile_activity(DB_PATH)
+    post_index = build_post_index(extra_data, profile_actvitity_link)
+    # Four-week windows moving one week at a time
+    weekly = traffic_likelihood_over_windows(post_index, window=4 * MS_PER_WEEK, step=MS_PER_WEEK)
+    for window_start, window in weekly.groupby("window_start"):
+        end = window_start + 4 * MS_PER_WEEK
+        clusters = suspicious_clusters_in_window(edge_index, post_index, window_start, end)
+        print(f"{pd.to_datetime(window_start, unit='ms').date()}: {len(window)} active profiles, {len(clusters)} suspicious clusters, largest {len(clusters[0]) if clusters else 0}")
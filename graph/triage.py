@@ -0,0 +1,201 @@
+import argparse
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from create_graph import extract_data_with_query
+from similarity_search import document_frequencies, embed_texts
+
+# Cheap local triage in front of translate_with_gemini: language id, lexicon hits and a
+# logistic regression on hashed TF-IDF features, trained on the traffic_likelihood labels we already paid for.
+
+SCRIPT_PATTERNS = {
+    "ru": r"[Ѐ-ӿ]",
+    "ar": r"[؀-ۿ]",
+    "zh": r"[一-鿿]",
+    "ja": r"[぀-ヿ]",
+    "ko": r"[가-힯]",
+    "th": r"[฀-๿]",
+    "hi": r"[ऀ-ॿ]",
+    # letters only Vietnamese uses (â, ê, ô alone are common in Portuguese and French)
+    "vi": r"(?i)[ăđơưạảấầẩẫậắằẳẵặẹẻẽếềểễệỉịọỏốồổỗộớờởỡợụủứừửữựỳỵỷỹ]",
+}
+# Latin-script patterns, which only decide when no stopword language was found
+LATIN_SCRIPTS = ["vi"]
+
+STOPWORDS = {
+    "en": ["the", "and", "is", "are", "for", "with", "this", "that", "you", "have", "not", "of"],
+    "es": ["el", "la", "los", "las", "que", "de", "y", "es", "por", "para", "con", "una", "del"],
+    "pt": ["o", "os", "as", "que", "de", "e", "não", "para", "com", "uma", "do", "da", "você"],
+    "fr": ["le", "la", "les", "et", "est", "pour", "avec", "une", "des", "que", "pas", "du"],
+    "id": ["yang", "dan", "di", "ini", "itu", "dengan", "untuk", "tidak", "ada", "saya", "dari"],
+    "de": ["der", "die", "das", "und", "ist", "nicht", "mit", "für", "ein", "eine", "ich"],
+}
+
+LANGUAGES = list(STOPWORDS) + list(SCRIPT_PATTERNS) + ["unknown"]
+
+# Multilingual keyword lexicons, matched on whole words, case-insensitive
+SPECIES_LEXICON = [
+    "ivory", "marfil", "ivoire", "marfim", "gading", "rhino", "rhinoceros", "rinoceronte", "horn", "cuerno", "chifre",
+    "pangolin", "pangolín", "trenggiling", "scales", "escamas", "tiger", "tigre", "harimau", "elephant", "elefante",
+    "turtle", "tortuga", "tartaruga", "penyu", "parrot", "loro", "papagaio", "macaw", "guacamaya", "arara", "shark",
+    "fin", "aleta", "tiburón", "tubarão", "leopard", "leopardo", "jaguar", "ocelot", "primate", "monkey", "mono",
+    "macaco", "orangutan", "gorilla", "lion", "león", "bear", "oso", "bile", "bushmeat", "tortoise", "gecko",
+    "python", "pitón", "cobra", "eagle", "águila", "hornbill", "totoaba", "abalone", "sea cucumber",
+]
+TRADE_LEXICON = [
+    "sale", "selling", "sell", "buy", "buying", "price", "venta", "vendo", "vende", "compro", "precio",
+    "venda", "preço", "jual", "harga", "beli", "vente", "prix", "achat", "whatsapp", "inbox", "dm",
+    "shipping", "envío", "envio", "delivery", "cod", "cash", "stock", "available", "disponible", "disponível",
+    "ready", "ready stock", "live", "vivo", "skin", "piel", "pele", "kulit", "trophy", "trofeo", "hunt", "caza",
+    "hunting", "cacería", "caça", "berburu", "poach", "cites",
+]
+
+
+def _lexicon_pattern(words):
+    return r"(?i)\b(?:" + "|".join(sorted(map(re.escape, set(words)), key=len, reverse=True)) + r")\b"
+
+
+SPECIES_PATTERN = _lexicon_pattern(SPECIES_LEXICON)
+TRADE_PATTERN = _lexicon_pattern(TRADE_LEXICON)
+
+
+def identify_language(texts):
+    # Non-Latin script ranges first, then the most frequent stopword language, then Latin-script letters, else "unknown"
+    texts = pd.Series(texts, dtype=object).fillna("").reset_index(drop=True)
+    script_counts = pd.DataFrame({lang: texts.str.count(pattern) for lang, pattern in SCRIPT_PATTERNS.items()})
+    tokens = texts.str.lower().str.findall(r"\w+").explode().dropna()
+    stopword_language = {word: lang for lang, words in STOPWORDS.items() for word in words}
+    token_languages = tokens.map(stopword_language).dropna()
+    stopword_counts = pd.crosstab(token_languages.index, token_languages).reindex(index=texts.index, columns=list(STOPWORDS), fill_value=0)
+    language = np.full(len(texts), "unknown", dtype=object)
+    has_stopwords = stopword_counts.to_numpy().max(axis=1) > 0
+    language[has_stopwords] = np.array(list(STOPWORDS))[stopword_counts.to_numpy().argmax(axis=1)][has_stopwords]
+    script_language = np.array(list(SCRIPT_PATTERNS))[script_counts.to_numpy().argmax(axis=1)]
+    has_script = (script_counts.to_numpy().max(axis=1) > 0) & ~(np.isin(script_language, LATIN_SCRIPTS) & has_stopwords)
+    language[has_script] = script_language[has_script]
+    return language
+
+
+def lexicon_hits(texts):
+    texts = pd.Series(texts, dtype=object).fillna("").reset_index(drop=True)
+    return pd.DataFrame({
+        "species_hits": texts.str.count(SPECIES_PATTERN).to_numpy(),
+        "trade_hits": texts.str.count(TRADE_PATTERN).to_numpy(),
+    })
+
+
+def triage_features(texts, idf):
+    hits = lexicon_hits(texts)
+    language = identify_language(texts)
+    language_one_hot = (language[:, None] == np.array(LANGUAGES, dtype=object)[None, :]).astype(np.float32)
+    return np.hstack([
+        embed_texts(list(pd.Series(texts, dtype=object).fillna("")), idf),
+        np.log1p(hits.to_numpy(dtype=np.float32)),
+        language_one_hot,
+    ])
+
+
+def _fit_logistic_regression(features, labels, l2=1.0):
+    # Class-balanced logistic regression, solved with L-BFGS (scipy only for training, scoring is numpy)
+    from scipy.optimize import minimize
+
+    n_positive = max(labels.sum(), 1)
+    n_negative = max(len(labels) - labels.sum(), 1)
+    sample_weight = np.where(labels == 1, len(labels) / (2 * n_positive), len(labels) / (2 * n_negative))
+
+    def loss_and_grad(params):
+        w, b = params[:-1], params[-1]
+        z = features @ w + b
+        p = 1 / (1 + np.exp(-z))
+        loss = np.sum(sample_weight * (np.logaddexp(0, z) - labels * z)) + 0.5 * l2 * w @ w
+        residual = sample_weight * (p - labels)
+        return loss, np.append(features.T @ residual + l2 * w, residual.sum())
+
+    result = minimize(loss_and_grad, np.zeros(features.shape[1] + 1), jac=True, method="L-BFGS-B")
+    return result.x[:-1].astype(np.float32), float(result.x[-1])
+
+
+def train_triage_model(texts, traffic_likelihood, label_threshold=3, target_recall=0.95, validation_fraction=0.2, seed=0):
+    # Posts rated >= label_threshold by the LLM count as relevant.
+    # The forwarding threshold is picked on a held-out split to reach target_recall.
+    texts = list(pd.Series(texts, dtype=object).fillna(""))
+    labels = (np.asarray(traffic_likelihood) >= label_threshold).astype(np.float64)
+    rng = np.random.default_rng(seed)
+    validation = rng.random(len(texts)) < validation_fraction
+    train_texts = [text for text, held_out in zip(texts, validation) if not held_out]
+    idf = (np.log((1 + len(train_texts)) / (1 + document_frequencies(train_texts))) + 1).astype(np.float32)
+    features = triage_features(texts, idf)
+    weights, bias = _fit_logistic_regression(features[~validation], labels[~validation])
+    model = {"weights": weights, "bias": bias, "idf": idf, "threshold": 0.5}
+    scores = features[validation] @ weights + bias
+    model["threshold"] = threshold_for_recall(scores, labels[validation], target_recall)
+    return model
+
+
+def threshold_for_recall(scores, labels, target_recall=0.95):
+    # Highest score threshold that still keeps target_recall of the positives
+    positive_scores = np.sort(np.asarray(scores)[np.asarray(labels) == 1])
+    if len(positive_scores) == 0:
+        return float("-inf")
+    return float(positive_scores[int(np.floor((1 - target_recall) * len(positive_scores)))])
+
+
+def save_triage_model(model, path):
+    np.savez(path, weights=model["weights"], bias=model["bias"], idf=model["idf"], threshold=model["threshold"])
+
+
+def load_triage_model(path):
+    data = np.load(path)
+    return {"weights": data["weights"], "bias": float(data["bias"]), "idf": data["idf"], "threshold": float(data["threshold"])}
+
+
+def score_posts(model, texts, batch_size=20_000):
+    # Decision scores in vectorized batches, higher means more likely to be about trafficking
+    texts = list(pd.Series(texts, dtype=object).fillna(""))
+    scores = np.empty(len(texts), dtype=np.float32)
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        scores[start:start + batch_size] = triage_features(batch, model["idf"]) @ model["weights"] + model["bias"]
+    return scores
+
+
+def select_for_llm(scores, threshold, calibration_rate=0.02, seed=0):
+    # Forward everything above threshold plus a random calibration sample of the rest,
+    # so recall can keep being measured on LLM labels in production
+    above = np.asarray(scores) >= threshold
+    calibration = ~above & (np.random.default_rng(seed).random(len(above)) < calibration_rate)
+    return above | calibration, calibration
+
+
+def evaluate_triage(model, texts, traffic_likelihood, label_threshold=3, calibration_rate=0.02):
+    labels = np.asarray(traffic_likelihood) >= label_threshold
+    forward, calibration = select_for_llm(score_posts(model, texts), model["threshold"], calibration_rate)
+    return {
+        "posts": len(labels),
+        "relevant_posts": int(labels.sum()),
+        "forwarded_to_llm": int(forward.sum()),
+        "calibration_sample": int(calibration.sum()),
+        "recall": float((forward & labels).sum() / max(labels.sum(), 1)),
+        "llm_call_reduction": float(1 - forward.mean()) if len(labels) else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the local triage model in front of the LLM translation step")
+    parser.add_argument("--posts", default="translated_posts.parquet")
+    parser.add_argument("--out", default="../data/triage_model.npz", help="explore.py reads data/triage_model.npz")
+    args = parser.parse_args()
+
+    # Train on the labelled parquet; the original (untranslated) text comes from Activity
+    extra_data = pd.read_parquet(args.posts, columns=["id", "traffic_likelihood"])
+    activities = extract_data_with_query("SELECT id, content FROM Activity")
+    labelled = pd.merge(extra_data, activities, on="id", how="inner")
+    rng = np.random.default_rng(1)
+    test = rng.random(len(labelled)) < 0.2
+    model = train_triage_model(labelled["content"][~test], labelled["traffic_likelihood"][~test])
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    save_triage_model(model, args.out)
+    print(evaluate_triage(model, labelled["content"][test], labelled["traffic_likelihood"][test]))
@@ -5,13 +5,7 @@ from copy import copy
 
 # Third Party
 import numpy as np
-import networkx as nx
-import matplotlib.pyplot as plt
-from matplotlib.path import Path
-from matplotlib.patches import PathPatch
-from matplotlib import cm
-from scipy.interpolate import splprep, splev
-from scipy.spatial import ConvexHull
+# networkx, matplotlib and scipy are imported inside the functions that draw, so importing this module is cheap
 
 
 ##################
@@ -35,6 +29,8 @@ def _inter_community_edges(G, partition):
 
 
 def _position_communities(G, partition, **kwargs):
+    import networkx as nx
+
     hypergraph = nx.Graph()
     hypergraph.add_nodes_from(set(partition))
 
@@ -53,6 +49,8 @@ def _position_communities(G, partition, **kwargs):
 
 
 def _position_nodes(G, partition, **kwargs):
+    import networkx as nx
+
     communities = defaultdict(list)
     for node, community in enumerate(partition):
         communities[community].append(node)
@@ -105,6 +103,8 @@ def _node_coordinates(nodes):
 
 
 def _convex_hull_vertices(node_coordinates, community):
+    from scipy.spatial import ConvexHull
+
     points = np.array(node_coordinates[list(community)])
     
     # Handle cases with fewer than 3 points
@@ -194,6 +194,10 @@ def _scale_convex_hull(vertices, offset):
 
 
 def _community_patch(vertices):
+    from matplotlib.patches import PathPatch
+    from matplotlib.path import Path
+    from scipy.interpolate import splev, splprep
+
     vertices = _scale_convex_hull(vertices, 1) # TODO: Make offset dynamic
     tck, u = splprep(vertices.T, u=None, s=0.0, per=1)
     u_new = np.linspace(u.min(), u.max(), 1000)
@@ -229,6 +233,10 @@ def draw_community_patches(nodes, communities, axes):
 
 
 def draw_communities(adj_matrix, communities, dark=False, filename=None, dpi=None, seed=1):
+    import matplotlib.pyplot as plt
+    import networkx as nx
+    from matplotlib import cm
+
     np.random.seed(seed)
     random.seed(seed)
 